@@ -1,55 +1,196 @@
+import argparse
 import asyncio
 import contextlib
+import os
+import time
+from typing import Optional
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from config import BOT_TOKEN, BACKUP_EVERY, log
-from db import init_db, sqlite_checkpoint, sqlite_backup_once
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import (BOT_TOKEN, BOT_API_URL, BACKUP_EVERY, ARCHIVE_EVERY, RUN_MODE, ALLOWED_UPDATES, METRICS_HOST,
+                    METRICS_PORT, UPDATE_MAX_PENDING, WORKERS, log)
+from db import init_db, close_db, chat_flush_loop, flush_chats, sqlite_checkpoint
+from backup import run_backup
+from archive import run_archive
 from handlers import setup_all
-from func_logger import setup_logging # Инициализация логгера
+from handlers.common import album_collector, card_refresher
+from outbound import OutboundMiddleware, scheduler as outbound_scheduler
+from middlewares import update_scheduler
+from shutdown import ShutdownCoordinator
+import metrics
+import broadcasts
+from digest import digest_buffer
+from dedup import dedup_flush_loop, dedup_store
+from webhook import run_webhook
+from update_queue import UpdateQueue
+from workers import WorkerPool, consume_queue, ingest_polling, stop_event
+from func_logger import setup_logging, stop_logging  # логи через очередь и фоновый поток
 
 
 
 async def periodic_backup_task():
     while True:
         try:
-            await sqlite_checkpoint()
-            path = await sqlite_backup_once()
-            log.info("[backup] %s создан", path)
+            await run_backup()
         except Exception:
             log.exception("[backup] ошибка")
         await asyncio.sleep(BACKUP_EVERY)
 
-async def main():
+async def periodic_archive_task():
+    while True:
+        try:
+            await run_archive()
+        except Exception:
+            log.exception("[archive] ошибка")
+        await asyncio.sleep(ARCHIVE_EVERY)
+
+async def run_polling(bot: Bot, dp: Dispatcher) -> None:
+    """Long polling до SIGTERM/SIGINT. Сессию бота не закрывает: она нужна дообработке при остановке."""
+    await bot.delete_webhook(drop_pending_updates=False)
+    stop = stop_event()
+    # backpressure: при UPDATE_MAX_PENDING задач в памяти polling ждёт, апдейты копятся у Telegram
+    polling = asyncio.create_task(dp.start_polling(
+        bot, allowed_updates=ALLOWED_UPDATES, tasks_concurrency_limit=UPDATE_MAX_PENDING,
+        handle_signals=False, close_bot_session=False,
+    ))
+    stopper = asyncio.create_task(stop.wait())
+    await asyncio.wait({polling, stopper}, return_when=asyncio.FIRST_COMPLETED)
+    stopper.cancel()
+    if not polling.done():
+        await dp.stop_polling()  # новые апдейты больше не забираем; начатые дорабатывает shutdown
+    await polling
+
+
+async def drain_updates(shutdown: ShutdownCoordinator) -> str:
+    done, abandoned = await update_scheduler.drain(shutdown.remaining())
+    if abandoned:
+        shutdown.failed += 1
+        log.warning("[shutdown] не дождались %s апдейтов: %s%s", len(abandoned), abandoned[:50],
+                    " …" if len(abandoned) > 50 else "")
+    return f"дождались {done}, брошено {len(abandoned)}"
+
+
+async def flush_db() -> str:
+    chats = await flush_chats()
+    keys = await dedup_store.flush()  # обработанные update_id — в БД до закрытия пула
+    await sqlite_checkpoint()  # WAL — в основной файл: следующий старт и бэкап без долгого replay
+    return f"чатов {chats}, update_id {keys}, WAL checkpoint"
+
+
+async def run_ingest(bot: Bot, dp: Dispatcher) -> None:
+    """WORKERS > 0: этот процесс только принимает апдейты в очередь, разбирают их воркеры."""
+    queue = UpdateQueue()
+    await queue.open()
+    moved = await queue.reshard()
+    if moved:
+        log.info("[workers] число шардов сменилось: переложено апдейтов %s", moved)
+    await queue.clear_workers()
+    pool = WorkerPool(WORKERS)
+    await pool.start()
+    try:
+        if RUN_MODE == "webhook":
+            await run_webhook(dp, bot, queue=queue)
+        else:
+            await bot.delete_webhook(drop_pending_updates=False)
+            await ingest_polling(bot, queue, stop_event())
+    finally:
+        await pool.stop()
+        await queue.close()
+
+
+async def run_worker(bot: Bot, dp: Dispatcher, worker: int, shards: int) -> None:
+    """Воркер шарда: обычный Dispatcher, апдейты — из очереди вместо Telegram."""
+    queue = UpdateQueue(shards=shards)
+    await queue.open()
+    try:
+        await queue.register_worker(worker, os.getpid(), time.time())
+        await dp.emit_startup(bot=bot, dispatcher=dp)
+        try:
+            await consume_queue(dp, bot, queue, worker, stop_event())
+        finally:
+            await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    finally:
+        await queue.close()
+
+
+async def main(worker: Optional[int] = None, shards: int = WORKERS):
+    log = setup_logging()  # до всего остального: весь вывод — через очередь
     await init_db()
 
-    bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+    session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None
+    bot = Bot(BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    bot.session.middleware(OutboundMiddleware(outbound_scheduler))  # все отправки/правки — через лимиты
+    bot.session.middleware(metrics.ApiMetricsMiddleware())  # внутри лимитов: каждая попытка и retry_after
     dp = Dispatcher()
 
-    await bot.delete_webhook(drop_pending_updates=False)
-    setup_all(dp, bot)
-
-    backup_task = asyncio.create_task(periodic_backup_task())
+    ingest_only = worker is None and WORKERS > 0
+    # бэкап и архив — один раз на бота: в процессе приёма (или единственном процессе), не в воркерах
+    background = [] if worker is not None else [
+        asyncio.create_task(periodic_backup_task()),
+        asyncio.create_task(periodic_archive_task()),
+    ]
+    chat_flush_task = asyncio.create_task(chat_flush_loop())
+    dedup_task = asyncio.create_task(dedup_flush_loop())
+    metrics_port = METRICS_PORT + 1 + worker if METRICS_PORT and worker is not None else METRICS_PORT
+    metrics_runner = await metrics.start_server(METRICS_HOST, metrics_port) if metrics_port else None
 
     try:
+        if ingest_only:
+            log.info("Bot starting: приём апдейтов, mode=%s, воркеров %s", RUN_MODE, WORKERS)
+            await run_ingest(bot, dp)
+            return
+
+        loaded = await dedup_store.load()  # обработанное до рестарта не повторится
+        log.info("[dedup] загружено ключей: %s", loaded)
         me = await bot.get_me()
-        log = setup_logging()
-        log.info("Bot starting as @%s (id=%s)", me.username, me.id)
+        setup_all(dp, bot, me)  # профиль бота резолвится один раз и уходит в middleware
+        if not worker:
+            await broadcasts.resume_unfinished(bot)  # в многопроцессном режиме — только воркер 0
 
-        await dp.start_polling(
-            bot,
-            allowed_updates=["message", "chat_member", "my_chat_member", "callback_query"],
-        )
+        if worker is not None:
+            log.info("Bot starting as @%s (id=%s), воркер %s/%s", me.username, me.id, worker, shards)
+            await run_worker(bot, dp, worker, shards)
+        elif RUN_MODE == "webhook":
+            log.info("Bot starting as @%s (id=%s), mode=%s", me.username, me.id, RUN_MODE)
+            await run_webhook(dp, bot)
+        else:
+            log.info("Bot starting as @%s (id=%s), mode=%s", me.username, me.id, RUN_MODE)
+            await run_polling(bot, dp)
     finally:
-        # аккуратно гасим фоновые задачи
-        backup_task.cancel()
-        with contextlib.suppress(asyncio.CancelledError):
-            await backup_task
+        # приём остановлен: дорабатываем начатое и сбрасываем буферы в пределах SHUTDOWN_TIMEOUT
+        shutdown = ShutdownCoordinator()
+        shutdown.start()
+        await shutdown.step("апдейты", drain_updates(shutdown), grace=2.0)
+        await shutdown.step("рассылки", broadcasts.stop_all())  # задания в БД, докачаются после рестарта
+        await shutdown.step("альбомы", album_collector.drain())  # начатые альбомы — до перерисовок карточек
+        await shutdown.step("дайджесты", digest_buffer.drain())  # накопленное — менеджерам, а не в никуда
+        await shutdown.step("карточки", card_refresher.drain())
+        await shutdown.step("исходящие", outbound_scheduler.drain())
+        for task in (*background, chat_flush_task, dedup_task):
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+        await outbound_scheduler.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
         # закрываем HTTP-сессию бота (иначе будут Unclosed client session/connector)
         await bot.session.close()
 
+        await shutdown.step("БД", flush_db())
+        # закрываем пул соединений с БД
+        await close_db()
+        shutdown.log_summary()
+        stop_logging()
+
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--worker", type=int, default=None, help="номер шарда (запускает WorkerPool)")
+    ap.add_argument("--shards", type=int, default=WORKERS)
+    args = ap.parse_args()
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.worker, args.shards))
     except (KeyboardInterrupt, SystemExit):
         log.info("Bot stopped")
@@ -0,0 +1,65 @@
+# archive.py — перенос давно закрытых заявок в холодный архив (ARCHIVE_DB_PATH)
+#
+# Рабочие invoices / invoice_events / invoice_cards держат только живые и недавно закрытые
+# заявки: меньше индексы, быстрее запросы по статусу, меньше каждый бэкап.
+# Архив — отдельный файл, подключённый к соединениям пула как схема archive;
+# db.get_invoice / db.list_invoice_events читают его, если заявки нет в рабочих таблицах.
+import asyncio
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from backup import snapshot
+from config import (
+    ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH, ARCHIVE_BATCH_SLEEP, ARCHIVE_DB_PATH, BACKUP_DIR, log,
+)
+from db import archive_done_invoices, reclaim_free_pages
+
+_lock = asyncio.Lock()  # периодический проход и /db_archive run не пересекаются
+
+
+@dataclass
+class ArchiveResult:
+    moved: int
+    batches: int
+    duration_ms: int
+
+
+async def run_archive(after_days: float = ARCHIVE_AFTER_DAYS, batch: int = ARCHIVE_BATCH,
+                      batch_sleep: float = ARCHIVE_BATCH_SLEEP) -> ArchiveResult:
+    """
+    Перенести заявки, закрытые (DONE) дольше after_days назад, пачками по batch.
+    Между пачками писатель свободен: хендлеры не ждут весь проход. Освободившееся место
+    возвращается incremental_vacuum, так что рабочий файл и его бэкапы действительно уменьшаются.
+    Если что-то перенесено — обновляется копия архива в BACKUP_DIR (сам архив в обычные бэкапы не входит).
+    """
+    if not ARCHIVE_DB_PATH or after_days <= 0:
+        return ArchiveResult(0, 0, 0)
+    async with _lock:
+        t0 = time.perf_counter()
+        cutoff = int(time.time() - after_days * 86400)
+        moved = batches = 0
+        after_id = 0
+        while True:
+            n, last_id = await archive_done_invoices(cutoff, after_id, batch)
+            if last_id is None:
+                break
+            moved += n
+            batches += 1
+            after_id = last_id
+            await asyncio.sleep(batch_sleep)
+
+        # освобождённые страницы — обратно ОС теми же короткими шагами (auto_vacuum=INCREMENTAL;
+        # в старом файле без него reclaim сразу возвращает 0, и страницы ждут /db_archive vacuum)
+        if moved:
+            while await reclaim_free_pages(batch * 16):
+                await asyncio.sleep(batch_sleep)
+
+        if moved:
+            bdir = Path(BACKUP_DIR)
+            bdir.mkdir(parents=True, exist_ok=True)
+            await snapshot(ARCHIVE_DB_PATH, bdir / "archive.sqlite")
+        duration_ms = int((time.perf_counter() - t0) * 1000)
+        if moved:
+            log.info("[archive] перенесено заявок: %s (%s пачек, %s мс)", moved, batches, duration_ms)
+        return ArchiveResult(moved, batches, duration_ms)
@@ -0,0 +1,142 @@
+# backup.py — онлайн-бэкапы SQLite: постраничное копирование, проверка, ротация
+import asyncio
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from config import (
+    BACKUP_DIR, BACKUP_KEEP_DAILY, BACKUP_KEEP_HOURLY, BACKUP_KEEP_WEEKLY,
+    BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP, DB_PATH, log,
+)
+from db import record_backup_run
+
+_TS_FORMAT = "%Y%m%d_%H%M%S"
+_lock = asyncio.Lock()  # периодический бэкап и /db_backup не пересекаются
+
+
+@dataclass
+class BackupResult:
+    path: Path
+    size_bytes: int
+    duration_ms: int
+    pages: int
+    removed: list[Path]
+
+
+def _copy(src_path: str, dst_path: Path, pages_per_step: int, step_sleep: float) -> int:
+    """
+    Online backup API: копируем по pages_per_step страниц, между шагами отдаём блокировку.
+    Источник держит один читающий снапшот (WAL), поэтому копия согласована,
+    а запись в основную БД не ждёт и не перезапускает бэкап.
+    """
+    src = sqlite3.connect(f"{Path(src_path).resolve().as_uri()}?mode=ro", uri=True, isolation_level=None)
+    dst = sqlite3.connect(dst_path)
+    pages = 0
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+
+        def progress(status, remaining, total):
+            nonlocal pages
+            pages = total
+
+        src.backup(dst, pages=pages_per_step, progress=progress, sleep=step_sleep)
+        src.execute("COMMIT")
+        # копия — самостоятельный файл: без WAL проверка и восстановление не оставляют -wal/-shm
+        # рядом с .part (после переименования они остались бы сиротами)
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+    return pages
+
+
+def _verify(path: Path) -> None:
+    conn = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise RuntimeError(f"integrity_check: {result}")
+
+
+async def snapshot(src_path: str, dst: Path) -> int:
+    """Согласованная копия файла БД в dst (через .part + integrity_check); возвращает число страниц."""
+    tmp = dst.with_suffix(".part")
+    try:
+        pages = await asyncio.to_thread(_copy, src_path, tmp, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP)
+        await asyncio.to_thread(_verify, tmp)
+        tmp.replace(dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return pages
+
+
+def _backup_ts(path: Path) -> Optional[datetime]:
+    try:
+        return datetime.strptime(path.stem.removeprefix("bot_"), _TS_FORMAT)
+    except ValueError:
+        return None
+
+
+def select_retained(paths: list[Path], hourly: int = BACKUP_KEEP_HOURLY,
+                    daily: int = BACKUP_KEEP_DAILY, weekly: int = BACKUP_KEEP_WEEKLY) -> set[Path]:
+    """Ротация «дед-отец-сын»: самый свежий бэкап в каждом из последних N часов/дней/недель."""
+    dated = sorted(((ts, p) for p in paths if (ts := _backup_ts(p))), reverse=True)
+    keep: set[Path] = set()
+    for limit, key in (
+        (hourly, lambda ts: (ts.date(), ts.hour)),
+        (daily, lambda ts: ts.date()),
+        (weekly, lambda ts: ts.isocalendar()[:2]),
+    ):
+        seen = set()
+        for ts, p in dated:
+            k = key(ts)
+            if k in seen:
+                continue
+            if len(seen) >= limit:
+                break
+            seen.add(k)
+            keep.add(p)
+    return keep
+
+
+def _apply_retention(bdir: Path) -> list[Path]:
+    backups = list(bdir.glob("bot_*.sqlite"))
+    keep = select_retained(backups)
+    removed = []
+    for p in backups:
+        if p not in keep and _backup_ts(p):
+            p.unlink(missing_ok=True)
+            removed.append(p)
+    return removed
+
+
+async def run_backup() -> BackupResult:
+    """Бэкап + integrity_check + ротация; каждый запуск (и неудачный) пишется в backup_runs."""
+    async with _lock:
+        bdir = Path(BACKUP_DIR)
+        bdir.mkdir(parents=True, exist_ok=True)
+        started = time.time()
+        path = bdir / f"bot_{time.strftime(_TS_FORMAT)}.sqlite"
+        t0 = time.perf_counter()
+        try:
+            # копирование и проверка — в потоке: event loop не блокируется ни на шаг
+            pages = await snapshot(DB_PATH, path)
+        except Exception as e:
+            duration_ms = int((time.perf_counter() - t0) * 1000)
+            await record_backup_run(int(started), None, 0, duration_ms, 0, False, str(e)[:500])
+            raise
+
+        duration_ms = int((time.perf_counter() - t0) * 1000)
+        size = path.stat().st_size
+        await record_backup_run(int(started), str(path), size, duration_ms, pages, True, None)
+        removed = await asyncio.to_thread(_apply_retention, bdir)
+        log.info("[backup] %s: %s байт, %s стр., %s мс, удалено старых: %s",
+                 path, size, pages, duration_ms, len(removed))
+        return BackupResult(path, size, duration_ms, pages, removed)
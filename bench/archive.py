@@ -0,0 +1,149 @@
+# bench/archive.py — холодный архив закрытых заявок: размер рабочей БД и паузы писателя
+#
+#   python -m bench.archive [--invoices 50000] [--events 6] [--open 0.05] [--batch 200] [--legacy]
+#
+# Временная БД (боевой bot.db не трогает): N заявок за два года, почти все давно DONE.
+# Меряет до и после archive.run_archive():
+#   - размер рабочей БД (online backup копирует её целиком, со свободными страницами);
+#   - выборку DONE-страницы /invoices и поиск событий заявки;
+#   - задержку записи хендлера (set_invoice_status открытой заявки) во время прохода архиватора.
+# Проверяет, что get_invoice / list_invoice_events находят перенесённые заявки.
+# --legacy: файл БД создан до auto_vacuum=INCREMENTAL (как старый боевой bot.db без однократного
+# VACUUM) — проход должен завершиться, оставив свободные страницы в файле.
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DB_PATH"] = str(Path(_tmp.name) / "bench.db")
+os.environ["BACKUP_PATH"] = str(Path(_tmp.name) / "backups")
+
+import archive  # noqa: E402
+import db  # noqa: E402
+
+ACTIONS = ["SENT_TO_ACCOUNTING", "ACCOUNTING_REPLIED", "SWIFT_SENT", "REPORT_REQUESTED", "NOTE"]
+
+
+async def _populate(n: int, events: int, open_share: float) -> list[int]:
+    rnd = random.Random(20)
+    now = int(time.time())
+    invoices, evs, cards, open_ids = [], [], [], []
+    ev_id = 0
+    for iid in range(1, n + 1):
+        created = now - int((n - iid) / n * 730 * 86400) - 3600
+        is_open = iid > n * (1 - open_share) or rnd.random() < open_share / 10
+        invoices.append((iid, -1000000000000 - rnd.randrange(300), iid, 1000 + iid % 50, created,
+                         "SENT_TO_ACCOUNTING" if is_open else "DONE", 1))
+        for k in range(events):
+            ev_id += 1
+            evs.append((ev_id, iid, created + k * 600, 218837831, "CREATED" if k == 0 else rnd.choice(ACTIONS),
+                        "комментарий " * rnd.randrange(4) or None))
+        if not is_open:
+            ev_id += 1
+            evs.append((ev_id, iid, created + events * 600, 218837831, "DONE", None))
+        else:
+            open_ids.append(iid)
+        for manager in (218837831, 7892801404):
+            cards.append((manager, iid, manager, 100000 + iid))
+    async with db.writer() as conn:
+        await conn.executemany("INSERT INTO invoices(id, chat_id, origin_msg_id, author_id, created_ts, status, progress)"
+                               " VALUES(?,?,?,?,?,?,?)", invoices)
+        await conn.executemany("INSERT INTO invoice_events(id, invoice_id, ts, actor_id, action, note)"
+                               " VALUES(?,?,?,?,?,?)", evs)
+        await conn.executemany("INSERT INTO invoice_cards(manager_id, invoice_id, dm_chat_id, message_id)"
+                               " VALUES(?,?,?,?)", cards)
+    await db.sqlite_checkpoint()
+    return open_ids
+
+
+async def _timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1e3
+
+
+async def _queries(sample_id: int) -> tuple[float, float]:
+    done_page = await _timed(lambda: db.list_invoices_page("DONE", limit=8), 50)
+    events = await _timed(lambda: db.list_invoice_events(sample_id), 200)
+    return done_page, events
+
+
+async def _writer_lag(open_ids: list[int], stop: asyncio.Event) -> list[float]:
+    """Запись «хендлера» раз в 5 мс, пока идёт архиватор: сколько она ждёт писателя."""
+    rnd = random.Random(3)
+    lags = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await db.set_invoice_status(rnd.choice(open_ids), "SENT_TO_ACCOUNTING", 218837831, None)
+        lags.append(time.perf_counter() - t0)
+        await asyncio.sleep(0.005)
+    return lags
+
+
+def _row(label: str, st: dict, done_page: float, events: float) -> None:
+    print(f"{label:<8} {st['main']['invoices']:>9} {st['main']['invoice_events']:>9} "
+          f"{st['main']['bytes'] / 2**20:>9.1f} {st['main']['free_pages']:>10} {done_page:>10.2f} {events:>10.3f}")
+
+
+async def main(args) -> None:
+    if args.legacy:
+        # непустой файл до init_db: auto_vacuum остаётся NONE, как у БД, созданной до миграции
+        with sqlite3.connect(db.DB_PATH) as conn:
+            conn.execute("CREATE TABLE legacy_marker(x)")
+    await db.init_db()
+    try:
+        open_ids = await _populate(args.invoices, args.events, args.open)
+        print(f"заявок {args.invoices}, событий на заявку ~{args.events + 1}, открытых {len(open_ids)}")
+        print(f"{'':<8} {'заявок':>9} {'событий':>9} {'БД, МБ':>9} {'своб. стр.':>10} "
+              f"{'DONE, мс':>10} {'события, мс':>10}")
+        st = await db.archive_stats()
+        _row("до", st, *await _queries(1))
+
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(_writer_lag(open_ids, stop))
+        # зависший проход (например, бесконечный reclaim) — ошибка бенча, а не вечное ожидание
+        res = await asyncio.wait_for(archive.run_archive(after_days=args.days, batch=args.batch), timeout=300)
+        stop.set()
+        lags = sorted(await lag_task)
+
+        await db.sqlite_checkpoint()
+        st = await db.archive_stats()
+        _row("после", st, *await _queries(1))
+        print(f"архив: {st['archive']['invoices']} заявок, {st['archive']['invoice_events']} событий, "
+              f"{st['archive']['bytes'] / 2**20:.1f} МБ; свободных страниц в рабочей БД: {st['main']['free_pages']}")
+        print(f"проход: {res.moved} заявок, {res.batches} пачек по {args.batch}, {res.duration_ms} мс")
+        if lags:
+            print(f"запись хендлера во время прохода: p50 {lags[len(lags) // 2] * 1e3:.2f} мс, "
+                  f"p99 {lags[int(len(lags) * 0.99) - 1] * 1e3:.2f} мс, max {lags[-1] * 1e3:.2f} мс ({len(lags)} записей)")
+
+        inv = await db.get_invoice(1)
+        events = await db.list_invoice_events(1)
+        assert inv is not None and inv[5] == "DONE" and events, "перенесённая заявка не находится"
+        assert await db.get_invoice(open_ids[-1]) is not None
+        assert not await db.set_invoice_status(1, "NEW", 218837831, "поздний комментарий")
+        print("get_invoice / list_invoice_events по архиву: OK")
+        if args.legacy:
+            assert st["main"]["free_pages"] > 0, "без INCREMENTAL место не возвращается — страницы должны остаться"
+            print("auto_vacuum=NONE: проход завершился, свободные страницы ждут /db_archive vacuum")
+    finally:
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--invoices", type=int, default=50000)
+    ap.add_argument("--events", type=int, default=6)
+    ap.add_argument("--open", type=float, default=0.05, help="доля открытых заявок")
+    ap.add_argument("--days", type=float, default=90, help="архивировать DONE старше стольких дней")
+    ap.add_argument("--batch", type=int, default=200)
+    ap.add_argument("--legacy", action="store_true", help="БД без auto_vacuum=INCREMENTAL (до однократного VACUUM)")
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,315 @@
+# bench/cache_consistency.py — write-through кэш горячих таблиц никогда не расходится с БД
+#
+#   python -m bench.cache_consistency [--rounds 20] [--tasks 16] [--ops 40] [--managers 40] [--seed 11]
+#
+# Временная БД (боевой bot.db не трогает), маленький CACHE_MAXSIZE и короткий CACHE_TTL, чтобы
+# вытеснение и истечение срабатывали на каждом шаге. Все четыре кэша db.py: manager_selection,
+# manager_mode, start_msg, manager_digest. Сценарии:
+#   - запись -> чтение: get_* сразу после set_* возвращает записанное (и оно же в БД);
+#   - медленное чтение-промах против записи: чтение прочитало старое значение и «застряло» до fill(),
+#     в это время прошла запись — fill() не должен положить в кэш устаревшее (writes_seen);
+#   - запись, упавшая в SQL: транзакция откатилась, ключ сброшен, get_* возвращает значение из БД;
+#   - вытеснение по LRU и по TTL: вытесненные ключи читаются из БД и совпадают с ней;
+#   - случайная конкурентная нагрузка с задержками чтений и сбоями записей: после каждого раунда
+#     всё, что лежит в кэше, совпадает с БД.
+# Заодно — идемпотентность кнопок заявки (set_invoice_status(only_if_changed=True)): повторные
+# нажатия не пишут событий, а MARK_SENT / REQUEST_REPORT по закрытой заявке её не переоткрывают.
+# Задержки и сбои вносятся обёртками над db.reader / db.writer (SQL и кэш — настоящие).
+# Выходит с ошибкой при первом расхождении.
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DB_PATH"] = str(Path(_tmp.name) / "bench.db")
+os.environ["BACKUP_PATH"] = str(Path(_tmp.name) / "backups")
+os.environ["ARCHIVE_DB_PATH"] = ""
+os.environ["CACHE_MAXSIZE"] = "8"
+os.environ["CACHE_TTL"] = "0.3"
+
+import db  # noqa: E402
+from cache import MISSING  # noqa: E402
+
+CHATS = [-1001000000000 - i for i in range(5)]
+
+
+class Faults:
+    """Что обёртки делают с чтениями и записями db.py."""
+    read_delay = 0.0   # пауза после SELECT, до fill() (случайная до этой величины)
+    exact_delay = False
+    fail_rate = 0.0    # доля записей, падающих внутри транзакции
+
+
+faults = Faults()
+rnd = random.Random()
+_orig_reader, _orig_writer = db.reader, db.writer
+
+
+@contextlib.asynccontextmanager
+async def slow_reader(db_path: str = db.DB_PATH):
+    async with _orig_reader(db_path) as conn:
+        yield conn
+    if faults.read_delay:
+        # строка уже прочитана, значение в кэш ещё не положено — окно гонки с записью
+        await asyncio.sleep(faults.read_delay if faults.exact_delay else rnd.uniform(0, faults.read_delay))
+
+
+@contextlib.asynccontextmanager
+async def flaky_writer(db_path: str = db.DB_PATH):
+    async with _orig_writer(db_path) as conn:
+        yield conn
+        if faults.fail_rate and rnd.random() < faults.fail_rate:
+            raise sqlite3.OperationalError("injected write failure")  # до commit: пул откатит транзакцию
+
+
+db.reader, db.writer = slow_reader, flaky_writer
+
+
+class Family:
+    """Один кэш: как читать через db.py, как читать БД напрямую и как сгенерировать запись."""
+
+    def __init__(self, name, cache, get, sql, row, writes):
+        self.name, self.cache, self.get, self.sql, self.row, self.writes = name, cache, get, sql, row, writes
+
+    def truth(self, conn: sqlite3.Connection, manager_id: int):
+        r = conn.execute(self.sql, (manager_id,)).fetchone()
+        return self.row(r) if r else None
+
+    async def write(self, manager_id: int, invoices: list[int]):
+        """Случайная запись; возвращает ожидаемое значение после неё."""
+        return await rnd.choice(self.writes)(manager_id, invoices)
+
+
+async def _select(m, _):
+    chat = rnd.choice(CHATS)
+    await db.set_selection(m, chat)
+    return chat
+
+
+async def _select_many(m, _):
+    chat = rnd.choice(CHATS)
+    await db.set_selection_many([m], chat)
+    return chat
+
+
+async def _mode(m, invoices):
+    value = (rnd.choice(invoices), rnd.choice(["POST_FILE", "SWIFT_FILE"]))
+    await db.set_mode(m, *value)
+    return value
+
+
+async def _clear_mode(m, _):
+    await db.clear_mode(m)
+    return None
+
+
+async def _start_msg(m, _):
+    value = (rnd.randrange(1, 10**6), rnd.choice(CHATS))
+    await db.set_chat_status_msg(m, value[1], value[0])
+    return value
+
+
+async def _digest(m, _):
+    window = rnd.choice([0, 300, 600])
+    await db.set_digest(m, window)
+    return window or None
+
+
+FAMILIES = [
+    Family("manager_selection", db._selection_cache, db.get_selection,
+           "SELECT chat_id FROM manager_selection WHERE manager_id=?", lambda r: r[0], [_select, _select_many]),
+    Family("manager_mode", db._mode_cache, db.get_mode,
+           "SELECT invoice_id, action FROM manager_mode WHERE manager_id=?", tuple, [_mode, _clear_mode]),
+    Family("start_msg", db._start_msg_cache, db.get_chat_status_msg,
+           "SELECT msg_id, chat_id FROM start_msg WHERE manager_id=?", tuple, [_start_msg]),
+    Family("manager_digest", db._digest_cache, db.get_digest,
+           "SELECT window_sec FROM manager_digest WHERE manager_id=?", lambda r: r[0], [_digest]),
+]
+
+failures: list[str] = []
+
+
+def check(ok: bool, what: str) -> None:
+    if not ok:
+        failures.append(what)
+        print(f"  РАСХОЖДЕНИЕ: {what}")
+
+
+def diverged(conn: sqlite3.Connection) -> list[str]:
+    """Все живые записи всех кэшей против БД (без get(): счётчики и LRU не трогаем)."""
+    out = []
+    now = time.monotonic()
+    for fam in FAMILIES:
+        for key, (expires, value) in list(fam.cache._data.items()):
+            if expires >= now and value != fam.truth(conn, key):
+                out.append(f"{fam.name}[{key}]: кэш {value!r}, БД {fam.truth(conn, key)!r}")
+    return out
+
+
+async def write_then_read(conn, managers, invoices) -> None:
+    for fam in FAMILIES:
+        for m in managers:
+            expected = await fam.write(m, invoices)
+            got = await fam.get(m)
+            check(got == expected == fam.truth(conn, m), f"{fam.name}[{m}] запись->чтение: {got!r} / {expected!r}")
+
+
+async def slow_miss_vs_write(conn, managers, invoices) -> None:
+    faults.read_delay, faults.exact_delay = 0.05, True
+    try:
+        for fam in FAMILIES:
+            for m in managers[:4]:
+                await fam.write(m, invoices)
+                fam.cache.invalidate(m)                  # следующий get — промах в БД
+                reading = asyncio.create_task(fam.get(m))
+                await asyncio.sleep(0.01)                # SELECT сделан, get ждёт до fill()
+                expected = await fam.write(m, invoices)
+                await reading                            # старое значение вправе вернуть, но не закэшировать
+                cached = fam.cache._data.get(m)
+                check(cached is None or cached[1] == expected,
+                      f"{fam.name}[{m}] медленный промах перетёр запись: {cached and cached[1]!r} / {expected!r}")
+                got = await fam.get(m)
+                check(got == expected == fam.truth(conn, m), f"{fam.name}[{m}] после гонки: {got!r} / {expected!r}")
+    finally:
+        faults.read_delay, faults.exact_delay = 0.0, False
+
+
+async def failed_write(conn, managers, invoices) -> None:
+    for fam in FAMILIES:
+        for m in managers[:4]:
+            before = await fam.write(m, invoices)
+            faults.fail_rate = 1.0
+            try:
+                await fam.write(m, invoices)
+                check(False, f"{fam.name}[{m}]: внесённый сбой записи не сработал")
+            except sqlite3.OperationalError:
+                pass
+            finally:
+                faults.fail_rate = 0.0
+            check(fam.cache.get(m) is MISSING, f"{fam.name}[{m}]: после сбоя записи ключ остался в кэше")
+            got = await fam.get(m)
+            check(got == before == fam.truth(conn, m), f"{fam.name}[{m}] после сбоя: {got!r} / БД {before!r}")
+
+
+async def eviction(conn, managers, invoices) -> None:
+    for fam in FAMILIES:
+        expected = {m: await fam.write(m, invoices) for m in managers}
+        check(len(fam.cache._data) <= fam.cache.maxsize, f"{fam.name}: размер {len(fam.cache._data)} > maxsize")
+        misses = fam.cache.misses
+        for m in managers:  # большая часть вытеснена LRU -> чтение из БД
+            got = await fam.get(m)
+            check(got == expected[m] == fam.truth(conn, m), f"{fam.name}[{m}] после LRU: {got!r} / {expected[m]!r}")
+        check(fam.cache.misses - misses >= len(managers) - fam.cache.maxsize, f"{fam.name}: LRU не вытеснял")
+    await asyncio.sleep(db.CACHE_TTL + 0.05)
+    for fam in FAMILIES:
+        misses = fam.cache.misses
+        for m in managers[:fam.cache.maxsize]:
+            got = await fam.get(m)
+            check(got == fam.truth(conn, m), f"{fam.name}[{m}] после TTL: {got!r}")
+        check(fam.cache.misses - misses == fam.cache.maxsize, f"{fam.name}: записи не истекали по TTL")
+
+
+async def invoice_actions(conn, managers, invoices) -> None:
+    def state(inv_id):
+        status = conn.execute("SELECT status FROM invoices WHERE id=?", (inv_id,)).fetchone()[0]
+        events = [a for (a,) in conn.execute("SELECT action FROM invoice_events WHERE invoice_id=? ORDER BY id",
+                                             (inv_id,))]
+        return status, events
+
+    inv_id = await db.create_invoice(CHATS[1], 1, 1)
+    clicks = ["SENT_TO_ACCOUNTING", "REPORT_REQUESTED", "SENT_TO_ACCOUNTING", "DONE", "DONE", "SENT_TO_ACCOUNTING"]
+    changed = [await db.set_invoice_status(inv_id, status, 1, None, only_if_changed=True) for status in clicks]
+    status, events = state(inv_id)
+    check(changed == [True, True, False, True, False, False], f"заявка #{inv_id}: изменения по кликам {changed}")
+    check(events == ["CREATED", "SENT_TO_ACCOUNTING", "REPORT_REQUESTED", "DONE"], f"заявка #{inv_id}: события {events}")
+
+    inv_id = await db.create_invoice(CHATS[1], 2, 1)  # закрыта без промежуточных шагов: биты пустые
+    await db.set_invoice_status(inv_id, "DONE", 1, None, only_if_changed=True)
+    for click in ("SENT_TO_ACCOUNTING", "REPORT_REQUESTED"):
+        check(not await db.set_invoice_status(inv_id, click, 1, None, only_if_changed=True),
+              f"заявка #{inv_id}: {click} по закрытой заявке что-то записал")
+    status, events = state(inv_id)
+    check(status == "DONE" and events == ["CREATED", "DONE"], f"заявка #{inv_id} переоткрыта: {status}, {events}")
+
+
+async def random_load(conn, managers, invoices, rounds: int, tasks: int, ops: int) -> tuple[int, int]:
+    faults.read_delay, faults.fail_rate = 0.004, 0.1
+    done = failed = 0
+
+    async def worker():
+        nonlocal done, failed
+        for _ in range(ops):
+            fam, m = rnd.choice(FAMILIES), rnd.choice(managers)
+            op = rnd.random()
+            try:
+                if op < 0.45:
+                    await fam.write(m, invoices)
+                elif op < 0.5:
+                    fam.cache.invalidate(m)
+                else:
+                    await fam.get(m)
+                done += 1
+            except sqlite3.OperationalError:
+                failed += 1
+            await asyncio.sleep(rnd.uniform(0, 0.002))
+
+    try:
+        for r in range(rounds):
+            await asyncio.gather(*(worker() for _ in range(tasks)))
+            for d in diverged(conn):
+                check(False, f"раунд {r + 1}: {d}")
+    finally:
+        faults.read_delay, faults.fail_rate = 0.0, 0.0
+    return done, failed
+
+
+async def main(args) -> int:
+    rnd.seed(args.seed)
+    await db.init_db()
+    for chat_id in CHATS:
+        await db.upsert_chat(chat_id, f"chat {chat_id}", None, "supergroup")
+    invoices = [await db.create_invoice(CHATS[0], 1000 + i, 1) for i in range(5)]
+    managers = list(range(1, args.managers + 1))
+    conn = sqlite3.connect(db.DB_PATH)
+    try:
+        steps = [
+            ("запись -> чтение", write_then_read),
+            ("медленный промах против записи", slow_miss_vs_write),
+            ("сбой записи в SQL", failed_write),
+            ("вытеснение LRU и TTL", eviction),
+            ("кнопки заявки: повторы и закрытая заявка", invoice_actions),
+        ]
+        for title, step in steps:
+            before = len(failures)
+            t0 = time.perf_counter()
+            await step(conn, managers, invoices)
+            print(f"{title}: {'ok' if len(failures) == before else 'FAIL'} ({time.perf_counter() - t0:.2f} с)")
+        before = len(failures)
+        t0 = time.perf_counter()
+        done, failed = await random_load(conn, managers, invoices, args.rounds, args.tasks, args.ops)
+        print(f"случайная нагрузка: {'ok' if len(failures) == before else 'FAIL'} — {args.rounds} раундов, "
+              f"операций {done}, внесённых сбоев записи {failed} ({time.perf_counter() - t0:.2f} с)")
+        for name, st in db.cache_stats().items():
+            print(f"  {name}: {st}")
+    finally:
+        conn.close()
+        await db.close_db()
+    print("OK" if not failures else f"FAIL: расхождений {len(failures)}")
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=20)
+    ap.add_argument("--tasks", type=int, default=16, help="конкурентных задач в раунде")
+    ap.add_argument("--ops", type=int, default=40, help="операций на задачу за раунд")
+    ap.add_argument("--managers", type=int, default=40, help="ключей на кэш (больше CACHE_MAXSIZE=8)")
+    ap.add_argument("--seed", type=int, default=11)
+    sys.exit(asyncio.run(main(ap.parse_args())))
@@ -0,0 +1,117 @@
+# bench/chat_search.py — поиск по каталогу чатов: FTS5 (trigram) против прежних способов
+#
+#   python -m bench.chat_search [--chats 100000] [--repeat 50]
+#
+# Заполняет временную БД каталогом из N чатов (боевой bot.db не трогает) и меряет:
+#   fts     — db.search_chats (chats_fts MATCH, ранжирование по bm25);
+#   like    — прежний get_target_chats: lower(...) LIKE '%q%' полным сканом;
+#   recent  — прежний list_chats_like: 500 свежих + фильтр в Python (старые чаты не находит).
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DB_PATH"] = str(Path(_tmp.name) / "bench.db")
+
+import db  # noqa: E402
+
+WORDS = ["Логистика", "Импорт", "Экспорт", "Склад", "Бухгалтерия", "Поставки", "Таможня", "Финансы",
+         "Shipping", "Cargo", "Trade", "Supply", "Partners", "Group", "Invoice", "Office"]
+CITIES = ["Москва", "Казань", "Алматы", "Ташкент", "Dubai", "Istanbul", "Shanghai", "Riga"]
+
+# (запрос, пояснение): часть совпадает только со старыми чатами
+QUERIES = [
+    ("логист", "частое слово"),
+    ("Dubai", "латиница, средняя частота"),
+    ("Таможня Казань", "фраза из двух слов"),
+    ("chat_07", "username, старые чаты"),
+    ("#4242", "редкий номер"),
+    ("нет такого", "нет совпадений"),
+    ("ка", "короткий запрос (без FTS)"),
+]
+
+
+def _catalog(n: int) -> list[tuple]:
+    rnd = random.Random(7)
+    now = int(time.time())
+    rows = []
+    for i in range(n):
+        title = f"{rnd.choice(WORDS)} {rnd.choice(WORDS)} {rnd.choice(CITIES)} #{i}"
+        username = f"chat_{i:06d}" if rnd.random() < 0.3 else None
+        rows.append((-1000000000000 - i, title, username, "supergroup", now - (n - i) * 60))
+    return rows
+
+
+async def _old_like(q: str) -> list:
+    q_like = f"%{q.lower()}%"
+    async with db.reader() as conn:
+        cur = await conn.execute(
+            """
+            SELECT chat_id, title, username FROM chats
+            WHERE lower(coalesce(title,'')) LIKE ? OR lower(coalesce(username,'')) LIKE ?
+            ORDER BY last_seen_ts DESC LIMIT 100
+            """,
+            (q_like, q_like),
+        )
+        return await cur.fetchall()
+
+
+async def _old_recent(q: str) -> list:
+    async with db.reader() as conn:
+        cur = await conn.execute("SELECT chat_id, title, username FROM chats ORDER BY last_seen_ts DESC LIMIT 500")
+        rows = await cur.fetchall()
+    needle = q.casefold()
+    return [r for r in rows if needle in (r[1] or "").casefold() or needle in (r[2] or "").casefold()]
+
+
+async def _measure(fn, q: str, repeat: int) -> tuple[float, float, int]:
+    samples = []
+    found = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        found = len(await fn(q))
+        samples.append((time.perf_counter() - t0) * 1e3)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1], found
+
+
+async def main(args) -> None:
+    await db.init_db()
+    try:
+        rows = _catalog(args.chats)
+        t0 = time.perf_counter()
+        async with db.writer() as conn:
+            await conn.executemany(db.UPSERT_CHAT_SQL, rows)
+        print(f"каталог: {args.chats} чатов, вставка с триггерами FTS за {time.perf_counter() - t0:.2f}s")
+
+        # повторный UPSERT активности с теми же названиями — индекс не должен переписываться
+        t0 = time.perf_counter()
+        async with db.writer() as conn:
+            await conn.executemany(db.UPSERT_CHAT_SQL, [r[:4] + (r[4] + 1,) for r in rows[-5000:]])
+        print(f"5000 UPSERT активности без смены названия: {(time.perf_counter() - t0) * 1e3:.1f} ms\n")
+
+        methods = [
+            ("fts", lambda q: db.search_chats(q, limit=100)),
+            ("like", _old_like),
+            ("recent", _old_recent),
+        ]
+        print(f"{'запрос':<16} {'метод':<7} {'p50, ms':>9} {'p99, ms':>9} {'найдено':>8}")
+        for q, note in QUERIES:
+            for name, fn in methods:
+                p50, p99, found = await _measure(fn, q, args.repeat)
+                print(f"{q:<16} {name:<7} {p50:9.2f} {p99:9.2f} {found:8}")
+            print(f"{'':<16} ({note})")
+    finally:
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=50)
+    asyncio.run(main(ap.parse_args()))
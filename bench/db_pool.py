@@ -0,0 +1,64 @@
+# bench/db_pool.py — задержка хелперов db.py: connect-per-call против пула соединений
+#
+#   python -m bench.db_pool [--calls 2000]
+#
+# Работает на временной БД, боевой bot.db не трогает. Кэш горячих таблиц (TTLCache в db.py)
+# выключен (CACHE_TTL=0): иначе get_selection отвечает из памяти и не меряет соединения вовсе.
+# search_chats и get_invoice не кэшируются и так.
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DB_PATH"] = str(Path(_tmp.name) / "bench.db")
+os.environ["CACHE_TTL"] = "0"  # каждое чтение — в БД
+
+import db  # noqa: E402  (DB_PATH и CACHE_TTL должны быть выставлены до импорта)
+
+
+async def _measure(label: str, calls: int, fn) -> None:
+    samples = []
+    for i in range(calls):
+        t0 = time.perf_counter()
+        await fn(i)
+        samples.append((time.perf_counter() - t0) * 1e6)
+    samples.sort()
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    print(f"  {label:<28} mean={statistics.fmean(samples):8.1f}µs  p50={samples[len(samples) // 2]:8.1f}µs  p99={p99:8.1f}µs")
+
+
+async def _round(title: str, calls: int) -> None:
+    print(title)
+    await _measure("get_selection (read)", calls, lambda i: db.get_selection(1000 + i % 10))
+    await _measure("set_selection (write)", calls, lambda i: db.set_selection(1000 + i % 10, -100 - i % 50))
+    await _measure("get_invoice (read)", calls, lambda i: db.get_invoice(1 + i % 20))
+    await _measure("search_chats (read)", calls, lambda i: db.search_chats(f"chat {i % 20}", limit=10))
+
+
+async def main(calls: int) -> None:
+    await db.init_db()
+    for i in range(20):
+        await db.upsert_chat(-100 - i, f"chat {i}", None, "supergroup")
+        await db.create_invoice(-100 - i, i + 1, 1)
+
+    # пул закрыт -> хелперы открывают соединение на каждый вызов (старое поведение)
+    await db.close_db()
+    await _round("connect-per-call:", calls)
+
+    await db.init_db()
+    try:
+        await _round("pooled:", calls)
+        hits = sum(st["hits"] for st in db.cache_stats().values())
+        assert not hits, f"кэш отвечал {hits} раз — замер не про соединения"
+    finally:
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=2000)
+    asyncio.run(main(ap.parse_args().calls))
@@ -0,0 +1,119 @@
+# bench/fake_api.py — локальный фейковый Bot API для бенчмарков
+#
+# aiohttp-сервер, который понимает /bot<token>/<method>: записывает вызовы,
+# добавляет настраиваемую задержку и отвечает правдоподобными объектами.
+# getUpdates раздаёт апдейты из очереди (для сравнения с long polling).
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+BOT_TOKEN = "123456:BENCH"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.calls: Counter = Counter()
+        self.updates: asyncio.Queue = asyncio.Queue()
+        # как у Telegram: отданный апдейт подтверждён, только когда следующий getUpdates
+        # пришёл с offset больше его update_id; до этого он отдаётся снова
+        self.unconfirmed: list[dict] = []
+        self.confirmed: list[int] = []
+        self._message_id = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def make_bot(self, **kwargs) -> Bot:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.base_url))
+        return Bot(BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"), **kwargs)
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def push_updates(self, updates: list[dict]) -> None:
+        for update in updates:
+            self.updates.put_nowait(update)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(v for k, v in self.calls.items() if k != "getUpdates")
+
+    def _message(self, chat_id) -> dict:
+        self._message_id += 1
+        chat_id = int(chat_id) if str(chat_id).lstrip("-").isdigit() else -1
+        chat_type = "private" if chat_id > 0 else "supergroup"
+        return {"message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": chat_type, "title": None if chat_id > 0 else "bench"}}
+
+    async def _get_updates(self, form) -> list:
+        limit = int(form.get("limit") or 100)
+        timeout = min(float(form.get("timeout") or 0), 1.0)
+        offset = int(form.get("offset") or 0)
+        if offset:
+            self.confirmed.extend(u["update_id"] for u in self.unconfirmed if u["update_id"] < offset)
+            self.unconfirmed = [u for u in self.unconfirmed if u["update_id"] >= offset]
+        if self.unconfirmed:
+            return self.unconfirmed[:limit]
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self.updates.get(), timeout=timeout or 0.01))
+        except asyncio.TimeoutError:
+            return []
+        while len(batch) < limit and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        self.unconfirmed = batch
+        return batch
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        self.calls[method] += 1
+        if method != "getUpdates" and self.latency:
+            await asyncio.sleep(self.latency)
+
+        m = method.lower()
+        if m == "getme":
+            result = BOT_USER
+        elif m == "getupdates":
+            result = await self._get_updates(form)
+        elif m == "copymessage":
+            self._message_id += 1
+            result = {"message_id": self._message_id}
+        elif m == "sendmediagroup":
+            result = [self._message(form.get("chat_id"))]
+        elif m.startswith("send"):
+            result = self._message(form.get("chat_id"))
+        elif m == "getchat":
+            result = {"id": int(form.get("chat_id") or 0), "type": "supergroup", "title": "bench",
+                      "accent_color_id": 0, "max_reaction_count": 11,
+                      "accepted_gift_types": {"unlimited_gifts": False, "limited_gifts": False,
+                                              "unique_gifts": False, "premium_subscription": False}}
+        elif m == "getchatmember":
+            result = {"status": "member", "user": BOT_USER}
+        else:
+            result = True
+        return web.Response(text=json.dumps({"ok": True, "result": result}), content_type="application/json")
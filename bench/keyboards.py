@@ -0,0 +1,101 @@
+# bench/keyboards.py — стоимость рендера клавиатуры карточки заявки: раньше и сейчас
+#
+#   python -m bench.keyboards [--renders 20000] [--managers 2]
+#
+#   legacy   — прежний build_invoice_kb: ряды собираются заново, pydantic-валидация каждой кнопки;
+#   template — kb.invoice_kb без кэша: копии заранее провалидированных кнопок раскладки с новым id;
+#   cached   — kb.invoice_kb с кэшем.
+# Выделения экономит только кэш: без него каждый рендер всё равно создаёт по модели на кнопку
+# (у каждой заявки свой callback_data), и шаблон стоит по памяти столько же, сколько прежний код.
+# Поток рендеров — как в жизни: каждая заявка проходит несколько состояний, и каждое
+# состояние рендерится несколько раз (карточки всем менеджерам, перерисовки после кликов).
+# Время на рендер и байты, выделенные на рендер (tracemalloc, с учётом освобождённого).
+import argparse
+import random
+import time
+import tracemalloc
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from kb import INVOICE_FLAGS, invoice_kb, invoice_layout_key
+
+
+def legacy_kb(inv_id: int, st: dict) -> InlineKeyboardMarkup:
+    """Копия прежнего handlers/common.build_invoice_kb (без чтения состояния из БД)."""
+    rows = []
+    if not st["sent_to_accounting"]:
+        rows.append([InlineKeyboardButton(text="✅ Отправил в бух", callback_data=f"inv:{inv_id}:MARK_SENT")])
+    line = []
+    if not st["accounting_replied"]:
+        line.append(InlineKeyboardButton(text="📎 Файл в группу", callback_data=f"inv:{inv_id}:POST_FILE"))
+    if not st["swift_sent"]:
+        line.append(InlineKeyboardButton(text="📄 SWIFT", callback_data=f"inv:{inv_id}:SWIFT_FILE"))
+    if line:
+        rows.append(line)
+    if not st["report_requested"]:
+        rows.append([InlineKeyboardButton(text="📝 Запросить отчёт", callback_data=f"inv:{inv_id}:REQUEST_REPORT")])
+    rows.append([InlineKeyboardButton(text="✔ Закрыть", callback_data=f"inv:{inv_id}:DONE")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def _workload(n: int, managers: int) -> list[tuple[int, dict]]:
+    rnd = random.Random(3)
+    out = []
+    inv_id = 0
+    while len(out) < n:
+        inv_id += 1
+        mask = 0
+        order = rnd.sample(range(len(INVOICE_FLAGS)), len(INVOICE_FLAGS))
+        for step in range(rnd.randint(1, len(order) + 1)):
+            st = {flag: bool(mask & (1 << i)) for i, flag in enumerate(INVOICE_FLAGS)}
+            # карточки всем менеджерам + повторная перерисовка после клика
+            out.extend([(inv_id, st)] * (managers + rnd.randint(0, 2)))
+            if step < len(order):
+                mask |= 1 << order[step]
+    return out[:n]
+
+
+def _measure(label: str, render, work) -> float:
+    render(*work[0])  # прогрев импорта/классов
+    t0 = time.perf_counter()
+    for inv_id, st in work:
+        render(inv_id, st)
+    elapsed = time.perf_counter() - t0
+
+    tracemalloc.start()
+    total = 0
+    for inv_id, st in work:
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        kb = render(inv_id, st)
+        total += tracemalloc.get_traced_memory()[1] - start
+        del kb
+    tracemalloc.stop()
+    n = len(work)
+    print(f"{label:<8} {elapsed / n * 1e6:8.2f} мкс/рендер  {total / n:8.0f} байт/рендер (пик выделения)")
+    return total / n
+
+
+def main(args) -> None:
+    work = _workload(args.renders, args.managers)
+
+    # проверка: шаблоны дают ту же разметку, что и прежний код
+    for inv_id, st in work[:200]:
+        assert invoice_kb(inv_id, invoice_layout_key(st)).model_dump(exclude_none=True) == \
+            legacy_kb(inv_id, st).model_dump(exclude_none=True)
+
+    print(f"{args.renders} рендеров, {work[-1][0]} заявок, {args.managers} менеджера")
+    legacy = _measure("legacy", legacy_kb, work)
+    template = _measure("template", lambda i, st: invoice_kb.__wrapped__(i, invoice_layout_key(st)), work)
+    invoice_kb.cache_clear()
+    cached = _measure("cached", lambda i, st: invoice_kb(i, invoice_layout_key(st)), work)
+    print(f"кэш: {invoice_kb.cache_info()}")
+    print(f"выделения против legacy: template {template / legacy - 1:+.0%}, cached {cached / legacy - 1:+.0%} — "
+          f"экономит только кэш (повторные рендеры той же заявки и раскладки)")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--renders", type=int, default=20000)
+    ap.add_argument("--managers", type=int, default=2)
+    main(ap.parse_args())
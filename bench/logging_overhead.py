@@ -0,0 +1,119 @@
+# bench/logging_overhead.py — сколько времени event loop тратит на логирование: до и после
+#
+#   python -m bench.logging_overhead [--updates 20000] [--sink devnull|file]
+#
+# На каждый «апдейт» — типичный для бота набор записей (aiogram.event INFO
+# «Update is handled», DEBUG клиента Bot API, лог колбэка, редкие INFO/WARNING с трейсбеком).
+#   legacy     — прежняя настройка: basicConfig + DEBUG на aiogram/aiohttp, двойной INFO в колбэке;
+#   prod/text  — func_logger.setup_logging("prod"), очередь + фоновый поток;
+#   prod/json  — то же с JSON-форматом;
+#   dev/text   — профиль dev, DEBUG приложения с сэмплированием.
+# Меряется время в вызовах логгера на потоке loop и задержка тика loop (1 мс таймер).
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import func_logger
+
+_tmp = tempfile.TemporaryDirectory()
+
+
+def _legacy(sink_path: str | None) -> None:
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    handler = logging.FileHandler(sink_path, encoding="utf-8") if sink_path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(func_logger.TEXT_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    for name in ("aiogram", "aiogram.event", "aiogram.client.telegram",
+                 "aiogram.client.session.aiohttp", "aiohttp.client", "aiohttp", "aiosqlite"):
+        logging.getLogger(name).setLevel(logging.NOTSET)
+    for name in ("aiogram", "aiogram.client.telegram", "aiogram.client.session.aiohttp", "aiohttp.client"):
+        logging.getLogger(name).setLevel(logging.DEBUG)
+
+
+def _emit(i: int, legacy: bool) -> None:
+    """Записи одного апдейта."""
+    logging.getLogger("aiogram.event").info("Update id=%s is handled. Duration %d ms by bot id=%d", i, 3, 123456)
+    client = logging.getLogger("aiogram.client.session.aiohttp")
+    client.debug("Request %s: sendMessage chat_id=%s", i, -100123)
+    client.debug("Response %s: ok=%s", i, True)
+    app = logging.getLogger("support-bot")
+    if i % 8 == 0:  # колбэк по карточке
+        if legacy:
+            app.info("callback: uid=%s data=%r", 218837831, f"inv:{i}:MARK_SENT")
+            app.info("callback from %s data=%r", 218837831, f"inv:{i}:MARK_SENT")
+        else:
+            app.debug("callback: uid=%s data=%r", 218837831, f"inv:{i}:MARK_SENT")
+    if i % 10 == 0:
+        app.info("[chats] flushed %s rows", i % 97)
+    if i % 500 == 0:
+        try:
+            raise RuntimeError(f"send failed {i}")
+        except RuntimeError:
+            app.warning("notify manager %s failed", 7892801404, exc_info=True)
+
+
+async def _run(n: int, legacy: bool) -> tuple[float, float, float]:
+    """(мкс логирования на апдейт на потоке loop, p99 и max задержки тика, мс)."""
+    lags: list[float] = []
+    stop = False
+
+    async def ticker():
+        while not stop:
+            t = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - t - 0.001)
+
+    tick = asyncio.create_task(ticker())
+    spent = 0.0
+    for i in range(n):
+        t0 = time.perf_counter()
+        _emit(i, legacy)
+        spent += time.perf_counter() - t0
+        if i % 50 == 0:
+            await asyncio.sleep(0)  # даём тикеру поработать, как между апдейтами
+    stop = True
+    await tick
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    return spent / n * 1e6, p99 * 1e3, (lags[-1] if lags else 0.0) * 1e3
+
+
+def main(args) -> None:
+    sink = str(Path(_tmp.name) / "bench.log") if args.sink == "file" else None
+    # stderr -> /dev/null: в терминал ничего не сыплется, но запись/форматирование настоящие
+    devnull = open(os.devnull, "w")
+    real_stderr, sys.stderr = sys.stderr, devnull
+    results = []
+    try:
+        for label, setup, legacy in (
+            ("legacy", lambda: _legacy(sink), True),
+            ("prod/text", lambda: func_logger.setup_logging("prod", "text", sink or "", 0.05), False),
+            ("prod/json", lambda: func_logger.setup_logging("prod", "json", sink or "", 0.05), False),
+            ("dev/text", lambda: func_logger.setup_logging("dev", "text", sink or "", 0.05), False),
+        ):
+            setup()
+            results.append((label, *asyncio.run(_run(args.updates, legacy))))
+            func_logger.stop_logging()
+    finally:
+        sys.stderr = real_stderr
+        devnull.close()
+
+    print(f"{args.updates} апдейтов, вывод: {args.sink}")
+    print(f"{'режим':<10} {'мкс/апдейт':>11} {'тик p99, мс':>12} {'тик max, мс':>12}")
+    for label, us, p99, mx in results:
+        print(f"{label:<10} {us:11.1f} {p99:12.2f} {mx:12.2f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=20000)
+    ap.add_argument("--sink", choices=("devnull", "file"), default="file")
+    main(ap.parse_args())
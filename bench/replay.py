@@ -0,0 +1,272 @@
+# bench/replay.py — прогон синтетического потока апдейтов через настоящий Dispatcher
+#
+#   python -m bench.replay [--updates 5000] [--concurrency 100] [--latency 0.0]
+#                          [--mix chatter=70,tag=6,...] [--per-kind 100] [--scheduler]
+#
+# Апдейты в реалистичных пропорциях (болтовня в группах, теги, /support, /invoice с
+# документом, клики по карточкам, ЛС менеджеров) подаются в Dispatcher из
+# handlers.setup_all; Bot API — фейковый локальный сервер (bench/fake_api.py) с
+# настраиваемой задержкой. БД — временная, боевой bot.db не трогается.
+#
+# Отчёт: апдейтов/с, p50/p99 времени обработки, SQL-выражений и вызовов API на апдейт;
+# затем последовательный прогон по каждому виду апдейта (--per-kind) для разбивки.
+# Время обработки при большом --concurrency включает ожидание в общем event loop
+# (фейковый API живёт в том же процессе); для «чистой» задержки — --concurrency 1..10.
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DB_PATH"] = str(Path(_tmp.name) / "bench.db")
+
+from aiogram import Dispatcher  # noqa: E402
+from aiogram.types import User  # noqa: E402
+
+import db  # noqa: E402
+from bench.fake_api import BOT_USER, FakeBotAPI  # noqa: E402
+from config import MANAGER_IDS  # noqa: E402
+from handlers import setup_all  # noqa: E402
+from outbound import OutboundMiddleware, OutboundScheduler  # noqa: E402
+
+# доли видов апдейтов по умолчанию (в процентах; нормируются)
+DEFAULT_MIX = {
+    "chatter": 70,         # обычная переписка в группе — только индексация чата
+    "tag": 6,              # @бот в группе — пересылка менеджерам
+    "reply_to_bot": 2,     # ответ на сообщение бота
+    "support": 4,          # /support (иногда ответом на чужое сообщение)
+    "invoice": 4,          # /invoice с документом — заявка + карточки менеджерам
+    "invoice_nofile": 1,   # /invoice без файла — подсказка
+    "callback": 6,         # кнопки карточки заявки
+    "manager_text": 5,     # ЛС менеджера: ответ в выбранный чат
+    "manager_file": 1,     # ЛС менеджера: файл по заявке
+    "manager_cmd": 1,      # /invoices, /list_chats, /where
+}
+
+CALLBACK_ACTIONS = ["MARK_SENT"] * 3 + ["REQUEST_REPORT"] * 2 + ["POST_FILE", "SWIFT_FILE", "DONE"]
+MANAGER_COMMANDS = ["/invoices", "/list_chats Группа 1", "/where", "/invoices all"]
+GROUPS = 200
+
+
+class UpdateStream:
+    """Генератор сырых апдейтов (dict, как из getUpdates) с детерминированным seed."""
+
+    def __init__(self, mix: dict[str, float], seed: int = 42, start_id: int = 1):
+        self.rnd = random.Random(seed)
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.next_id = start_id
+        self.invoices = 0          # сколько /invoice с файлом уже выдано (ids заявок в свежей БД — 1..N)
+        self.managers = sorted(MANAGER_IDS)
+        self.mention = f"@{BOT_USER['username']}"
+
+    def _chat(self) -> dict:
+        n = self.rnd.randrange(GROUPS)
+        return {"id": -1001000000000 - n, "type": "supergroup", "title": f"Группа {n}"}
+
+    def _user(self) -> dict:
+        return {"id": 10_000 + self.rnd.randrange(2000), "is_bot": False, "first_name": "User"}
+
+    def _manager(self) -> dict:
+        return {"id": self.rnd.choice(self.managers), "is_bot": False, "first_name": "Manager"}
+
+    def _message(self, chat: dict, sender: dict, **extra) -> dict:
+        return {"message_id": self.next_id, "date": int(time.time()), "chat": chat, "from": sender, **extra}
+
+    def _document(self) -> dict:
+        return {"file_id": f"BQAD{self.next_id}", "file_unique_id": f"u{self.next_id}", "file_name": "invoice.pdf"}
+
+    def make(self, kind: str) -> tuple[str, dict]:
+        """(фактический вид, апдейт): клик по карточке до первой заявки становится болтовнёй."""
+        uid = self.next_id
+        if kind == "callback" and not self.invoices:
+            kind = "chatter"
+        chat, user = self._chat(), self._user()
+
+        if kind == "chatter":
+            body = {"message": self._message(chat, user, text=f"сообщение {uid}")}
+        elif kind == "tag":
+            body = {"message": self._message(
+                chat, user, text=f"{self.mention} помогите",
+                entities=[{"type": "mention", "offset": 0, "length": len(self.mention)}])}
+        elif kind == "reply_to_bot":
+            original = {"message_id": max(1, uid - 10), "date": int(time.time()), "chat": chat,
+                        "from": BOT_USER, "text": "ответ менеджера"}
+            body = {"message": self._message(chat, user, text="спасибо, а ещё вопрос", reply_to_message=original)}
+        elif kind == "support":
+            extra = {}
+            if self.rnd.random() < 0.3:
+                extra["reply_to_message"] = {"message_id": max(1, uid - 5), "date": int(time.time()),
+                                             "chat": chat, "from": self._user(), "text": "вопрос клиента"}
+            body = {"message": self._message(
+                chat, user, text="/support", entities=[{"type": "bot_command", "offset": 0, "length": 8}], **extra)}
+        elif kind == "invoice":
+            self.invoices += 1
+            body = {"message": self._message(
+                chat, user, caption="/invoice", document=self._document(),
+                caption_entities=[{"type": "bot_command", "offset": 0, "length": 8}])}
+        elif kind == "invoice_nofile":
+            body = {"message": self._message(
+                chat, user, text="/invoice", entities=[{"type": "bot_command", "offset": 0, "length": 8}])}
+        elif kind == "callback":
+            manager = self._manager()
+            inv_id = self.rnd.randint(1, self.invoices)
+            card = {"message_id": uid, "date": int(time.time()),
+                    "chat": {"id": manager["id"], "type": "private"}, "from": BOT_USER, "text": f"Заявка #{inv_id}"}
+            body = {"callback_query": {
+                "id": str(uid), "from": manager, "chat_instance": "bench", "message": card,
+                "data": f"inv:{inv_id}:{self.rnd.choice(CALLBACK_ACTIONS)}",
+            }}
+        elif kind in ("manager_text", "manager_file", "manager_cmd"):
+            manager = self._manager()
+            dm = {"id": manager["id"], "type": "private", "first_name": "Manager"}
+            if kind == "manager_text":
+                body = {"message": self._message(dm, manager, text=f"ответ клиенту {uid}")}
+            elif kind == "manager_file":
+                body = {"message": self._message(dm, manager, document=self._document())}
+            else:
+                cmd = self.rnd.choice(MANAGER_COMMANDS)
+                name_len = len(cmd.split()[0])
+                body = {"message": self._message(
+                    dm, manager, text=cmd, entities=[{"type": "bot_command", "offset": 0, "length": name_len}])}
+        else:
+            raise ValueError(f"неизвестный вид апдейта: {kind}")
+
+        self.next_id += 1
+        return kind, {"update_id": uid, **body}
+
+    def batch(self, n: int, kind: str | None = None) -> list[tuple[str, dict]]:
+        out = []
+        for _ in range(n):
+            k = kind or self.rnd.choices(self.kinds, self.weights)[0]
+            out.append(self.make(k))
+        return out
+
+
+class Counters:
+    """
+    Счётчик SQL-выражений: trace callback вызывается из потоков aiosqlite.
+    Выражения изнутри триггеров и FTS5 приходят с префиксом «--» и не считаются:
+    интересны обращения кода к БД (строки executemany считаются по одной).
+    """
+
+    def __init__(self):
+        self.statements = 0
+
+    def trace(self, sql: str) -> None:
+        if not sql.startswith("--"):
+            self.statements += 1
+
+
+def _pct(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def replay(dp: Dispatcher, bot, updates: list[tuple[str, dict]], concurrency: int) -> dict[str, list[float]]:
+    """Подаёт апдейты в dp через concurrency воркеров; возвращает {вид: [сек обработки]}."""
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in updates:
+        queue.put_nowait(item)
+    latencies: dict[str, list[float]] = {}
+    errors = Counter()
+
+    async def worker():
+        while not queue.empty():
+            kind, raw = queue.get_nowait()
+            t0 = time.perf_counter()
+            try:
+                await dp.feed_raw_update(bot, raw)
+            except Exception as e:
+                errors[f"{kind}: {type(e).__name__}"] += 1
+            latencies.setdefault(kind, []).append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    if errors:
+        print("ошибки обработчиков:", dict(errors))
+    return latencies
+
+
+async def main(args) -> None:
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, (args.mix or "").split(",")):
+        k, _, v = part.partition("=")
+        if k not in mix:
+            raise SystemExit(f"неизвестный вид в --mix: {k} (есть: {', '.join(mix)})")
+        mix[k] = float(v)
+
+    await db.init_db()
+    api = FakeBotAPI(latency=args.latency)
+    await api.start()
+    counters = Counters()
+    await db.trace_statements(counters.trace)
+    flusher = asyncio.create_task(db.chat_flush_loop())
+
+    bot = api.make_bot()
+    sched = None
+    if args.scheduler:
+        sched = OutboundScheduler()
+        bot.session.middleware(OutboundMiddleware(sched))
+    dp = Dispatcher()
+    setup_all(dp, bot, User(**BOT_USER))
+    stream = UpdateStream(mix)
+    try:
+        # прогрев: чаты в каталоге, выбранные чаты у менеджеров, несколько заявок
+        await replay(dp, bot, stream.batch(50, "tag") + stream.batch(20, "invoice"), 10)
+        await db.flush_chats()
+
+        updates = stream.batch(args.updates)
+        api.calls.clear()
+        counters.statements = 0
+        t0 = time.perf_counter()
+        latencies = await replay(dp, bot, updates, args.concurrency)
+        elapsed = time.perf_counter() - t0
+        await db.flush_chats()  # отложенная запись активности — тоже часть стоимости
+
+        n = len(updates)
+        flat = [x for xs in latencies.values() for x in xs]
+        print(f"апдейтов: {n}, воркеров: {args.concurrency}, задержка API: {args.latency * 1e3:.0f} ms, "
+              f"планировщик исходящих: {'да' if sched else 'нет'}")
+        print(f"пропускная способность: {n / elapsed:8.0f} upd/s ({elapsed:.2f}s)")
+        print(f"обработка апдейта:      p50={_pct(flat, 0.5) * 1e3:.2f} ms  p99={_pct(flat, 0.99) * 1e3:.2f} ms  "
+              f"max={max(flat) * 1e3:.2f} ms")
+        print(f"SQL-выражений/апдейт:   {counters.statements / n:.2f}")
+        print(f"вызовов API/апдейт:     {api.total_calls / n:.2f}  {dict(api.calls.most_common(6))}")
+
+        if args.per_kind:
+            print(f"\nпо видам (последовательно, по {args.per_kind} шт.):")
+            print(f"{'вид':<16} {'доля':>5} {'p50, ms':>9} {'p99, ms':>9} {'SQL/upd':>8} {'API/upd':>8}")
+            total = sum(mix.values())
+            for kind in mix:
+                batch = stream.batch(args.per_kind, kind)
+                api.calls.clear()
+                await db.flush_chats()
+                counters.statements = 0
+                lat = (await replay(dp, bot, batch, 1)).get(kind, [])
+                await db.flush_chats()
+                print(f"{kind:<16} {mix[kind] / total:5.0%} {_pct(lat, 0.5) * 1e3:9.2f} {_pct(lat, 0.99) * 1e3:9.2f} "
+                      f"{counters.statements / len(batch):8.2f} {api.total_calls / len(batch):8.2f}")
+    finally:
+        flusher.cancel()
+        if sched is not None:
+            await sched.close()
+        await bot.session.close()
+        await api.stop()
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=5000)
+    ap.add_argument("--concurrency", type=int, default=100, help="одновременно обрабатываемых апдейтов")
+    ap.add_argument("--latency", type=float, default=0.0, help="задержка фейкового Bot API, сек")
+    ap.add_argument("--mix", default="", help="переопределить доли: chatter=50,invoice=10,...")
+    ap.add_argument("--per-kind", type=int, default=100, help="апдейтов на вид в разбивке (0 — без разбивки)")
+    ap.add_argument("--scheduler", action="store_true", help="включить OutboundScheduler с боевыми лимитами (ЛС менеджера ≈1/с — берите мало --updates)")
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,104 @@
+# bench/shutdown.py — SIGTERM под нагрузкой: ни один полученный апдейт не потерян
+#
+#   python -m bench.shutdown [--updates 3000] [--tag-ratio 0.3] [--latency 0.05] [--at 0.4] [--workers 0]
+#
+# Поднимает фейковый Bot API (bench/fake_api.py) с очередью синтетических апдейтов и настоящий
+# `python app.py` на временной БД (боевой bot.db не трогает). Когда бот забрал долю --at апдейтов,
+# шлёт ему SIGTERM и ждёт выхода. Затем сверяет: каждый апдейт, подтверждённый Telegram
+# (offset следующего getUpdates), либо отмечен обработанным (dedup_keys, scope='update'), либо
+# (при --workers N) ещё лежит в update_queue и будет разобран после рестарта. Неподтверждённые
+# Telegram отдаст снова — они не потеряны. Печатает итоговую строку [shutdown] из лога.
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.fake_api import BOT_TOKEN, FakeBotAPI
+from bench.webhook_load import synthetic_updates
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+async def main(args) -> int:
+    tmp = tempfile.TemporaryDirectory()
+    api = FakeBotAPI(latency=args.latency)
+    await api.start()
+    api.push_updates(synthetic_updates(args.updates, args.tag_ratio))
+    db_path = Path(tmp.name) / "bot.db"
+    env = dict(
+        os.environ, DB_PATH=str(db_path), BACKUP_PATH=str(Path(tmp.name) / "backups"), METRICS_PORT="0",
+        BOT_TOKEN=BOT_TOKEN, BOT_API_URL=api.base_url, WORKERS=str(args.workers),
+        # лимиты Telegram фейковому API не нужны: под SIGTERM должно оказаться много начатых отправок
+        OUT_GLOBAL_RATE="100000", OUT_PRIVATE_RATE="100000", OUT_PRIVATE_BURST="1000",
+        OUT_GROUP_PER_MIN="1000000", OUT_GROUP_BURST="1000",
+    )
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "app.py", cwd=str(ROOT), env=env, stderr=asyncio.subprocess.PIPE,
+    )
+    log_lines: list[str] = []
+
+    async def read_log():
+        async for line in proc.stderr:
+            log_lines.append(line.decode(errors="replace").rstrip())
+
+    reader = asyncio.create_task(read_log())
+    try:
+        target = int(args.updates * args.at)
+        deadline = time.monotonic() + 120
+        while len(api.confirmed) < target:
+            if proc.returncode is not None or time.monotonic() > deadline:
+                print("\n".join(log_lines[-30:]))
+                raise RuntimeError("бот не забрал апдейты")
+            await asyncio.sleep(0.01)
+        calls_at_term, confirmed_at_term = api.total_calls, len(api.confirmed)
+        t0 = time.perf_counter()
+        proc.send_signal(signal.SIGTERM)
+        code = await proc.wait()
+        stop_s = time.perf_counter() - t0
+        await reader
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        await api.stop()
+
+    with sqlite3.connect(db_path) as conn:
+        handled = {int(k) for (k,) in conn.execute("SELECT key FROM dedup_keys WHERE scope='update'")}
+    queued: set[int] = set()
+    queue_path = db_path.with_name("bot_queue.db")
+    if args.workers and queue_path.exists():
+        with sqlite3.connect(queue_path) as conn:
+            queued = {json.loads(p)["update_id"] for (p,) in conn.execute("SELECT payload FROM update_queue")}
+
+    confirmed = set(api.confirmed)
+    lost = sorted(confirmed - handled - queued)
+    print(f"режим: {'WORKERS=' + str(args.workers) if args.workers else 'один процесс, polling'}")
+    print(f"SIGTERM после {confirmed_at_term} из {args.updates} подтверждённых апдейтов (вызовов API к этому моменту {calls_at_term}); "
+          f"остановка {stop_s:.2f} с, код выхода {code}")
+    print(f"подтверждено {len(confirmed)}: обработано {len(confirmed & handled)}, в очереди до рестарта "
+          f"{len(confirmed & queued)}, потеряно {len(lost)}; придут повторно {len(api.unconfirmed)}")
+    for line in log_lines:
+        if "[shutdown]" in line or "[worker" in line and "остановка" in line:
+            print("  " + line)
+    if lost:
+        print(f"ПОТЕРЯНЫ: {lost[:20]}")
+    ok = not lost and code == 0
+    print("OK" if ok else "FAIL")
+    tmp.cleanup()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=3000)
+    ap.add_argument("--tag-ratio", type=float, default=0.3, help="доля апдейтов, которые пересылаются менеджерам")
+    ap.add_argument("--latency", type=float, default=0.05, help="задержка фейкового Bot API, сек")
+    ap.add_argument("--at", type=float, default=0.4, help="SIGTERM, когда бот забрал такую долю апдейтов")
+    ap.add_argument("--workers", type=int, default=0)
+    sys.exit(asyncio.run(main(ap.parse_args())))
@@ -0,0 +1,122 @@
+# bench/update_order.py — проверка UpdateScheduler: порядок внутри чата при параллельной обработке
+#
+#   python -m bench.update_order [--updates 3000] [--chats 40] [--limit 8] [--max-delay 0.01]
+#
+# Апдейты подаются в Dispatcher так же, как это делает polling: задача на апдейт в порядке
+# update_id. Хендлеры спят случайное время (имитация БД/Bot API), так что без планировщика
+# апдейты одного чата обгоняют друг друга. Сообщения в группах + клики по карточкам заявок
+# (ключ — заявка, а не чат). Проверяется:
+#   - внутри ключа апдейты не пересекаются и завершаются строго по update_id (без обгонов);
+#   - одновременно в работе не больше --limit апдейтов, но больше одного (разные ключи параллельны).
+# Выходит с ошибкой, если с планировщиком порядок нарушен.
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import CallbackQuery, Message, Update
+
+from middlewares import UpdateScheduler, update_key
+
+
+def make_updates(n: int, chats: int, invoices: int) -> list[Update]:
+    rnd = random.Random(19)
+    out = []
+    for uid in range(1, n + 1):
+        chat = {"id": -1000000000000 - rnd.randrange(chats), "type": "supergroup", "title": "g"}
+        user = {"id": 10_000 + rnd.randrange(50), "is_bot": False, "first_name": "U"}
+        message = {"message_id": uid, "date": 0, "chat": chat, "from": user, "text": f"m{uid}"}
+        if rnd.random() < 0.3:
+            # клик по карточке заявки в ЛС менеджера
+            dm = {"id": 218837831, "type": "private", "first_name": "M"}
+            card = {"message_id": uid, "date": 0, "chat": dm, "from": user, "text": "card"}
+            out.append(Update.model_validate({"update_id": uid, "callback_query": {
+                "id": str(uid), "from": user, "chat_instance": "x", "message": card,
+                "data": f"inv:{rnd.randrange(invoices) + 1}:MARK_SENT"}}))
+        else:
+            out.append(Update.model_validate({"update_id": uid, "message": message}))
+    return out
+
+
+class Recorder:
+    def __init__(self, max_delay: float):
+        self.rnd = random.Random(7)
+        self.max_delay = max_delay
+        self.active: set = set()
+        self.finished: dict = {}
+        self.overlaps = 0
+        self.reordered = 0
+        self.running = 0
+        self.peak = 0
+
+    async def handle(self, update: Update) -> None:
+        key = update_key(update)
+        if key in self.active:
+            self.overlaps += 1
+        self.active.add(key)
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(self.rnd.random() * self.max_delay)
+        finally:
+            self.running -= 1
+            self.active.discard(key)
+            if self.finished.get(key, 0) > update.update_id:
+                self.reordered += 1
+            self.finished[key] = max(self.finished.get(key, 0), update.update_id)
+
+
+async def run(updates: list[Update], scheduler, max_delay: float) -> tuple[Recorder, float]:
+    rec = Recorder(max_delay)
+    dp = Dispatcher()
+    if scheduler is not None:
+        dp.update.outer_middleware(scheduler)
+
+    async def on_message(message: Message, event_update: Update):
+        await rec.handle(event_update)
+
+    async def on_callback(cb: CallbackQuery, event_update: Update):
+        await rec.handle(event_update)
+
+    dp.message.register(on_message)
+    dp.callback_query.register(on_callback)
+
+    bot = Bot("123456:TEST")
+    t0 = time.perf_counter()
+    tasks = [asyncio.create_task(dp.feed_update(bot, u)) for u in updates]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t0
+    await bot.session.close()
+    return rec, elapsed
+
+
+async def main(args) -> int:
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)  # «Update id=... is handled» на каждый апдейт
+    updates = make_updates(args.updates, args.chats, args.invoices)
+    print(f"{args.updates} апдейтов, {args.chats} групп, {args.invoices} заявок, задержка хендлера до {args.max_delay * 1e3:.0f} мс")
+    print(f"{'режим':<12} {'сек':>6} {'пересеч.':>9} {'обгонов':>8} {'пик в работе':>13}")
+    scheduler = UpdateScheduler(args.limit)
+    results = {}
+    for label, sched in (("без очереди", None), (f"scheduler/{args.limit}", scheduler)):
+        rec, elapsed = await run(updates, sched, args.max_delay)
+        results[label] = rec
+        print(f"{label:<12} {elapsed:6.2f} {rec.overlaps:9} {rec.reordered:8} {rec.peak:13}")
+
+    rec = results[f"scheduler/{args.limit}"]
+    ok = not rec.overlaps and not rec.reordered and 1 < rec.peak <= args.limit
+    st = scheduler.stats()
+    print(f"пик очереди {st['peak_waiting']}, ключей после прогона {st['keys']} — {'OK' if ok else 'FAIL'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=3000)
+    ap.add_argument("--chats", type=int, default=40)
+    ap.add_argument("--invoices", type=int, default=20)
+    ap.add_argument("--limit", type=int, default=8)
+    ap.add_argument("--max-delay", type=float, default=0.01)
+    sys.exit(asyncio.run(main(ap.parse_args())))
@@ -0,0 +1,165 @@
+# bench/webhook_load.py — пропускная способность приёма: webhook против long polling
+#
+#   python -m bench.webhook_load [--mode both|webhook|polling] [--updates 5000]
+#                                [--concurrency 50] [--tag-ratio 0.02] [--latency 0.0]
+#   python -m bench.webhook_load --url http://host:8080/tg/webhook --secret S   # только нагрузка
+#
+# Без --url поднимает в процессе фейковый Bot API (bench/fake_api.py), настоящий
+# Dispatcher из handlers.setup_all и временную БД; боевой bot.db не трогает.
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DB_PATH"] = str(Path(_tmp.name) / "bench.db")
+
+import aiohttp  # noqa: E402
+from aiogram import BaseMiddleware, Dispatcher  # noqa: E402
+
+import db  # noqa: E402
+from bench.fake_api import BOT_USER, FakeBotAPI  # noqa: E402
+from handlers import setup_all  # noqa: E402
+from webhook import SECRET_HEADER, WebhookServer  # noqa: E402
+
+
+def synthetic_updates(n: int, tag_ratio: float, start_id: int = 1) -> list[dict]:
+    """Переписка в 50 группах; доля tag_ratio сообщений тегает бота."""
+    rnd = random.Random(42)
+    mention = f"@{BOT_USER['username']}"
+    updates = []
+    for i in range(n):
+        uid = start_id + i
+        chat_id = -1000000000000 - rnd.randrange(50)
+        tagged = rnd.random() < tag_ratio
+        text = f"{mention} помогите" if tagged else f"сообщение {uid}"
+        message = {
+            "message_id": uid, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"Группа {chat_id % 50}"},
+            "from": {"id": 10_000 + rnd.randrange(500), "is_bot": False, "first_name": "User"},
+            "text": text,
+        }
+        if tagged:
+            message["entities"] = [{"type": "mention", "offset": 0, "length": len(mention)}]
+        updates.append({"update_id": uid, "message": message})
+    return updates
+
+
+class _Done(BaseMiddleware):
+    """Считает полностью обработанные апдейты и будит ожидающего на n-м."""
+
+    def __init__(self, target: int):
+        self.target = target
+        self.count = 0
+        self.event = asyncio.Event()
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            self.count += 1
+            if self.count >= self.target:
+                self.event.set()
+
+
+async def post_updates(url: str, updates: list[dict], concurrency: int, secret: str = "") -> list[float]:
+    """Постит апдейты с заданным параллелизмом; возвращает задержки ответов (сек)."""
+    queue: asyncio.Queue = asyncio.Queue()
+    for u in updates:
+        queue.put_nowait(u)
+    latencies: list[float] = []
+    headers = {SECRET_HEADER: secret} if secret else {}
+
+    async def client(session: aiohttp.ClientSession):
+        while not queue.empty():
+            update = queue.get_nowait()
+            t0 = time.perf_counter()
+            async with session.post(url, json=update, headers=headers) as resp:
+                resp.raise_for_status()
+            latencies.append(time.perf_counter() - t0)
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    return latencies
+
+
+def _report(label: str, n: int, elapsed: float, api: FakeBotAPI | None = None, latencies=None) -> None:
+    line = f"{label:<8} {n} апдейтов за {elapsed:6.2f}s → {n / elapsed:8.0f} upd/s"
+    if latencies:
+        latencies.sort()
+        line += f"  ответ p50={latencies[len(latencies) // 2] * 1e3:.2f}ms p99={latencies[int(len(latencies) * 0.99) - 1] * 1e3:.2f}ms"
+    if api is not None:
+        line += f"  вызовов API: {api.total_calls}"
+    print(line)
+
+
+async def _build(api: FakeBotAPI, n: int):
+    bot = api.make_bot()
+    dp = Dispatcher()
+    setup_all(dp, bot)
+    done = _Done(n)
+    dp.update.outer_middleware(done)
+    return bot, dp, done
+
+
+async def bench_webhook(api: FakeBotAPI, updates: list[dict], concurrency: int) -> None:
+    bot, dp, done = await _build(api, len(updates))
+    server = WebhookServer(dp, bot, secret="bench-secret", path="/tg/webhook")
+    await server.start("127.0.0.1", 0)
+    port = server._runner.addresses[0][1]
+    t0 = time.perf_counter()
+    latencies = await post_updates(f"http://127.0.0.1:{port}/tg/webhook", updates, concurrency, "bench-secret")
+    await done.event.wait()
+    _report("webhook", len(updates), time.perf_counter() - t0, api, latencies)
+    await server.drain(5)
+    await server.stop()
+    await bot.session.close()
+
+
+async def bench_polling(api: FakeBotAPI, updates: list[dict]) -> None:
+    bot, dp, done = await _build(api, len(updates))
+    api.push_updates(updates)
+    t0 = time.perf_counter()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=1))
+    await done.event.wait()
+    _report("polling", len(updates), time.perf_counter() - t0, api)
+    await dp.stop_polling()
+    await polling
+
+
+async def main(args) -> None:
+    updates = synthetic_updates(args.updates, args.tag_ratio)
+    if args.url:
+        t0 = time.perf_counter()
+        latencies = await post_updates(args.url, updates, args.concurrency, args.secret)
+        _report("webhook", len(updates), time.perf_counter() - t0, latencies=latencies)
+        return
+
+    await db.init_db()
+    api = FakeBotAPI(latency=args.latency)
+    await api.start()
+    try:
+        if args.mode in ("both", "polling"):
+            await bench_polling(api, updates)
+        if args.mode in ("both", "webhook"):
+            api.calls.clear()
+            await bench_webhook(api, synthetic_updates(args.updates, args.tag_ratio, start_id=args.updates + 1),
+                                args.concurrency)
+    finally:
+        await api.stop()
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=("both", "webhook", "polling"), default="both")
+    ap.add_argument("--updates", type=int, default=5000)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--tag-ratio", type=float, default=0.02)
+    ap.add_argument("--latency", type=float, default=0.0, help="задержка фейкового Bot API, сек")
+    ap.add_argument("--url", help="внешний вебхук: только отправить нагрузку")
+    ap.add_argument("--secret", default="")
+    asyncio.run(main(ap.parse_args()))
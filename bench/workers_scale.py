@@ -0,0 +1,105 @@
+# bench/workers_scale.py — пропускная способность многопроцессного режима (WORKERS > 0)
+#
+#   python -m bench.workers_scale [--workers 1,2,4] [--updates 6000] [--tag-ratio 0.02] [--latency 0.0]
+#
+# Для каждого N: свежие временные БД и очередь, фейковый Bot API (bench/fake_api.py) в этом
+# процессе, настоящий WorkerPool из N процессов `python -m app --worker i`. Все апдейты кладутся
+# в очередь разом (как после простоя приёма), время — до опустошения очереди.
+# Проверяет, что порядок внутри чата сохранён: сообщения одного чата лежат в одном шарде.
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DB_PATH"] = str(Path(_tmp.name) / "bench.db")
+os.environ["BACKUP_PATH"] = str(Path(_tmp.name) / "backups")
+os.environ["METRICS_PORT"] = "0"
+# фейковому API лимиты Telegram не нужны: меряем разбор апдейтов, а не очередь отправок
+os.environ.update({"OUT_GLOBAL_RATE": "100000", "OUT_PRIVATE_RATE": "100000", "OUT_PRIVATE_BURST": "1000",
+                   "OUT_GROUP_PER_MIN": "1000000", "OUT_GROUP_BURST": "1000"})
+
+from aiogram.types import Update  # noqa: E402
+
+from bench.fake_api import BOT_TOKEN, FakeBotAPI  # noqa: E402
+from bench.webhook_load import synthetic_updates  # noqa: E402
+from update_queue import UpdateQueue, shard_of  # noqa: E402
+from workers import WorkerPool  # noqa: E402
+
+_INIT_DB = "import asyncio, db\nasync def m():\n    await db.init_db()\n    await db.close_db()\nasyncio.run(m())"
+
+
+async def bench(api: FakeBotAPI, n_workers: int, updates: list[Update]) -> float:
+    run_dir = Path(_tmp.name) / f"w{n_workers}"
+    run_dir.mkdir()
+    os.environ.update({
+        "DB_PATH": str(run_dir / "bot.db"),
+        "QUEUE_DB_PATH": str(run_dir / "queue.db"),
+        "ARCHIVE_DB_PATH": str(run_dir / "archive.db"),
+        "BOT_API_URL": api.base_url,
+        "BOT_TOKEN": BOT_TOKEN,
+    })
+    # схема и миграции — один раз до воркеров, как в процессе приёма
+    init = await asyncio.create_subprocess_exec(sys.executable, "-c", _INIT_DB, env=dict(os.environ))
+    if await init.wait():
+        raise RuntimeError("не удалось создать БД")
+    queue = UpdateQueue(os.environ["QUEUE_DB_PATH"], shards=n_workers)
+    await queue.open()
+    pool = WorkerPool(n_workers)
+    try:
+        await queue.reshard()
+        await pool.start()
+        if not await pool.wait_ready(queue):
+            raise RuntimeError("воркеры не поднялись")
+        calls0 = api.total_calls
+        t0 = time.perf_counter()
+        await queue.put(updates)
+        while sum((await queue.depth()).values()):
+            await asyncio.sleep(0.02)
+        elapsed = time.perf_counter() - t0
+        print(f"воркеров {n_workers}: {len(updates)} апдейтов за {elapsed:6.2f}s → "
+              f"{len(updates) / elapsed:7.0f} upd/s, вызовов API {api.total_calls - calls0}")
+        return elapsed
+    finally:
+        await pool.stop()
+        await queue.close()
+
+
+def _check_sharding(updates: list[Update], shards: int) -> None:
+    by_chat: dict[int, set[int]] = {}
+    for u in updates:
+        by_chat.setdefault(u.message.chat.id, set()).add(shard_of(u, shards))
+    assert all(len(s) == 1 for s in by_chat.values()), "чат разъехался по шардам"
+    sizes = [sum(1 for u in updates if shard_of(u, shards) == s) for s in range(shards)]
+    print(f"  шарды при N={shards}: {sizes}")
+
+
+async def main(args) -> None:
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    counts = [int(x) for x in args.workers.split(",")]
+    updates = [Update.model_validate(u) for u in synthetic_updates(args.updates, args.tag_ratio)]
+    print(f"ядер: {os.cpu_count()}, апдейтов: {len(updates)}, задержка API {args.latency * 1e3:.0f} мс")
+    for n in counts:
+        if n > 1:
+            _check_sharding(updates, n)
+
+    api = FakeBotAPI(latency=args.latency)
+    await api.start()
+    try:
+        for n in counts:
+            await bench(api, n, updates)
+    finally:
+        await api.stop()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", default="1,2,4")
+    ap.add_argument("--updates", type=int, default=6000)
+    ap.add_argument("--tag-ratio", type=float, default=0.02)
+    ap.add_argument("--latency", type=float, default=0.0, help="задержка фейкового Bot API, сек")
+    asyncio.run(main(ap.parse_args()))
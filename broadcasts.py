@@ -0,0 +1,145 @@
+# broadcasts.py — фоновые рассылки: задания в SQLite, воркер, живой прогресс
+import asyncio
+import contextlib
+import time
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+
+from config import BROADCAST_BATCH, BROADCAST_CONCURRENCY, BROADCAST_PROGRESS_EVERY, log
+from db import (
+    broadcast_counts,
+    broadcast_errors,
+    get_broadcast_job,
+    list_running_broadcasts,
+    mark_broadcast_targets,
+    next_broadcast_targets,
+    set_broadcast_status,
+)
+from kb import broadcast_kb
+from outbound import bulk
+from utils import escape_html
+
+STATUS_TEXT = {
+    "RUNNING": "идёт",
+    "PAUSED": "на паузе",
+    "CANCELLED": "отменена",
+    "DONE": "завершена",
+}
+
+# job_id -> задача воркера (одна на задание)
+_tasks: dict[int, asyncio.Task] = {}
+
+
+def start_job(bot: Bot, job_id: int) -> None:
+    """Запустить (или продолжить) воркер задания, если он ещё не крутится."""
+    task = _tasks.get(job_id)
+    if task is not None and not task.done():
+        return
+    _tasks[job_id] = asyncio.create_task(_run_job(bot, job_id))
+
+
+async def resume_unfinished(bot: Bot) -> int:
+    """На старте: продолжить все задания в статусе RUNNING с места остановки."""
+    job_ids = await list_running_broadcasts()
+    for job_id in job_ids:
+        start_job(bot, job_id)
+    if job_ids:
+        log.info("[broadcast] возобновлены задания: %s", job_ids)
+    return len(job_ids)
+
+
+async def stop_all() -> None:
+    """Остановка бота: воркеры сохраняют уже отправленное, задания остаются RUNNING."""
+    tasks = [t for t in _tasks.values() if not t.done()]
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+async def render_progress(job_id: int) -> tuple[str, Optional[InlineKeyboardMarkup]]:
+    job = await get_broadcast_job(job_id)
+    if not job:
+        return f"Рассылка #{job_id} не найдена.", None
+    status = job[3]
+    counts = await broadcast_counts(job_id)
+    total = sum(counts.values())
+    lines = [
+        f"📣 Рассылка #{job_id} — {STATUS_TEXT.get(status, status)}",
+        f"Отправлено: {counts['SENT']}, ошибок: {counts['FAILED']}, осталось: {counts['PENDING']} из {total}",
+    ]
+    if counts["FAILED"] and status in ("DONE", "CANCELLED"):
+        errors = await broadcast_errors(job_id)
+        lines.append("\nПервые ошибки:")
+        lines += [f"{cid}: {escape_html(err)}" for cid, err in errors]
+    return "\n".join(lines), broadcast_kb(job_id, status)
+
+
+async def refresh_progress(bot: Bot, job_id: int) -> None:
+    """Перерисовать сообщение-прогресс задания на месте."""
+    job = await get_broadcast_job(job_id)
+    if not job or not job[5]:
+        return
+    text, kb = await render_progress(job_id)
+    try:
+        await bot.edit_message_text(chat_id=job[4], message_id=job[5], text=text, reply_markup=kb)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e).lower():
+            log.warning("[broadcast] прогресс #%s не обновлён: %s", job_id, e)
+    except Exception as e:
+        log.warning("[broadcast] прогресс #%s не обновлён: %s", job_id, e)
+
+
+async def _send_batch(bot: Bot, text: str, chat_ids: list[int], results: list) -> None:
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def send(cid: int):
+        async with sem:
+            try:
+                await bot.send_message(chat_id=cid, text=text)
+                results.append((cid, "SENT", None))
+            except Exception as e:
+                results.append((cid, "FAILED", str(e)[:300]))
+
+    # темп задаёт outbound-планировщик; полоса bulk уступает интерактивному трафику
+    with bulk():
+        await asyncio.gather(*(send(cid) for cid in chat_ids))
+
+
+async def _run_job(bot: Bot, job_id: int) -> None:
+    last_refresh = time.monotonic()
+    try:
+        while True:
+            # статус перечитываем на каждой пачке — так работают пауза и отмена
+            job = await get_broadcast_job(job_id)
+            if not job or job[3] != "RUNNING":
+                break
+            chat_ids = await next_broadcast_targets(job_id, BROADCAST_BATCH)
+            if not chat_ids:
+                await set_broadcast_status(job_id, "DONE")
+                break
+
+            results: list = []
+            try:
+                await _send_batch(bot, job[2], chat_ids, results)
+            finally:
+                # и при остановке бота фиксируем уже отправленное — без повторов после рестарта
+                await mark_broadcast_targets(job_id, results)
+
+            if time.monotonic() - last_refresh >= BROADCAST_PROGRESS_EVERY:
+                last_refresh = time.monotonic()
+                await refresh_progress(bot, job_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        log.exception("[broadcast] задание #%s упало", job_id)
+        return
+    finally:
+        if _tasks.get(job_id) is asyncio.current_task():
+            _tasks.pop(job_id, None)
+
+    await refresh_progress(bot, job_id)
@@ -0,0 +1,66 @@
+# cache.py — маленький in-memory кэш с TTL и LRU-вытеснением
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+MISSING = object()  # «нет в кэше» (None — законное закэшированное значение: «в БД пусто»)
+
+
+class TTLCache:
+    """
+    LRU-кэш с ограничением по размеру и времени жизни записей.
+    Для write-through: put() после успешной записи в БД, fill() — после чтения из БД
+    (fill не перетирает значение, если с начала чтения в кэш уже что-то писали).
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 300.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0  # счётчик записей: по нему fill() узнаёт о гонке с put()
+
+    def get(self, key: Hashable) -> Any:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.writes += 1
+        self._store(key, value)
+
+    def fill(self, key: Hashable, value: Any, writes_seen: int) -> None:
+        """Положить прочитанное из БД, если за время чтения не было put()/invalidate()."""
+        if self.writes == writes_seen:
+            self._store(key, value)
+
+    def invalidate(self, key: Hashable) -> None:
+        self.writes += 1
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self.writes += 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+        }
@@ -6,13 +6,94 @@ from pathlib import Path
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+BOT_API_URL = os.getenv("BOT_API_URL", "")  # свой Bot API сервер (local bot-api, стенд); пусто — api.telegram.org
 # MANAGER_ID = int(os.getenv("MANAGER_ID", "0"))
 MANAGER_IDS = {218837831, 7892801404}
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "8"))  # одновременных отправок при рассылке менеджерам
 
+# лимиты исходящих запросов к Bot API (outbound.py)
+OUT_GLOBAL_RATE = float(os.getenv("OUT_GLOBAL_RATE", "30"))      # сообщений/с на весь бот
+OUT_PRIVATE_RATE = float(os.getenv("OUT_PRIVATE_RATE", "1"))     # сообщений/с в один ЛС
+OUT_PRIVATE_BURST = int(os.getenv("OUT_PRIVATE_BURST", "3"))
+OUT_GROUP_PER_MIN = float(os.getenv("OUT_GROUP_PER_MIN", "20"))  # сообщений/мин в одну группу
+OUT_GROUP_BURST = int(os.getenv("OUT_GROUP_BURST", "3"))
+OUT_MAX_RETRIES = int(os.getenv("OUT_MAX_RETRIES", "3"))         # повторов после retry_after
+
+# фоновые рассылки (broadcasts.py)
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "50"))              # целей за один проход воркера
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))  # одновременных отправок в задании
+BROADCAST_PROGRESS_EVERY = float(os.getenv("BROADCAST_PROGRESS_EVERY", "3"))  # сек между правками прогресса
+
+CARD_REFRESH_DEBOUNCE = float(os.getenv("CARD_REFRESH_DEBOUNCE", "0.4"))  # сек: серия кликов -> одна перерисовка карточек
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "0.8"))  # сек тишины после части альбома -> альбом собран
+INVOICES_PAGE_SIZE = int(os.getenv("INVOICES_PAGE_SIZE", "8"))  # заявок на странице /invoices
+
+# режим дайджеста (digest.py, /digest): запросы из групп -> одна сводка за окно
+DIGEST_WINDOW = int(os.getenv("DIGEST_WINDOW", "600"))       # сек, окно по умолчанию для /digest on
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "20"))  # столько запросов — сводка уходит, не дожидаясь окна
+# слова, с которыми запрос идёт менеджеру сразу, мимо дайджеста (через запятую, без учёта регистра)
+DIGEST_URGENT_WORDS = tuple(
+    w.strip().lower() for w in os.getenv("DIGEST_URGENT_WORDS", "срочно,urgent,asap,!!!").split(",") if w.strip()
+)
+
+
+# приём апдейтов: "polling" (по умолчанию) или "webhook"
+RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
+ALLOWED_UPDATES = ["message", "chat_member", "my_chat_member", "callback_query"]
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))  # апдейтов в обработке одновременно (разные чаты)
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "512"))  # polling: больше задач в памяти — не забираем новые
+
+# многопроцессный режим (workers.py): процесс приёма кладёт апдейты в очередь SQLite,
+# WORKERS процессов обрабатывают их, каждый — свою часть чатов (шард по update_key)
+WORKERS = int(os.getenv("WORKERS", "0"))  # 0 — всё в одном процессе, как раньше
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "25"))  # long polling процесса приёма, сек
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "0.02"))  # сек: воркер опрашивает пустую очередь
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", "20000"))  # приём ждёт, пока воркеры не разберут очередь
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "20"))  # сек воркеру на дообработку при остановке
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "25"))  # сек на остановку по SIGTERM: дообработка и сброс буферов
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")          # внешний https-адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")              # X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "20"))  # сек на дообработку при остановке
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # /metrics (Prometheus); 0 — не поднимать
 
 DB_PATH = os.getenv("DB_PATH", "bot.db")
+DB_READERS = int(os.getenv("DB_READERS", "3"))  # размер пула read-only соединений
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))       # сек жизни записей кэша горячих таблиц
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "1024"))
+CHAT_FLUSH_EVERY = float(os.getenv("CHAT_FLUSH_EVERY", "5"))  # сек, сброс буфера активности чатов
+CHAT_FLUSH_MAX = int(os.getenv("CHAT_FLUSH_MAX", "500"))        # досрочный сброс при стольких чатах в буфере
+DEDUP_TTL = int(os.getenv("DEDUP_TTL", str(48 * 60 * 60)))  # сек помним обработанное (Telegram хранит апдейты сутки)
+DEDUP_MAXSIZE = int(os.getenv("DEDUP_MAXSIZE", "200000"))      # ключей в памяти
+# архив закрытых заявок (archive.py): отдельный файл рядом с DB_PATH, подключается как схема archive;
+# ARCHIVE_DB_PATH="" — без архива
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", str(Path(DB_PATH).with_name(Path(DB_PATH).stem + "_archive.db")))
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))  # DONE дольше стольких дней -> в архив; 0 — не архивировать
+ARCHIVE_EVERY = int(os.getenv("ARCHIVE_EVERY", str(6 * 60 * 60)))  # сек между проходами архиватора
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "200"))             # заявок за одну транзакцию
+ARCHIVE_BATCH_SLEEP = float(os.getenv("ARCHIVE_BATCH_SLEEP", "0.05"))  # пауза между пачками: писатель свободен для хендлеров
+# однократный VACUUM для перевода существующей БД в auto_vacuum=INCREMENTAL прямо на старте
+# (держит писатель и задерживает запуск на время перезаписи файла); по умолчанию — вручную: /db_archive vacuum
+DB_VACUUM_ON_START = os.getenv("DB_VACUUM_ON_START", "0") == "1"
+# очередь апдейтов многопроцессного режима (update_queue.py), тоже рядом с DB_PATH
+QUEUE_DB_PATH = os.getenv("QUEUE_DB_PATH", str(Path(DB_PATH).with_name(Path(DB_PATH).stem + "_queue.db")))
 BACKUP_DIR = Path(os.getenv("BACKUP_PATH", "db_backups"))
-BACKUP_EVERY = 4 * 60 * 60  # in seconds, default is 4 hours
+BACKUP_EVERY = int(os.getenv("BACKUP_EVERY", str(60 * 60)))  # in seconds, default is 1 hour
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))  # страниц за шаг online backup
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.005"))      # пауза между шагами, сек
+BACKUP_KEEP_HOURLY = int(os.getenv("BACKUP_KEEP_HOURLY", "24"))  # ротация: последние N часов
+BACKUP_KEEP_DAILY = int(os.getenv("BACKUP_KEEP_DAILY", "7"))     # ... N дней
+BACKUP_KEEP_WEEKLY = int(os.getenv("BACKUP_KEEP_WEEKLY", "4"))   # ... N недель
+
+# логирование (func_logger.setup_logging): профиль уровней, формат, файл, сэмплирование DEBUG
+LOG_PROFILE = os.getenv("LOG_PROFILE", "prod").lower()     # prod | dev | debug
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()       # text | json
+LOG_FILE = os.getenv("LOG_FILE", "")                       # путь к файлу (с ротацией); пусто — только stderr
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "0.05"))  # доля DEBUG-записей с одного места в коде
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
 log = logging.getLogger("support-bot")
\ No newline at end of file
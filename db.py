@@ -1,10 +1,14 @@
 # db.py — единая БД для чатов и инвойс-цикла
+import asyncio
+import contextlib
 import time
-from pathlib import Path
-from typing import Optional, List, Tuple
+from typing import AsyncIterator, Optional, List, Tuple
 
 import aiosqlite
-from config import DB_PATH, BACKUP_DIR  # BACKUP_DIR должен быть pathlib.Path или строкой пути
+from cache import MISSING, TTLCache
+from config import ARCHIVE_DB_PATH, DB_PATH, DB_READERS, DB_VACUUM_ON_START, CHAT_FLUSH_EVERY, CHAT_FLUSH_MAX, CACHE_MAXSIZE, CACHE_TTL, MANAGER_IDS, log
+from db_pool import DBPool
+from metrics import instrument_module
 
 
 # ------------------------- СХЕМА -------------------------
@@ -36,6 +40,7 @@ CREATE TABLE IF NOT EXISTS invoices (
     author_id      INTEGER NOT NULL,     -- кто создал
     created_ts     INTEGER NOT NULL DEFAULT (strftime('%s','now')),
     status         TEXT    NOT NULL DEFAULT 'NEW',
+    progress       INTEGER NOT NULL DEFAULT 0,   -- битовая маска PROGRESS_FLAGS (материализация invoice_events)
     FOREIGN KEY (chat_id) REFERENCES chats(chat_id)
 );
 
@@ -66,6 +71,12 @@ CREATE TABLE IF NOT EXISTS invoice_cards (
     PRIMARY KEY(manager_id, invoice_id)
 );
 
+-- режим дайджеста менеджера: запросы из групп копятся window_sec секунд и приходят одной сводкой
+CREATE TABLE IF NOT EXISTS manager_digest (
+    manager_id  INTEGER PRIMARY KEY,
+    window_sec  INTEGER NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS start_msg (
     manager_id  INTEGER PRIMARY KEY,
     chat_id     INTEGER,
@@ -73,91 +84,511 @@ CREATE TABLE IF NOT EXISTS start_msg (
     FOREIGN KEY (chat_id) REFERENCES chats(chat_id)
 );
 
+-- фоновые рассылки: задание + по строке на каждый целевой чат (переживают рестарт)
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    id                INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_by        INTEGER NOT NULL,
+    created_ts        INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+    text              TEXT    NOT NULL,
+    status            TEXT    NOT NULL DEFAULT 'RUNNING',  -- RUNNING|PAUSED|CANCELLED|DONE
+    progress_chat_id  INTEGER,                             -- сообщение с живым прогрессом
+    progress_msg_id   INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS broadcast_targets (
+    job_id   INTEGER NOT NULL,
+    chat_id  INTEGER NOT NULL,
+    status   TEXT    NOT NULL DEFAULT 'PENDING',  -- PENDING|SENT|FAILED
+    error    TEXT,
+    PRIMARY KEY (job_id, chat_id),
+    FOREIGN KEY (job_id) REFERENCES broadcast_jobs(id)
+);
+
+-- журнал бэкапов (backup.py): длительность и размер каждого запуска
+CREATE TABLE IF NOT EXISTS backup_runs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_ts   INTEGER NOT NULL,
+    path         TEXT,
+    size_bytes   INTEGER NOT NULL DEFAULT 0,
+    duration_ms  INTEGER NOT NULL,
+    pages        INTEGER NOT NULL DEFAULT 0,
+    ok           INTEGER NOT NULL,
+    error        TEXT
+);
+
+-- уже обработанное (dedup.py): повторно доставленные апдейты и побочные эффекты по сообщению
+CREATE TABLE IF NOT EXISTS dedup_keys (
+    scope  TEXT    NOT NULL,   -- 'update' | 'relay' | ...
+    key    TEXT    NOT NULL,   -- update_id или "chat_id:message_id"
+    ts     INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+    PRIMARY KEY (scope, key)
+) WITHOUT ROWID;
+
 CREATE INDEX IF NOT EXISTS idx_chats_seen ON chats(last_seen_ts);
+CREATE INDEX IF NOT EXISTS idx_dedup_ts ON dedup_keys(ts);
+CREATE INDEX IF NOT EXISTS idx_bt_pending ON broadcast_targets(job_id) WHERE status = 'PENDING';
 CREATE INDEX IF NOT EXISTS idx_invoices_chat ON invoices(chat_id);
+-- частичный индекс открытых заявок: листинг /invoices не растёт вместе с архивом DONE
+CREATE INDEX IF NOT EXISTS idx_invoices_open ON invoices(id) WHERE status != 'DONE';
+-- постраничный браузер /invoices с фильтром по статусу: keyset по id внутри статуса
+CREATE INDEX IF NOT EXISTS idx_invoices_status ON invoices(status, id);
 CREATE INDEX IF NOT EXISTS idx_events_invoice ON invoice_events(invoice_id, id);
 """
 
 
+# холодный архив закрытых заявок (archive.py): те же строки + время переноса.
+# Отдельный файл, подключается ко всем соединениям пула как схема archive.
+ARCHIVE_SQL = """
+PRAGMA archive.journal_mode=WAL;
+
+CREATE TABLE IF NOT EXISTS archive.invoices (
+    id             INTEGER PRIMARY KEY,
+    chat_id        INTEGER NOT NULL,
+    origin_msg_id  INTEGER NOT NULL,
+    author_id      INTEGER NOT NULL,
+    created_ts     INTEGER NOT NULL,
+    status         TEXT    NOT NULL,
+    progress       INTEGER NOT NULL DEFAULT 0,
+    archived_ts    INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS archive.invoice_events (
+    id          INTEGER PRIMARY KEY,
+    invoice_id  INTEGER NOT NULL,
+    ts          INTEGER NOT NULL,
+    actor_id    INTEGER,
+    action      TEXT    NOT NULL,
+    note        TEXT
+);
+
+CREATE TABLE IF NOT EXISTS archive.invoice_cards (
+    manager_id  INTEGER NOT NULL,
+    invoice_id  INTEGER NOT NULL,
+    dm_chat_id  INTEGER NOT NULL,
+    message_id  INTEGER NOT NULL,
+    PRIMARY KEY(manager_id, invoice_id)
+);
+
+CREATE INDEX IF NOT EXISTS archive.idx_events_invoice ON invoice_events(invoice_id, id);
+"""
+
+
+# флаги прогресса заявки: событие invoice_events.action -> бит в invoices.progress
+PROGRESS_FLAGS = {
+    "SENT_TO_ACCOUNTING": 1 << 0,
+    "ACCOUNTING_REPLIED": 1 << 1,
+    "SWIFT_SENT":         1 << 2,
+    "REPORT_REQUESTED":   1 << 3,
+    "POST_FILE_INTENT":   1 << 4,
+    "SWIFT_FILE_INTENT":  1 << 5,
+}
+
+# SQL-выражение «action -> бит» (для бэкфилла и проверки согласованности)
+_PROGRESS_CASE = "CASE action " + " ".join(
+    f"WHEN '{action}' THEN {bit}" for action, bit in PROGRESS_FLAGS.items()
+) + " ELSE 0 END"
+
+# маска по журналу событий: биты различны, поэтому sum(DISTINCT) == побитовое ИЛИ
+PROGRESS_FROM_EVENTS_SQL = f"""
+SELECT invoice_id, sum(DISTINCT {_PROGRESS_CASE}) AS progress
+FROM invoice_events
+GROUP BY invoice_id
+"""
+
+
+# ------------------------- СОЕДИНЕНИЯ -------------------------
+_pool: Optional[DBPool] = None
+
+
+def _pooled(db_path: str) -> bool:
+    return _pool is not None and _pool.is_open and db_path == _pool.path
+
+
+@contextlib.asynccontextmanager
+async def writer(db_path: str = DB_PATH) -> AsyncIterator[aiosqlite.Connection]:
+    """
+    Пишущее соединение для хендлеров и хелперов ниже: commit на выходе, rollback при ошибке.
+    Пока пул не открыт (скрипты, другой db_path) — разовое соединение, как раньше.
+    """
+    if _pooled(db_path):
+        async with _pool.writer() as db:
+            yield db
+        return
+    async with aiosqlite.connect(db_path) as db:
+        yield db
+        await db.commit()
+
+
+@contextlib.asynccontextmanager
+async def reader(db_path: str = DB_PATH) -> AsyncIterator[aiosqlite.Connection]:
+    """Читающее соединение из пула (или разовое, если пул не открыт)."""
+    if _pooled(db_path):
+        async with _pool.reader() as db:
+            yield db
+        return
+    async with aiosqlite.connect(db_path) as db:
+        yield db
+
+
+async def trace_statements(callback) -> None:
+    """Трассировка SQL на соединениях пула (bench/replay.py считает выражения на апдейт)."""
+    if _pool is not None:
+        await _pool.set_trace_callback(callback)
+
+
+# ------------------------- МИГРАЦИИ -------------------------
+async def _column_exists(db: aiosqlite.Connection, table: str, column: str) -> bool:
+    cur = await db.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in await cur.fetchall())
+
+
+async def _migrate_invoice_progress(db: aiosqlite.Connection) -> None:
+    """invoices.progress + одноразовый бэкфилл из существующего журнала событий."""
+    if not await _column_exists(db, "invoices", "progress"):
+        await db.execute("ALTER TABLE invoices ADD COLUMN progress INTEGER NOT NULL DEFAULT 0")
+    await db.execute(f"""
+        UPDATE invoices SET progress = coalesce(
+            (SELECT e.progress FROM ({PROGRESS_FROM_EVENTS_SQL}) e WHERE e.invoice_id = invoices.id), 0)
+    """)
+
+
+# полнотекстовый каталог чатов: триграммы по title/username (подстрочный поиск без скана).
+# external content — текст хранится только в chats, триггеры держат индекс в синхроне;
+# UPSERT активности с тем же названием индекс не трогает (WHEN в триггере обновления).
+CHATS_FTS_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(
+    title, username,
+    content='chats', content_rowid='chat_id', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS chats_fts_ai AFTER INSERT ON chats BEGIN
+    INSERT INTO chats_fts(rowid, title, username) VALUES (new.chat_id, new.title, new.username);
+END;
+
+CREATE TRIGGER IF NOT EXISTS chats_fts_ad AFTER DELETE ON chats BEGIN
+    INSERT INTO chats_fts(chats_fts, rowid, title, username) VALUES ('delete', old.chat_id, old.title, old.username);
+END;
+
+CREATE TRIGGER IF NOT EXISTS chats_fts_au AFTER UPDATE OF title, username ON chats
+WHEN old.title IS NOT new.title OR old.username IS NOT new.username BEGIN
+    INSERT INTO chats_fts(chats_fts, rowid, title, username) VALUES ('delete', old.chat_id, old.title, old.username);
+    INSERT INTO chats_fts(rowid, title, username) VALUES (new.chat_id, new.title, new.username);
+END;
+"""
+
+
+async def _migrate_chats_fts(db: aiosqlite.Connection) -> None:
+    """chats_fts + триггеры синхронизации + индексация уже накопленного каталога."""
+    await db.executescript(CHATS_FTS_SQL)
+    await db.execute("INSERT INTO chats_fts(chats_fts) VALUES ('rebuild')")
+
+
+AUTO_VACUUM_INCREMENTAL = 2  # значение PRAGMA auto_vacuum
+
+
+async def _migrate_incremental_vacuum(db: aiosqlite.Connection) -> None:
+    """
+    auto_vacuum=INCREMENTAL: страницы, освобождённые архиватором, возвращаются из файла без
+    блокирующего VACUUM, и бэкап перестаёт копировать пустые страницы. Новый файл получает режим
+    сразу; существующий — только после полного VACUUM, а он на большой БД долгий, поэтому
+    запускается отдельно: /db_archive vacuum или DB_VACUUM_ON_START=1 (см. init_db).
+    """
+    await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+
+async def _auto_vacuum_mode(db: aiosqlite.Connection) -> int:
+    cur = await db.execute("PRAGMA main.auto_vacuum")
+    return (await cur.fetchone())[0]
+
+
+async def _vacuum_to_incremental(db: aiosqlite.Connection) -> float:
+    """Перевод файла в auto_vacuum=INCREMENTAL полным VACUUM; сколько секунд он занял."""
+    t0 = time.monotonic()
+    # прагма без VACUUM в том же соединении не сохраняется; executescript сначала коммитит
+    await db.executescript("PRAGMA main.auto_vacuum=INCREMENTAL; VACUUM;")
+    return time.monotonic() - t0
+
+
+async def vacuum_incremental() -> Optional[float]:
+    """Однократный VACUUM рабочей БД (держит писатель всё время перезаписи); None — уже INCREMENTAL."""
+    async with writer() as db:
+        if await _auto_vacuum_mode(db) == AUTO_VACUUM_INCREMENTAL:
+            return None
+        took = await _vacuum_to_incremental(db)
+    log.info("[db] VACUUM: auto_vacuum=INCREMENTAL за %.1f с", took)
+    return took
+
+
+# PRAGMA user_version == число применённых миграций
+MIGRATIONS = [
+    _migrate_invoice_progress,
+    _migrate_chats_fts,
+    _migrate_incremental_vacuum,
+]
+
+
+async def _apply_migrations(db: aiosqlite.Connection) -> None:
+    cur = await db.execute("PRAGMA user_version")
+    version = (await cur.fetchone())[0]
+    for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        await migration(db)
+        await db.execute(f"PRAGMA user_version = {i}")
+        await db.commit()
+        log.info("[db] миграция %s (%s) применена", i, migration.__name__)
+
+
 # ------------------------- ИНИЦИАЛИЗАЦИЯ -------------------------
 async def init_db():
+    global _pool
     async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("PRAGMA auto_vacuum=INCREMENTAL")  # действует, только если файл ещё пустой
         await db.executescript(CREATE_SQL)
         await db.commit()
+        await _apply_migrations(db)
+        if await _auto_vacuum_mode(db) != AUTO_VACUUM_INCREMENTAL:
+            if DB_VACUUM_ON_START:
+                log.info("[db] VACUUM для auto_vacuum=INCREMENTAL (DB_VACUUM_ON_START=1)…")
+                log.info("[db] VACUUM готов за %.1f с", await _vacuum_to_incremental(db))
+            else:
+                log.warning("[db] auto_vacuum не INCREMENTAL: место после архивации не возвращается файлу; "
+                            "однократно — /db_archive vacuum или DB_VACUUM_ON_START=1")
+        if ARCHIVE_DB_PATH:
+            # файл архива создаётся здесь: читатели пула подключают его только read-only
+            await db.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+            await db.executescript(ARCHIVE_SQL)
+            await db.commit()
+
+    if _pool is None:
+        _pool = DBPool(DB_PATH, readers=DB_READERS, attach={"archive": ARCHIVE_DB_PATH} if ARCHIVE_DB_PATH else None)
+    await _pool.open()
+    await warm_caches()
+
+
+async def close_db():
+    """Сбросить буферы и закрыть пул соединений (вызывается при остановке бота)."""
+    global _pool
+    if _pool is not None:
+        try:
+            await flush_chats()
+        except Exception:
+            log.exception("[chats] не удалось сбросить буфер активности при остановке")
+        await _pool.close()
+        _pool = None
 
 
 # ------------------------- CHATS -------------------------
-async def upsert_chat(chat_id: int, title: Optional[str], username: Optional[str], type_: str):
-    """Добавить/обновить чат в каталоге."""
+UPSERT_CHAT_SQL = """
+INSERT INTO chats (chat_id, title, username, type, last_seen_ts)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(chat_id) DO UPDATE SET
+    title        = excluded.title,
+    username     = excluded.username,
+    type         = excluded.type,
+    last_seen_ts = max(chats.last_seen_ts, excluded.last_seen_ts)
+"""
+
+# write-behind буфер активности: chat_id -> (title, username, type, last_seen_ts).
+# Каждое сообщение в группе лишь обновляет запись в памяти; в chats уходит
+# одним executemany по таймеру (chat_flush_loop), по порогу размера и при close_db().
+_chat_dirty: dict[int, tuple[Optional[str], Optional[str], str, int]] = {}
+_chat_flush_task: Optional[asyncio.Task] = None
+
+
+def _norm_username(username: Optional[str]) -> Optional[str]:
     if username and username.startswith("@"):
-        username = username[1:]
-    async with aiosqlite.connect(DB_PATH) as db:
+        return username[1:]
+    return username
+
+
+def note_chat(chat_id: int, title: Optional[str], username: Optional[str], type_: str) -> None:
+    """Отметить активность чата без I/O (сброс в БД — отложенный, пачкой)."""
+    global _chat_flush_task
+    _chat_dirty[chat_id] = (title, _norm_username(username), str(type_), int(time.time()))
+    if len(_chat_dirty) >= CHAT_FLUSH_MAX and (_chat_flush_task is None or _chat_flush_task.done()):
+        _chat_flush_task = asyncio.create_task(flush_chats())
+
+
+async def flush_chats() -> int:
+    """Сбросить буфер активности в chats одной транзакцией. Возвращает число строк."""
+    if not _chat_dirty:
+        return 0
+    # записи остаются видимыми для чтений до commit; убираем только не обновлённые за это время
+    batch = dict(_chat_dirty)
+    async with writer() as db:
+        await db.executemany(
+            UPSERT_CHAT_SQL,
+            [(cid, title, uname, type_, ts) for cid, (title, uname, type_, ts) in batch.items()],
+        )
+    for cid, entry in batch.items():
+        if _chat_dirty.get(cid) is entry:
+            del _chat_dirty[cid]
+    return len(batch)
+
+
+async def chat_flush_loop():
+    """Фоновая задача: периодический сброс буфера активности чатов."""
+    while True:
+        await asyncio.sleep(CHAT_FLUSH_EVERY)
+        try:
+            await flush_chats()
+        except Exception:
+            log.exception("[chats] ошибка сброса буфера активности")
+
+
+async def upsert_chat(chat_id: int, title: Optional[str], username: Optional[str], type_: str):
+    """Добавить/обновить чат в каталоге (сразу, с commit — нужно перед ссылками на chat_id)."""
+    _chat_dirty.pop(chat_id, None)  # прямая запись свежее отложенной
+    async with writer() as db:
         await db.execute(
-            """
-            INSERT INTO chats (chat_id, title, username, type, last_seen_ts)
-            VALUES (?, ?, ?, ?, strftime('%s','now'))
-            ON CONFLICT(chat_id) DO UPDATE SET
-                title        = excluded.title,
-                username     = excluded.username,
-                type         = excluded.type,
-                last_seen_ts = excluded.last_seen_ts
-            """,
-            (chat_id, title, username, str(type_)),
+            UPSERT_CHAT_SQL,
+            (chat_id, title, _norm_username(username), str(type_), int(time.time())),
         )
-        await db.commit()
 
 
-async def list_chats_like(q: Optional[str] = None) -> List[Tuple[int, Optional[str], Optional[str], str]]:
-    """[(chat_id, title, username, type)] — при q фильтруем по подстроке в title/username."""
-    limit = 500
-    async with aiosqlite.connect(DB_PATH) as db:
+def _overlay_pending(rows, limit: Optional[int]) -> list:
+    """
+    rows — (chat_id, title, username, type, last_seen_ts) из БД.
+    Накладываем ещё не сброшенные записи буфера, сортируем по активности, режем до limit.
+    """
+    merged = {r[0]: tuple(r) for r in rows}
+    for cid, (title, uname, type_, ts) in _chat_dirty.items():
+        merged[cid] = (cid, title, uname, type_, ts)
+    return sorted(merged.values(), key=lambda r: r[4], reverse=True)[:limit]
+
+
+_CHAT_COLS = "c.chat_id, c.title, c.username, c.type, c.last_seen_ts"
+FTS_MIN_QUERY = 3  # триграммный индекс не ищет подстроки короче трёх символов
+
+
+async def _recent_chats(limit: Optional[int]) -> list:
+    async with reader() as db:
         cur = await db.execute(
-            "SELECT chat_id, title, username, type FROM chats ORDER BY last_seen_ts DESC LIMIT ?",
-            (limit,),
+            f"SELECT {_CHAT_COLS} FROM chats c ORDER BY c.last_seen_ts DESC LIMIT ?",
+            (-1 if limit is None else limit,),
         )
         rows = await cur.fetchall()
+    return _overlay_pending(rows, limit)
 
-    if not q:
-        return rows
 
-    needle = q.casefold()
-    def match(row):
-        title = (row[1] or "").casefold()
-        uname = (row[2] or "").casefold()
-        return (needle in title) or (needle in uname)
+async def search_chats(q: str, limit: Optional[int] = 100) -> List[Tuple[int, Optional[str], Optional[str], str]]:
+    """
+    [(chat_id, title, username, type)] по подстроке в title/username — по всему каталогу.
+    От трёх символов — chats_fts (ранжирование bm25, при равенстве — свежая активность);
+    короче — просмотр каталога по активности с casefold-сравнением.
+    limit=None — все совпадения (адресаты рассылки).
+    """
+    needle = q.strip().lstrip("@")
+    if not needle:
+        return [r[:4] for r in await _recent_chats(limit)]
+    # буфер активности сбрасываем до поиска: новые чаты попадают в индекс и ранжируются наравне
+    await flush_chats()
+
+    if len(needle) >= FTS_MIN_QUERY:
+        phrase = '"' + needle.replace('"', '""') + '"'
+        async with reader() as db:
+            cur = await db.execute(
+                f"""
+                SELECT {_CHAT_COLS}
+                FROM chats_fts f JOIN chats c ON c.chat_id = f.rowid
+                WHERE chats_fts MATCH ?
+                ORDER BY f.rank, c.last_seen_ts DESC
+                LIMIT ?
+                """,
+                (phrase, -1 if limit is None else limit),
+            )
+            return [tuple(r[:4]) for r in await cur.fetchall()]
+
+    # lower()/LIKE в SQLite не знают кириллицы — сравниваем в Python, курсор читается порциями
+    folded = needle.casefold()
+    found = []
+    async with reader() as db:
+        async with db.execute(f"SELECT {_CHAT_COLS} FROM chats c ORDER BY c.last_seen_ts DESC") as cur:
+            async for r in cur:
+                if folded in (r[1] or "").casefold() or folded in (r[2] or "").casefold():
+                    found.append(tuple(r[:4]))
+                    if limit is not None and len(found) >= limit:
+                        break
+    return found
 
-    return [r for r in rows if match(r)]
+
+async def list_chats_like(q: Optional[str] = None) -> List[Tuple[int, Optional[str], Optional[str], str]]:
+    """[(chat_id, title, username, type)] — при q поиск по каталогу (search_chats), иначе последние активные."""
+    if q:
+        return await search_chats(q, limit=500)
+    return [r[:4] for r in await _recent_chats(500)]
 
 
 async def get_target_chats(query: Optional[str]) -> List[Tuple[int, Optional[str], Optional[str]]]:
     """
     [(chat_id, title, username)].
-    'all'/None — до 100 последних; иначе ILIKE по title/username (через lower LIKE).
+    'all'/None — до 100 последних; иначе до 100 лучших совпадений по title/username.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        if not query or query.lower() == "all":
-            cur = await db.execute(
-                "SELECT chat_id, title, username FROM chats ORDER BY last_seen_ts DESC LIMIT 100"
-            )
-        else:
-            q_like = f"%{query.lower()}%"
-            cur = await db.execute(
-                """
-                SELECT chat_id, title, username
-                FROM chats
-                WHERE lower(coalesce(title,'')) LIKE ? OR lower(coalesce(username,'')) LIKE ?
-                ORDER BY last_seen_ts DESC
-                LIMIT 100
-                """,
-                (q_like, q_like),
-            )
-        rows = await cur.fetchall()
-    return rows
+    if not query or query.lower() == "all":
+        rows = await _recent_chats(100)
+    else:
+        rows = await search_chats(query, limit=100)
+    return [r[:3] for r in rows]
+
+
+async def list_chat_ids() -> List[int]:
+    """Все chat_id каталога (для рассылки «all»), включая ещё не сброшенные из буфера."""
+    async with reader() as db:
+        cur = await db.execute("SELECT chat_id FROM chats ORDER BY last_seen_ts DESC")
+        ids = [r[0] for r in await cur.fetchall()]
+    known = set(ids)
+    return ids + [cid for cid in _chat_dirty if cid not in known]
+
+
+# ------------------------- КЭШ ГОРЯЧИХ ТАБЛИЦ -------------------------
+# write-through кэш для manager_selection / manager_mode / start_msg / manager_digest:
+# чтения на горячем пути (каждое ЛС менеджера, каждый файл) не ходят в БД,
+# записи сначала коммитятся в БД и только потом попадают в кэш.
+# None в кэше — «строки нет». TTL ограничивает расхождение, если БД правит другой процесс.
+_selection_cache = TTLCache("manager_selection", maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL)
+_mode_cache = TTLCache("manager_mode", maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL)
+_start_msg_cache = TTLCache("start_msg", maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL)
+_digest_cache = TTLCache("manager_digest", maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL)
+CACHES = (_selection_cache, _mode_cache, _start_msg_cache, _digest_cache)
+
+
+@contextlib.asynccontextmanager
+async def _write_through(cache: TTLCache, key, db_path: str = DB_PATH) -> AsyncIterator[aiosqlite.Connection]:
+    """writer(), после которого ключ кэша обновляет вызывающий; при ошибке ключ сбрасывается."""
+    try:
+        async with writer(db_path) as db:
+            yield db
+    except BaseException:
+        cache.invalidate(key)
+        raise
+
+
+async def warm_caches() -> None:
+    """Прогрев на старте: таблицы крошечные (по строке на менеджера), грузим целиком."""
+    for cache in CACHES:
+        cache.clear()
+    async with reader() as db:
+        cur = await db.execute("SELECT manager_id, chat_id FROM manager_selection")
+        selections = dict(await cur.fetchall())
+        cur = await db.execute("SELECT manager_id, invoice_id, action FROM manager_mode")
+        modes = {r[0]: (r[1], r[2]) for r in await cur.fetchall()}
+        cur = await db.execute("SELECT manager_id, msg_id, chat_id FROM start_msg")
+        start_msgs = {r[0]: (r[1], r[2]) for r in await cur.fetchall()}
+        cur = await db.execute("SELECT manager_id, window_sec FROM manager_digest")
+        digests = dict(await cur.fetchall())
+
+    for cache, rows in ((_selection_cache, selections), (_mode_cache, modes), (_start_msg_cache, start_msgs),
+                        (_digest_cache, digests)):
+        for manager_id in set(rows) | set(MANAGER_IDS):
+            cache.put(manager_id, rows.get(manager_id))
+
+
+def cache_stats() -> dict[str, dict]:
+    return {cache.name: cache.stats() for cache in CACHES}
 
 
 # ------------------------- MANAGER SELECTION -------------------------
 async def set_selection(manager_id: int, chat_id: int, db_path: str = DB_PATH) -> None:
-    async with aiosqlite.connect(db_path) as db:
+    async with _write_through(_selection_cache, manager_id, db_path) as db:
         await db.execute(
             """
             INSERT INTO manager_selection (manager_id, chat_id)
@@ -166,19 +597,57 @@ async def set_selection(manager_id: int, chat_id: int, db_path: str = DB_PATH) -
             """,
             (manager_id, chat_id),
         )
-        await db.commit()
+    if db_path == DB_PATH:
+        _selection_cache.put(manager_id, chat_id)
+
+
+async def set_selection_many(manager_ids, chat_id: int) -> None:
+    """Одним commit выставить выбранный чат сразу нескольким менеджерам."""
+    manager_ids = list(manager_ids)
+    try:
+        async with writer() as db:
+            await db.executemany(
+                """
+                INSERT INTO manager_selection (manager_id, chat_id)
+                VALUES (?, ?)
+                ON CONFLICT(manager_id) DO UPDATE SET chat_id = excluded.chat_id
+                """,
+                [(manager_id, chat_id) for manager_id in manager_ids],
+            )
+    except BaseException:
+        for manager_id in manager_ids:
+            _selection_cache.invalidate(manager_id)
+        raise
+    for manager_id in manager_ids:
+        _selection_cache.put(manager_id, chat_id)
 
 
 async def get_selection(manager_id: int, db_path: str = DB_PATH) -> Optional[int]:
-    async with aiosqlite.connect(db_path) as db:
+    use_cache = db_path == DB_PATH
+    if use_cache:
+        cached = _selection_cache.get(manager_id)
+        if cached is not MISSING:
+            return cached
+        writes_seen = _selection_cache.writes
+    async with reader(db_path) as db:
         cur = await db.execute("SELECT chat_id FROM manager_selection WHERE manager_id = ?", (manager_id,))
         row = await cur.fetchone()
-    return row[0] if row else None
+    value = row[0] if row else None
+    if use_cache:
+        _selection_cache.fill(manager_id, value, writes_seen)
+    return value
 
 
 # ------------------------- INVOICES -------------------------
 async def create_invoice(chat_id: int, origin_msg_id: int, author_id: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Идемпотентно: для уже заведённого (chat_id, origin_msg_id) возвращает id существующей заявки."""
+    async with writer() as db:
+        cur = await db.execute(
+            "SELECT id FROM invoices WHERE chat_id=? AND origin_msg_id=?", (chat_id, origin_msg_id)
+        )
+        row = await cur.fetchone()
+        if row:
+            return row[0]
         # 1) вставляем ЗАЯВКУ и сразу сохраняем её id
         cur = await db.execute(
             "INSERT INTO invoices(chat_id, origin_msg_id, author_id) VALUES(?,?,?)",
@@ -192,21 +661,32 @@ async def create_invoice(chat_id: int, origin_msg_id: int, author_id: int) -> in
             (invoice_id, 'CREATED', author_id)
         )
 
-        await db.commit()
         return invoice_id
 
 
+def _archive_attached() -> bool:
+    return _pooled(DB_PATH) and "archive" in _pool.attached
+
+
 async def get_invoice(invoice_id: int) -> Optional[Tuple[int, int, int, int, int, str]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Заявка по id; перенесённые в архив (archive.py) ищутся там же, тем же кортежем."""
+    async with reader() as db:
         cur = await db.execute(
-            "SELECT id, chat_id, origin_msg_id, author_id, created_ts, status FROM invoices WHERE id=?",
+            "SELECT id, chat_id, origin_msg_id, author_id, created_ts, status FROM main.invoices WHERE id=?",
             (invoice_id,),
         )
-        return await cur.fetchone()
+        row = await cur.fetchone()
+        if row is None and _archive_attached():
+            cur = await db.execute(
+                "SELECT id, chat_id, origin_msg_id, author_id, created_ts, status FROM archive.invoices WHERE id=?",
+                (invoice_id,),
+            )
+            row = await cur.fetchone()
+        return row
 
 
 async def list_invoices(limit: int = 30) -> List[Tuple[int, int, int, int, int, str]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader() as db:
         cur = await db.execute(
             "SELECT id, chat_id, origin_msg_id, author_id, created_ts, status FROM invoices ORDER BY id DESC LIMIT ?",
             (limit,),
@@ -214,29 +694,178 @@ async def list_invoices(limit: int = 30) -> List[Tuple[int, int, int, int, int,
         return await cur.fetchall()
 
 
-async def set_invoice_status(invoice_id: int, status: str, actor_id: Optional[int], note: Optional[str] = None):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE invoices SET status=? WHERE id=?", (status, invoice_id))
+async def set_invoice_status(invoice_id: int, status: str, actor_id: Optional[int],
+                             note: Optional[str] = None, only_if_changed: bool = False) -> bool:
+    """
+    False — заявки нет в рабочей таблице (например, уже в архиве): событие не пишется.
+    only_if_changed — уже сделанное действие (двойной клик, повторная доставка, повторное нажатие
+    после других действий) ничего не пишет: проверяется бит прогресса, для DONE — статус.
+    Закрытую заявку такие действия тоже не трогают (не переоткрывают).
+    """
+    action = status if status != 'NEW' else 'NOTE'
+    bit = PROGRESS_FLAGS.get(action, 0)
+    sql, params = "UPDATE invoices SET status=?, progress = progress | ? WHERE id=?", [status, bit, invoice_id]
+    if only_if_changed:
+        sql += " AND status != 'DONE'"
+        if bit:
+            sql += " AND (progress & ?) = 0"
+            params.append(bit)
+        else:
+            sql += " AND status != ?"
+            params.append(status)
+    async with writer() as db:
+        # статус и битовая маска прогресса — в той же транзакции, что и событие
+        cur = await db.execute(sql, params)
+        if not cur.rowcount:
+            return False
         await db.execute(
             "INSERT INTO invoice_events(invoice_id, action, actor_id, note) VALUES(?,?,?,?)",
-            (invoice_id, status if status != 'NEW' else 'NOTE', actor_id, note),
+            (invoice_id, action, actor_id, note),
         )
-        await db.commit()
+        return True
 
 
 # — история по заявке (если нужно где-то показать)
 async def list_invoice_events(invoice_id: int) -> List[Tuple[int, int, int, Optional[int], str, Optional[str]]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader() as db:
         cur = await db.execute(
-            "SELECT id, invoice_id, ts, actor_id, action, note FROM invoice_events WHERE invoice_id=? ORDER BY id ASC",
+            "SELECT id, invoice_id, ts, actor_id, action, note FROM main.invoice_events WHERE invoice_id=? ORDER BY id ASC",
             (invoice_id,),
         )
-        return await cur.fetchall()
+        rows = await cur.fetchall()
+        if not rows and _archive_attached():
+            cur = await db.execute(
+                "SELECT id, invoice_id, ts, actor_id, action, note FROM archive.invoice_events"
+                " WHERE invoice_id=? ORDER BY id ASC",
+                (invoice_id,),
+            )
+            rows = await cur.fetchall()
+        return rows
+
+
+# ------------------------- АРХИВ ЗАКРЫТЫХ ЗАЯВОК -------------------------
+def _in_list(ids) -> str:
+    return ",".join("?" * len(ids))
+
+
+async def archive_done_invoices(cutoff_ts: int, after_id: int, limit: int) -> tuple[int, Optional[int]]:
+    """
+    Одна пачка архиватора: заявки DONE, закрытые раньше cutoff_ts, с id > after_id.
+    Возвращает (перенесено, последний просмотренный id | None — кандидатов больше нет).
+
+    В WAL транзакция над несколькими файлами атомарна только для каждого файла отдельно,
+    поэтому перенос — две транзакции, каждая пишет в один файл:
+      1) копия заявок, событий и карточек в archive (INSERT OR REPLACE — повтор безопасен);
+      2) удаление из main только тех заявок, чья копия совпадает с рабочей строкой и у которых
+         нет событий, не попавших в архив (заявку переоткрыли/дописали между шагами — она
+         остаётся в рабочих таблицах до следующего прохода).
+    Сбой между шагами оставляет заявку в обеих БД; get_invoice читает рабочую копию первой.
+    """
+    async with writer() as db:
+        cur = await db.execute(
+            """
+            SELECT i.id FROM main.invoices i
+            WHERE i.status = 'DONE' AND i.id > ?
+              AND coalesce((SELECT max(e.ts) FROM main.invoice_events e
+                            WHERE e.invoice_id = i.id AND e.action = 'DONE'), i.created_ts) < ?
+            ORDER BY i.id
+            LIMIT ?
+            """,
+            (after_id, cutoff_ts, limit),
+        )
+        ids = [row[0] for row in await cur.fetchall()]
+        if not ids:
+            return 0, None
+        marks = _in_list(ids)
+        await db.execute(
+            f"""
+            INSERT OR REPLACE INTO archive.invoices
+                (id, chat_id, origin_msg_id, author_id, created_ts, status, progress, archived_ts)
+            SELECT id, chat_id, origin_msg_id, author_id, created_ts, status, progress, ?
+            FROM main.invoices WHERE id IN ({marks})
+            """,
+            (int(time.time()), *ids),
+        )
+        await db.execute(
+            f"""
+            INSERT OR REPLACE INTO archive.invoice_events(id, invoice_id, ts, actor_id, action, note)
+            SELECT id, invoice_id, ts, actor_id, action, note FROM main.invoice_events WHERE invoice_id IN ({marks})
+            """,
+            ids,
+        )
+        await db.execute(
+            f"""
+            INSERT OR REPLACE INTO archive.invoice_cards(manager_id, invoice_id, dm_chat_id, message_id)
+            SELECT manager_id, invoice_id, dm_chat_id, message_id FROM main.invoice_cards WHERE invoice_id IN ({marks})
+            """,
+            ids,
+        )
+
+    async with writer() as db:
+        cur = await db.execute(
+            f"""
+            SELECT i.id FROM main.invoices i
+            JOIN archive.invoices a ON a.id = i.id AND a.status = i.status AND a.progress = i.progress
+            WHERE i.id IN ({marks}) AND i.status = 'DONE'
+              AND NOT EXISTS (SELECT 1 FROM main.invoice_events e
+                              WHERE e.invoice_id = i.id
+                                AND NOT EXISTS (SELECT 1 FROM archive.invoice_events ae WHERE ae.id = e.id))
+            """,
+            ids,
+        )
+        movable = [row[0] for row in await cur.fetchall()]
+        if movable:
+            marks = _in_list(movable)
+            for table, column in (("invoice_events", "invoice_id"), ("invoice_cards", "invoice_id"),
+                                  ("manager_mode", "invoice_id"), ("invoices", "id")):
+                await db.execute(f"DELETE FROM main.{table} WHERE {column} IN ({marks})", movable)
+    return len(movable), ids[-1]
+
+
+async def reclaim_free_pages(max_pages: int) -> int:
+    """
+    Вернуть файлу до max_pages свободных страниц рабочей БД (incremental_vacuum); сколько осталось.
+    0 — продолжать не нужно: всё возвращено, шаг ничего не освободил, или файл не в
+    auto_vacuum=INCREMENTAL (там прагма ничего не делает — место вернёт только /db_archive vacuum).
+    """
+    async with writer() as db:
+        if await _auto_vacuum_mode(db) != AUTO_VACUUM_INCREMENTAL:
+            return 0
+        cur = await db.execute("PRAGMA main.freelist_count")
+        before = (await cur.fetchone())[0]
+        # execute() делает один шаг прагмы (= одна страница); executescript прогоняет её до конца
+        await db.executescript(f"PRAGMA main.incremental_vacuum({int(max_pages)});")
+        cur = await db.execute("PRAGMA main.freelist_count")
+        left = (await cur.fetchone())[0]
+        return left if left < before else 0
+
+
+async def archive_stats() -> dict[str, dict[str, int]]:
+    """
+    Размеры горячих и холодных таблиц для /db_archive:
+    {"main"|"archive": {"invoices", "invoice_events", "invoice_cards", "bytes", "free_pages"}}.
+    """
+    schemas = ["main"] + (["archive"] if _archive_attached() else [])
+    result = {}
+    async with reader() as db:
+        for schema in schemas:
+            st = {}
+            for table in ("invoices", "invoice_events", "invoice_cards"):
+                cur = await db.execute(f"SELECT count(*) FROM {schema}.{table}")
+                st[table] = (await cur.fetchone())[0]
+            pragmas = {}
+            for pragma in ("page_count", "page_size", "freelist_count"):
+                cur = await db.execute(f"PRAGMA {schema}.{pragma}")
+                pragmas[pragma] = (await cur.fetchone())[0]
+            st["bytes"] = pragmas["page_count"] * pragmas["page_size"]
+            st["free_pages"] = pragmas["freelist_count"]
+            result[schema] = st
+    return result
 
 
 # ------------------------- MANAGER MODE (ожидание файла) -------------------------
 async def set_mode(manager_id: int, invoice_id: int, action: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write_through(_mode_cache, manager_id) as db:
         await db.execute(
             """
             INSERT INTO manager_mode(manager_id, invoice_id, action)
@@ -245,47 +874,125 @@ async def set_mode(manager_id: int, invoice_id: int, action: str):
             """,
             (manager_id, invoice_id, action),
         )
-        await db.commit()
+    _mode_cache.put(manager_id, (invoice_id, action))
 
 
 async def get_mode(manager_id: int) -> Optional[tuple[int, str]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    cached = _mode_cache.get(manager_id)
+    if cached is not MISSING:
+        return cached
+    writes_seen = _mode_cache.writes
+    async with reader() as db:
         cur = await db.execute("SELECT invoice_id, action FROM manager_mode WHERE manager_id=?", (manager_id,))
         row = await cur.fetchone()
-        return (row[0], row[1]) if row else None
+    value = (row[0], row[1]) if row else None
+    _mode_cache.fill(manager_id, value, writes_seen)
+    return value
 
 
 async def clear_mode(manager_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write_through(_mode_cache, manager_id) as db:
         await db.execute("DELETE FROM manager_mode WHERE manager_id=?", (manager_id,))
-        await db.commit()
+    _mode_cache.put(manager_id, None)
+
+
+# ------------------------- MANAGER DIGEST -------------------------
+async def set_digest(manager_id: int, window_sec: int) -> None:
+    """Включить дайджест с окном window_sec; 0 — выключить."""
+    async with _write_through(_digest_cache, manager_id) as db:
+        if window_sec > 0:
+            await db.execute(
+                """
+                INSERT INTO manager_digest(manager_id, window_sec) VALUES(?,?)
+                ON CONFLICT(manager_id) DO UPDATE SET window_sec=excluded.window_sec
+                """,
+                (manager_id, window_sec),
+            )
+        else:
+            await db.execute("DELETE FROM manager_digest WHERE manager_id=?", (manager_id,))
+    _digest_cache.put(manager_id, window_sec if window_sec > 0 else None)
+
+
+async def get_digest(manager_id: int) -> Optional[int]:
+    """Окно дайджеста менеджера в секундах; None — запросы приходят сразу."""
+    cached = _digest_cache.get(manager_id)
+    if cached is not MISSING:
+        return cached
+    writes_seen = _digest_cache.writes
+    async with reader() as db:
+        cur = await db.execute("SELECT window_sec FROM manager_digest WHERE manager_id=?", (manager_id,))
+        row = await cur.fetchone()
+    value = row[0] if row else None
+    _digest_cache.fill(manager_id, value, writes_seen)
+    return value
+
+
+# ------------------------- DEDUP -------------------------
+async def claim_key(scope: str, key: str) -> bool:
+    """Записать ключ; False — он уже был (действие выполнено раньше, в том числе до рестарта)."""
+    async with writer() as db:
+        cur = await db.execute("INSERT OR IGNORE INTO dedup_keys(scope, key) VALUES(?,?)", (scope, key))
+        return cur.rowcount == 1
+
+
+async def release_key(scope: str, key: str) -> None:
+    async with writer() as db:
+        await db.execute("DELETE FROM dedup_keys WHERE scope=? AND key=?", (scope, key))
+
+
+async def save_keys(scope: str, keys: list[str]) -> None:
+    """Пачка ключей одним commit (write-behind обработанных update_id)."""
+    if not keys:
+        return
+    async with writer() as db:
+        await db.executemany("INSERT OR IGNORE INTO dedup_keys(scope, key) VALUES(?,?)", [(scope, k) for k in keys])
+
+
+async def recent_keys(since_ts: int) -> list[tuple[str, str]]:
+    async with reader() as db:
+        cur = await db.execute("SELECT scope, key FROM dedup_keys WHERE ts >= ?", (since_ts,))
+        return await cur.fetchall()
+
+
+async def prune_keys(before_ts: int) -> int:
+    async with writer() as db:
+        cur = await db.execute("DELETE FROM dedup_keys WHERE ts < ?", (before_ts,))
+        return cur.rowcount
 
 
 # ------------------------- BACKUP -------------------------
 async def sqlite_checkpoint():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with writer() as db:
         await db.execute("PRAGMA wal_checkpoint(TRUNCATE);")
-        await db.commit()
-
 
-async def sqlite_backup_once():
-    # BACKUP_DIR может быть строкой — приведём к Path
-    bdir = Path(BACKUP_DIR) if not isinstance(BACKUP_DIR, Path) else BACKUP_DIR
-    bdir.mkdir(parents=True, exist_ok=True)
 
-    ts = time.strftime("%Y%m%d_%H%M%S")
-    path = bdir / f"bot_{ts}.sqlite"
+async def record_backup_run(started_ts: int, path: Optional[str], size_bytes: int, duration_ms: int,
+                            pages: int, ok: bool, error: Optional[str]) -> None:
+    async with writer() as db:
+        await db.execute(
+            """
+            INSERT INTO backup_runs(started_ts, path, size_bytes, duration_ms, pages, ok, error)
+            VALUES(?,?,?,?,?,?,?)
+            """,
+            (started_ts, path, size_bytes, duration_ms, pages, int(ok), error),
+        )
 
-    backup_str = path.as_posix().replace("'", "''")
-    sql = f"VACUUM INTO '{backup_str}'"
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(sql)
-        await db.commit()
-    return path
+# === СВОДНОЕ СОСТОЯНИЕ ЗАЯВКИ ===
+def progress_state(status: str, progress: int) -> dict:
+    """Расшифровка invoices.progress в словарь флагов (см. get_invoice_state)."""
+    return {
+        "status": status,
+        "sent_to_accounting": bool(progress & PROGRESS_FLAGS["SENT_TO_ACCOUNTING"]),
+        "accounting_replied": bool(progress & PROGRESS_FLAGS["ACCOUNTING_REPLIED"]),
+        "swift_sent": bool(progress & PROGRESS_FLAGS["SWIFT_SENT"]),
+        "report_requested": bool(progress & PROGRESS_FLAGS["REPORT_REQUESTED"]),
+        # «намерения» скрывают кнопки сразу после нажатия
+        "post_file_started": bool(progress & PROGRESS_FLAGS["POST_FILE_INTENT"]),
+        "swift_started": bool(progress & PROGRESS_FLAGS["SWIFT_FILE_INTENT"]),
+    }
 
 
-# === СВОДНОЕ СОСТОЯНИЕ ЗАЯВКИ ===
 async def get_invoice_state(invoice_id: int):
     """
     Возвращает сводное состояние заявки + флаги «намерений»:
@@ -298,97 +1005,144 @@ async def get_invoice_state(invoice_id: int):
       "post_file_started": bool,   # нажата кнопка "Файл в группу"
       "swift_started": bool        # нажата кнопка "SWIFT"
     }
+    Читается одна строка invoices (маска progress), без скана invoice_events.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT status FROM invoices WHERE id=?", (invoice_id,))
+    async with reader() as db:
+        cur = await db.execute("SELECT status, progress FROM invoices WHERE id=?", (invoice_id,))
         row = await cur.fetchone()
-        if not row:
-            return None
-        status = row[0]
-
-        cur = await db.execute(
-            "SELECT action FROM invoice_events WHERE invoice_id=?",
-            (invoice_id,)
-        )
-        actions = {r[0] for r in await cur.fetchall()}
-
-    return {
-        "status": status,
-        "sent_to_accounting": "SENT_TO_ACCOUNTING" in actions,
-        "accounting_replied": "ACCOUNTING_REPLIED" in actions,
-        "swift_sent": "SWIFT_SENT" in actions,
-        "report_requested": "REPORT_REQUESTED" in actions,
-        # «намерения» скрывают кнопки сразу после нажатия
-        "post_file_started": "POST_FILE_INTENT" in actions,
-        "swift_started": "SWIFT_FILE_INTENT" in actions,
-    }
+    if not row:
+        return None
+    return progress_state(row[0], row[1])
 
 
-# db.py — ЗАМЕНИ list_open_invoices_with_state
-async def list_open_invoices_with_state(limit: int = 20):
+async def check_invoice_progress(fix: bool = False) -> list[tuple[int, int, int]]:
+    """
+    Сверка invoices.progress с журналом invoice_events.
+    Возвращает [(invoice_id, в_таблице, по_событиям)] расхождений; fix=True — чинит их.
+    """
+    async with reader() as db:
+        cur = await db.execute(f"""
+            SELECT i.id, i.progress, coalesce(e.progress, 0)
+            FROM invoices i
+            LEFT JOIN ({PROGRESS_FROM_EVENTS_SQL}) e ON e.invoice_id = i.id
+            WHERE i.progress != coalesce(e.progress, 0)
+            ORDER BY i.id
+        """)
+        mismatches = await cur.fetchall()
+
+    if fix and mismatches:
+        async with writer() as db:
+            await db.executemany(
+                "UPDATE invoices SET progress=? WHERE id=?",
+                [(expected, iid) for iid, _, expected in mismatches],
+            )
+    return mismatches
+
+
+def _invoice_checklist(st: dict) -> tuple[list[str], list[str]]:
+    """Чек-лист заявки по progress_state: (сделано, осталось)."""
+    done = []
+    if st["sent_to_accounting"]:
+        done.append("✅ Отправлено в бух")
+    if st["accounting_replied"]:
+        done.append("📎 Файл в группе")
+    if st["swift_sent"]:
+        done.append("📄 SWIFT отправлен")
+    if st["report_requested"]:
+        done.append("📝 Отчёт запрошен")
+
+    remaining = []
+    if not st["sent_to_accounting"]:
+        remaining.append("✅ Отправить в бух")
+    if not st["accounting_replied"]:
+        remaining.append("📎 Файл в группу")
+    if not st["swift_sent"]:
+        remaining.append("📄 SWIFT")
+    if not st["report_requested"]:
+        remaining.append("📝 Запросить отчёт")
+    return done, remaining
+
+
+async def list_invoices_page(status: Optional[str] = "OPEN", chat_id: Optional[int] = None,
+                             before: Optional[int] = None, after: Optional[int] = None, limit: int = 10):
     """
-    Список открытых заявок (status != DONE) + чек-лист действий.
+    Страница заявок с чек-листом — keyset по invoices.id, без OFFSET.
+    status: 'OPEN' — все, кроме DONE; None — любые; иначе точное значение invoices.status.
+    before — заявки старше id (следующая страница), after — новее id (предыдущая); порядок всегда id DESC.
+    Один запрос по индексу: idx_invoices_open / idx_invoices_status / idx_invoices_chat.
     Возвращает items: {
-      id, chat_id, created_ts, status,
+      id, chat_id, chat_title, created_ts, status,
       done: [строки], remaining: [строки]
     }
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    where, params = [], []
+    if status == "OPEN":
+        where.append("i.status != 'DONE'")
+    elif status is not None:
+        where.append("i.status = ?")
+        params.append(status)
+    if chat_id is not None:
+        where.append("i.chat_id = ?")
+        params.append(chat_id)
+    if after is not None:
+        where.append("i.id > ?")
+        params.append(after)
+        order = "ASC"
+    else:
+        if before is not None:
+            where.append("i.id < ?")
+            params.append(before)
+        order = "DESC"
+
+    async with reader() as db:
         cur = await db.execute(
-            "SELECT id, chat_id, created_ts, status FROM invoices WHERE status != 'DONE' ORDER BY id DESC LIMIT ?",
-            (limit,),
+            f"""
+            SELECT i.id, i.chat_id, c.title, i.created_ts, i.status, i.progress
+            FROM invoices i
+            LEFT JOIN chats c ON c.chat_id = i.chat_id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY i.id {order}
+            LIMIT ?
+            """,
+            (*params, limit),
         )
         rows = await cur.fetchall()
+    if order == "ASC":
+        rows.reverse()
 
     result = []
-    for iid, chat_id, created_ts, status in rows:
-        st = await get_invoice_state(iid)
-        if not st:
-            continue
-
-        done = []
-        if st["sent_to_accounting"]:
-            done.append("✅ Отправлено в бух")
-        if st["accounting_replied"]:
-            done.append("📎 Файл в группе")
-        if st["swift_sent"]:
-            done.append("📄 SWIFT отправлен")
-        if st["report_requested"]:
-            done.append("📝 Отчёт запрошен")
-
-        remaining = []
-        if not st["sent_to_accounting"]:
-            remaining.append("✅ Отправить в бух")
-        if not st["accounting_replied"]:
-            remaining.append("📎 Файл в группу")
-        if not st["swift_sent"]:
-            remaining.append("📄 SWIFT")
-        if not st["report_requested"]:
-            remaining.append("📝 Запросить отчёт")
-
+    for iid, chat_id_, chat_title, created_ts, status_, progress in rows:
+        done, remaining = _invoice_checklist(progress_state(status_, progress))
         result.append({
             "id": iid,
-            "chat_id": chat_id,
+            "chat_id": chat_id_,
+            "chat_title": chat_title,
             "created_ts": created_ts,
-            "status": status,
+            "status": status_,
             "done": done,
             "remaining": remaining,
         })
     return result
 
 
+async def list_open_invoices_with_state(limit: int = 20):
+    """Последние открытые заявки (status != DONE) + чек-лист действий — первая страница list_invoices_page."""
+    return await list_invoices_page("OPEN", limit=limit)
+
 
 async def add_event(invoice_id: int, action: str, actor_id: int, note: Optional[str] = None):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with writer() as db:
         await db.execute(
             "INSERT INTO invoice_events(invoice_id, action, actor_id, note) VALUES(?,?,?,?)",
             (invoice_id, action, actor_id, note),
         )
-        await db.commit()
+        flag = PROGRESS_FLAGS.get(action, 0)
+        if flag:
+            await db.execute("UPDATE invoices SET progress = progress | ? WHERE id=?", (flag, invoice_id))
 
 
 async def save_invoice_card(manager_id: int, invoice_id: int, dm_chat_id: int, message_id: int) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with writer() as db:
         await db.execute("""
             INSERT INTO invoice_cards(manager_id, invoice_id, dm_chat_id, message_id)
             VALUES(?,?,?,?)
@@ -396,11 +1150,24 @@ async def save_invoice_card(manager_id: int, invoice_id: int, dm_chat_id: int, m
                 dm_chat_id=excluded.dm_chat_id,
                 message_id=excluded.message_id
         """, (manager_id, invoice_id, dm_chat_id, message_id))
-        await db.commit()
+
+async def save_invoice_cards(rows) -> None:
+    """Пакетная запись карточек: rows = [(manager_id, invoice_id, dm_chat_id, message_id), ...]."""
+    if not rows:
+        return
+    async with writer() as db:
+        await db.executemany("""
+            INSERT INTO invoice_cards(manager_id, invoice_id, dm_chat_id, message_id)
+            VALUES(?,?,?,?)
+            ON CONFLICT(manager_id, invoice_id) DO UPDATE SET
+                dm_chat_id=excluded.dm_chat_id,
+                message_id=excluded.message_id
+        """, rows)
+
 
 async def get_invoice_cards(invoice_id: int) -> list[tuple[int, int, int]]:
     # (manager_id, dm_chat_id, message_id)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader() as db:
         cur = await db.execute(
             "SELECT manager_id, dm_chat_id, message_id FROM invoice_cards WHERE invoice_id=?",
             (invoice_id,)
@@ -413,7 +1180,7 @@ async def get_invoice_card_for_manager(invoice_id: int, manager_id: int) -> Opti
     Вернёт (dm_chat_id, message_id) карточки заявки для этого менеджера,
     либо None, если карточка ещё не отправлялась.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader() as db:
         cur = await db.execute(
             "SELECT dm_chat_id, message_id FROM invoice_cards WHERE invoice_id=? AND manager_id=?",
             (invoice_id, manager_id),
@@ -423,7 +1190,7 @@ async def get_invoice_card_for_manager(invoice_id: int, manager_id: int) -> Opti
     
 
 async def set_chat_status_msg(manager_id: int, chat_id: int, msg_id: int, db_path: str = DB_PATH) -> None:
-    async with aiosqlite.connect(db_path) as db:
+    async with _write_through(_start_msg_cache, manager_id, db_path) as db:
         await db.execute(
             """
             INSERT INTO start_msg (manager_id, chat_id, msg_id)
@@ -434,10 +1201,110 @@ async def set_chat_status_msg(manager_id: int, chat_id: int, msg_id: int, db_pat
             """,
             (manager_id, chat_id, msg_id),
         )
-        await db.commit()
+    if db_path == DB_PATH:
+        _start_msg_cache.put(manager_id, (msg_id, chat_id))
 
 async def get_chat_status_msg(manager_id: int, db_path: str = DB_PATH) -> Optional[tuple[int, int]]:
-    async with aiosqlite.connect(db_path) as db:
+    use_cache = db_path == DB_PATH
+    if use_cache:
+        cached = _start_msg_cache.get(manager_id)
+        if cached is not MISSING:
+            return cached
+        writes_seen = _start_msg_cache.writes
+    async with reader(db_path) as db:
         cur = await db.execute("SELECT msg_id,chat_id FROM start_msg WHERE manager_id = ?", (manager_id,))
         row = await cur.fetchone()
-    return row if row else None 
\ No newline at end of file
+    value = (row[0], row[1]) if row else None
+    if use_cache:
+        _start_msg_cache.fill(manager_id, value, writes_seen)
+    return value
+
+
+# ------------------------- BROADCAST JOBS -------------------------
+async def create_broadcast_job(created_by: int, text: str, chat_ids) -> int:
+    async with writer() as db:
+        cur = await db.execute(
+            "INSERT INTO broadcast_jobs(created_by, text) VALUES(?, ?)",
+            (created_by, text),
+        )
+        job_id = cur.lastrowid
+        await db.executemany(
+            "INSERT OR IGNORE INTO broadcast_targets(job_id, chat_id) VALUES(?, ?)",
+            [(job_id, cid) for cid in chat_ids],
+        )
+        return job_id
+
+
+async def get_broadcast_job(job_id: int) -> Optional[tuple[int, int, str, str, Optional[int], Optional[int]]]:
+    """(id, created_by, text, status, progress_chat_id, progress_msg_id)"""
+    async with reader() as db:
+        cur = await db.execute(
+            "SELECT id, created_by, text, status, progress_chat_id, progress_msg_id FROM broadcast_jobs WHERE id=?",
+            (job_id,),
+        )
+        return await cur.fetchone()
+
+
+async def set_broadcast_status(job_id: int, status: str) -> None:
+    async with writer() as db:
+        await db.execute("UPDATE broadcast_jobs SET status=? WHERE id=?", (status, job_id))
+
+
+async def set_broadcast_progress_msg(job_id: int, chat_id: int, msg_id: int) -> None:
+    async with writer() as db:
+        await db.execute(
+            "UPDATE broadcast_jobs SET progress_chat_id=?, progress_msg_id=? WHERE id=?",
+            (chat_id, msg_id, job_id),
+        )
+
+
+async def list_running_broadcasts() -> List[int]:
+    async with reader() as db:
+        cur = await db.execute("SELECT id FROM broadcast_jobs WHERE status='RUNNING' ORDER BY id")
+        return [r[0] for r in await cur.fetchall()]
+
+
+async def next_broadcast_targets(job_id: int, limit: int) -> List[int]:
+    async with reader() as db:
+        cur = await db.execute(
+            "SELECT chat_id FROM broadcast_targets WHERE job_id=? AND status='PENDING' LIMIT ?",
+            (job_id, limit),
+        )
+        return [r[0] for r in await cur.fetchall()]
+
+
+async def mark_broadcast_targets(job_id: int, results) -> None:
+    """results = [(chat_id, 'SENT'|'FAILED', error|None), ...] — одной транзакцией."""
+    if not results:
+        return
+    async with writer() as db:
+        await db.executemany(
+            "UPDATE broadcast_targets SET status=?, error=? WHERE job_id=? AND chat_id=?",
+            [(status, error, job_id, cid) for cid, status, error in results],
+        )
+
+
+async def broadcast_counts(job_id: int) -> dict[str, int]:
+    """{'PENDING': n, 'SENT': n, 'FAILED': n}"""
+    async with reader() as db:
+        cur = await db.execute(
+            "SELECT status, count(*) FROM broadcast_targets WHERE job_id=? GROUP BY status",
+            (job_id,),
+        )
+        counts = dict(await cur.fetchall())
+    return {k: counts.get(k, 0) for k in ("PENDING", "SENT", "FAILED")}
+
+
+async def broadcast_errors(job_id: int, limit: int = 5) -> List[tuple[int, str]]:
+    async with reader() as db:
+        cur = await db.execute(
+            "SELECT chat_id, error FROM broadcast_targets WHERE job_id=? AND status='FAILED' LIMIT ?",
+            (job_id, limit),
+        )
+        return await cur.fetchall()
+
+
+# ------------------------- МЕТРИКИ -------------------------
+# время каждого публичного вызова -> bot_db_seconds{query="<имя функции>"};
+# обёртка ставится до того, как хендлеры делают `from db import ...`
+instrument_module(globals(), __name__, skip=("chat_flush_loop", "trace_statements"))
@@ -0,0 +1,113 @@
+# db_pool.py — постоянные соединения с SQLite: один писатель + пул читателей
+import asyncio
+import contextlib
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import aiosqlite
+
+
+# прагмы, общие для всех соединений (раньше применялись на каждом connect)
+COMMON_PRAGMAS = (
+    "PRAGMA busy_timeout=5000;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-8000;",      # ~8 МБ страничного кэша на соединение
+)
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",    # в WAL это безопасно и сильно дешевле FULL
+)
+READER_PRAGMAS = (
+    "PRAGMA query_only=ON;",
+)
+
+
+class DBPool:
+    """
+    Менеджер соединений: открывается один раз в init_db(), закрывается в app.main().
+    - writer(): единственное пишущее соединение, транзакции сериализуются локом;
+      на выходе из блока — commit, при исключении — rollback.
+    - reader(): соединение из пула read-only (в WAL читатели не блокируют писателя).
+    attach: {схема: путь} — дополнительные файлы БД (архив), подключаются ко всем соединениям;
+    файлы должны существовать до open() — читатели открывают их read-only.
+    """
+
+    def __init__(self, path: str, readers: int = 3, attach: Optional[dict[str, str]] = None):
+        self.path = str(path)
+        self.readers = max(1, readers)
+        self.attached = dict(attach or {})
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._idle: Optional[asyncio.Queue] = None
+        self._all_readers: list[aiosqlite.Connection] = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def open(self) -> None:
+        if self.is_open:
+            return
+        self._writer = await aiosqlite.connect(self.path)
+        for pragma in COMMON_PRAGMAS + WRITER_PRAGMAS:
+            await self._writer.execute(pragma)
+        for schema, path in self.attached.items():
+            await self._writer.execute(f"ATTACH DATABASE ? AS {schema}", (str(path),))
+
+        ro_uri = f"{Path(self.path).resolve().as_uri()}?mode=ro"
+        self._idle = asyncio.Queue()
+        for _ in range(self.readers):
+            conn = await aiosqlite.connect(ro_uri, uri=True)
+            for pragma in COMMON_PRAGMAS + READER_PRAGMAS:
+                await conn.execute(pragma)
+            for schema, path in self.attached.items():
+                await conn.execute(f"ATTACH DATABASE ? AS {schema}", (f"{Path(path).resolve().as_uri()}?mode=ro",))
+            self._all_readers.append(conn)
+            self._idle.put_nowait(conn)
+
+    async def close(self) -> None:
+        if not self.is_open:
+            return
+        async with self._write_lock:
+            writer, self._writer = self._writer, None
+            await writer.close()
+        for conn in self._all_readers:
+            with contextlib.suppress(Exception):
+                await conn.close()
+        self._all_readers.clear()
+        self._idle = None
+
+    async def set_trace_callback(self, callback) -> None:
+        """sqlite3 trace на все соединения пула (бенчмарки: число SQL-выражений). None — снять."""
+        for conn in [self._writer, *self._all_readers]:
+            if conn is not None:
+                await conn.set_trace_callback(callback)
+
+    @contextlib.asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with self._write_lock:
+            conn = self._writer
+            if conn is None:
+                raise RuntimeError("DBPool закрыт")
+            try:
+                yield conn
+            except BaseException:
+                await conn.rollback()
+                raise
+            else:
+                await conn.commit()
+
+    @contextlib.asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        if self._idle is None:
+            raise RuntimeError("DBPool закрыт")
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            # закрываем неявную читающую транзакцию, чтобы не держать старый снапшот WAL
+            if conn.in_transaction:
+                with contextlib.suppress(Exception):
+                    await conn.rollback()
+            if self._idle is not None:
+                self._idle.put_nowait(conn)
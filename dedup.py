@@ -0,0 +1,93 @@
+# dedup.py — защита от повторной обработки
+#
+# Повторы бывают: рестарт polling (offset не успел подтвердиться), повтор вебхука,
+# at-least-once очередь воркеров (WORKERS > 0), один и тот же запрос через разные пути.
+# Два уровня, оба — TTL-набор в памяти + таблица dedup_keys (переживает рестарт):
+#   - update_id: проверка в памяти на каждом апдейте (UpdateDedupMiddleware), в БД —
+#     write-behind пачкой, как активность чатов; на старте последние ключи грузятся в память;
+#   - побочные эффекты по сообщению (claim): ключ пишется в БД сразу, до отправки менеджерам.
+import asyncio
+import time
+
+from cache import MISSING, TTLCache
+from config import CHAT_FLUSH_EVERY, DEDUP_MAXSIZE, DEDUP_TTL, log
+from db import claim_key, prune_keys, recent_keys, release_key, save_keys
+from metrics import DUPLICATES_DROPPED
+
+
+class DedupStore:
+    def __init__(self, ttl: int = DEDUP_TTL, maxsize: int = DEDUP_MAXSIZE):
+        self.ttl = ttl
+        self._seen = TTLCache("dedup", maxsize=maxsize, ttl=ttl)  # (scope, key) -> True
+        self._unsaved: list[str] = []                            # обработанные update_id, ещё не в БД
+
+    async def load(self) -> int:
+        """На старте: удалить просроченные ключи и поднять свежие в память."""
+        now = int(time.time())
+        await prune_keys(now - self.ttl)
+        rows = await recent_keys(now - self.ttl)
+        for scope, key in rows:
+            self._seen.put((scope, key), True)
+        return len(rows)
+
+    # --- апдейты ---
+    def begin_update(self, update_id: int) -> bool:
+        """False — апдейт уже обработан или обрабатывается."""
+        key = ("update", str(update_id))
+        if self._seen.get(key) is not MISSING:
+            DUPLICATES_DROPPED.inc("update")
+            return False
+        self._seen.put(key, True)
+        return True
+
+    def done_update(self, update_id: int) -> None:
+        """Апдейт отработан — в БД со следующим flush (упавший посреди хендлера процесс обработает его снова)."""
+        self._unsaved.append(str(update_id))
+
+    def forget_update(self, update_id: int) -> None:
+        self._seen.invalidate(("update", str(update_id)))
+
+    async def flush(self) -> int:
+        if not self._unsaved:
+            return 0
+        batch, self._unsaved = self._unsaved, []
+        try:
+            await save_keys("update", batch)
+        except BaseException:
+            self._unsaved[:0] = batch
+            raise
+        return len(batch)
+
+    # --- побочные эффекты по сообщению ---
+    async def claim(self, scope: str, chat_id: int, message_id: int) -> bool:
+        """Первый вызов для (scope, чат, сообщение) — True; повторы, в том числе после рестарта, — False."""
+        key = (scope, f"{chat_id}:{message_id}")
+        if self._seen.get(key) is not MISSING or not await claim_key(*key):
+            self._seen.put(key, True)
+            DUPLICATES_DROPPED.inc(scope)
+            return False
+        self._seen.put(key, True)
+        return True
+
+    async def release(self, scope: str, chat_id: int, message_id: int) -> None:
+        """Действие не удалось — повторная доставка сможет выполнить его снова."""
+        key = (scope, f"{chat_id}:{message_id}")
+        self._seen.invalidate(key)
+        await release_key(*key)
+
+
+async def dedup_flush_loop():
+    """Фоновая задача: сброс обработанных update_id и раз в час — чистка просроченных ключей."""
+    last_prune = time.monotonic()
+    while True:
+        await asyncio.sleep(CHAT_FLUSH_EVERY)
+        try:
+            await dedup_store.flush()
+            if time.monotonic() - last_prune > 3600:
+                last_prune = time.monotonic()
+                await prune_keys(int(time.time()) - dedup_store.ttl)
+        except Exception:
+            log.exception("[dedup] ошибка сброса ключей")
+
+
+dedup_store = DedupStore()
@@ -0,0 +1,149 @@
+# digest.py — режим дайджеста: запросы из групп приходят менеджеру сводкой раз в окно
+#
+# Менеджер включает режим командой /digest (окно хранится в manager_digest). relay_to_manager
+# вместо шапки + копии кладёт запрос сюда; через окно (или при DIGEST_MAX_ITEMS запросах)
+# уходит одно сообщение, сгруппированное по чатам, со ссылками на исходные сообщения.
+# Срочные запросы (DIGEST_URGENT_WORDS) и /invoice идут мимо дайджеста, как раньше.
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.types import Message
+
+from config import DIGEST_MAX_ITEMS, DIGEST_URGENT_WORDS, log
+from utils import escape_html, message_link
+
+SNIPPET_LEN = 80
+TEXT_LIMIT = 4000  # запас до 4096 символов сообщения Telegram
+
+
+@dataclass
+class DigestItem:
+    chat_id: int
+    chat_title: str
+    chat_username: Optional[str]
+    message_id: int
+    author: str
+    snippet: str
+
+
+def is_urgent(message: Message) -> bool:
+    text = (message.text or message.caption or "").lower()
+    return any(word in text for word in DIGEST_URGENT_WORDS)
+
+
+def digest_item(message: Message, author: str) -> DigestItem:
+    text = " ".join((message.text or message.caption or "").split())
+    if not text:
+        text = f"[{message.content_type}]"
+    elif len(text) > SNIPPET_LEN:
+        text = text[:SNIPPET_LEN - 1] + "…"
+    chat = message.chat
+    return DigestItem(chat.id, chat.title or "(без названия)", getattr(chat, "username", None),
+                      message.message_id, author, text)
+
+
+def render(items: list[DigestItem]) -> list[str]:
+    """
+    Сводка по чатам в порядке первого запроса. Не влезает в TEXT_LIMIT — несколько сообщений
+    (шапка с номером части, чат, продолжающийся в следующей части, повторяет свой заголовок):
+    обрезается только текст запроса (SNIPPET_LEN), сами запросы — никогда.
+    """
+    by_chat: dict[int, list[DigestItem]] = {}
+    for item in items:
+        by_chat.setdefault(item.chat_id, []).append(item)
+    header = f"🗂 <b>Дайджест:</b> {len(items)} запрос(ов) из {len(by_chat)} чат(ов)"
+    limit = TEXT_LIMIT - len(header) - 16  # запас под « · часть N/M»
+    parts: list[list[str]] = [[]]
+    size = 0
+    for chat_id, chat_items in by_chat.items():
+        title = f"\n💬 <b>{escape_html(chat_items[0].chat_title)}</b> — {len(chat_items)} · /select_chat {chat_id}"
+        chat_open = False
+        for item in chat_items:
+            link = message_link(item.chat_id, item.chat_username, item.message_id)
+            line = f"• {escape_html(item.author)}: {escape_html(item.snippet)}"
+            line = f'{line} <a href="{link}">→</a>' if link else line
+            need = len(line) + 1 + (0 if chat_open else len(title) + 1)
+            if size + need > limit and parts[-1]:
+                parts.append([])
+                size, chat_open = 0, False
+                need = len(line) + len(title) + 2
+            if not chat_open:
+                parts[-1].append(title)
+                chat_open = True
+            parts[-1].append(line)
+            size += need
+    if len(parts) == 1:
+        return ["\n".join([header, *parts[0]])]
+    return ["\n".join([f"{header} · часть {i}/{len(parts)}", *lines]) for i, lines in enumerate(parts, 1)]
+
+
+class DigestBuffer:
+    """
+    Накопление запросов по менеджерам. Первый запрос запускает таймер окна; сводка уходит
+    по таймеру или сразу при max_items запросах. Буфер в памяти: при остановке drain()
+    отправляет накопленное, не дожидаясь окон.
+    """
+
+    def __init__(self, max_items: int = DIGEST_MAX_ITEMS):
+        self.max_items = max_items
+        self._items: dict[int, list[DigestItem]] = {}   # manager_id -> запросы текущего окна
+        self._timers: dict[int, asyncio.Task] = {}      # manager_id -> ожидание конца окна
+        self._running: set[asyncio.Task] = set()
+        self._bot: Optional[Bot] = None
+        self.buffered = 0
+        self.sent = 0
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        return task
+
+    def add(self, bot: Bot, manager_id: int, window: float, item: DigestItem) -> None:
+        self._bot = bot
+        items = self._items.setdefault(manager_id, [])
+        items.append(item)
+        self.buffered += 1
+        if len(items) >= self.max_items:
+            self.flush_now(manager_id)
+        elif manager_id not in self._timers:
+            self._timers[manager_id] = self._spawn(self._wait(manager_id, window))
+
+    def pending(self, manager_id: int) -> int:
+        return len(self._items.get(manager_id, ()))
+
+    def flush_now(self, manager_id: int) -> None:
+        """Отправить накопленное менеджеру сейчас (лимит, /digest off)."""
+        timer = self._timers.pop(manager_id, None)
+        if timer is not None:
+            timer.cancel()  # таймер в _timers только пока спит — отправку не прерываем
+        if self._items.get(manager_id):
+            self._spawn(self._flush(manager_id))
+
+    async def _wait(self, manager_id: int, window: float) -> None:
+        await asyncio.sleep(window)
+        self._timers.pop(manager_id, None)
+        await self._flush(manager_id)
+
+    async def _flush(self, manager_id: int) -> None:
+        items = self._items.pop(manager_id, [])
+        if not items or self._bot is None:
+            return
+        try:
+            for text in render(items):
+                await self._bot.send_message(manager_id, text, disable_web_page_preview=True)
+            self.sent += 1
+        except Exception as e:
+            log.warning("digest for manager %s (%s items) failed: %s", manager_id, len(items), e)
+
+    async def drain(self) -> None:
+        """Отправить все накопленные сводки (при остановке)."""
+        for manager_id in list(self._items):
+            self.flush_now(manager_id)
+        while self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+
+digest_buffer = DigestBuffer()
@@ -1,22 +1,170 @@
 # НЕ называйте файл просто "logging.py", чтобы не путать со стандартным модулем logging!
+#
+# Логи не форматируются и не пишутся в event loop: корневой логгер отдаёт записи
+# в очередь (QueueHandler), а форматирование и вывод в stderr/файл делает
+# QueueListener в отдельном потоке.
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
+import time
+from typing import Optional
+
+from config import LOG_DEBUG_SAMPLE, LOG_FILE, LOG_FORMAT, LOG_PROFILE
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+# уровни по окружениям: "" — корневой логгер
+PROFILES = {
+    "prod": {
+        "": logging.INFO,
+        "aiogram": logging.WARNING,
+        "aiogram.event": logging.WARNING,   # «Update id=... is handled» на каждый апдейт
+        "aiohttp": logging.WARNING,
+    },
+    "dev": {
+        "": logging.DEBUG,
+        "aiogram": logging.INFO,
+        "aiogram.event": logging.INFO,
+        "aiohttp": logging.INFO,
+        "aiosqlite": logging.INFO,          # aiosqlite пишет DEBUG на каждый запрос
+    },
+    "debug": {
+        "": logging.DEBUG,
+        "aiogram": logging.DEBUG,
+        "aiogram.client.telegram": logging.DEBUG,
+        "aiogram.client.session.aiohttp": logging.DEBUG,
+        "aiohttp.client": logging.DEBUG,
+        "aiosqlite": logging.DEBUG,
+    },
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.Handler] = None
+
+# стандартные поля LogRecord — всё остальное в JSON уходит как extra
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка; поля из extra= попадают в объект как есть."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """
+    Пропускает каждую N-ю DEBUG-запись с одного места в коде (N = 1/rate).
+    Стоит на QueueHandler, то есть отбрасывает лишнее ещё до очереди.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._seen: dict[tuple[str, int], int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        if not self.every:
+            return False
+        key = (record.pathname, record.lineno)
+        n = self._seen.get(key, 0)
+        self._seen[key] = n + 1
+        return n % self.every == 0
+
+
+class _LoopQueueHandler(logging.handlers.QueueHandler):
+    """
+    Стандартный QueueHandler форматирует запись в вызывающем потоке.
+    Здесь в event loop только фиксируем текст сообщения (аргументы могут измениться),
+    а asctime, форматтер и трейсбек считает поток QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _make_formatter(fmt: str) -> logging.Formatter:
+    return JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+
+
+def setup_logging(profile: str = LOG_PROFILE, fmt: str = LOG_FORMAT, log_file: str = LOG_FILE,
+                  debug_sample: float = LOG_DEBUG_SAMPLE):
+    """Перенастроить логирование процесса (повторный вызов заменяет предыдущую настройку)."""
+    global _listener, _queue_handler
+    stop_logging()
+
+    formatter = _make_formatter(fmt)
+    outputs: list[logging.Handler] = [logging.StreamHandler()]
+    if log_file:
+        outputs.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=20 * 1024 * 1024, backupCount=5, encoding="utf-8"))
+    for handler in outputs:
+        handler.setFormatter(formatter)
+
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _LoopQueueHandler(q)
+    queue_handler.addFilter(DebugSampler(debug_sample))
 
-def setup_logging(level=logging.INFO):
-    # не плодим дубликаты хендлеров при повторных импортах/рестартах
     root = logging.getLogger()
-    if not root.handlers:
-        logging.basicConfig(
-            level=level,
-            format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-        )
+    for handler in root.handlers[:]:  # убираем basicConfig из config.py и прошлые настройки
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    _queue_handler = queue_handler
 
-    # ваш именованный логгер (если нужен)
-    app_log = logging.getLogger("support-bot")
+    levels = PROFILES.get(profile, PROFILES["prod"])
+    for name in {n for p in PROFILES.values() for n in p}:
+        if name:
+            logging.getLogger(name).setLevel(logging.NOTSET)
+    for name, level in levels.items():
+        logging.getLogger(name or None).setLevel(level)
 
-    # подробности от aiogram/aiohttp
-    logging.getLogger("aiogram").setLevel(logging.DEBUG)
-    logging.getLogger("aiogram.client.telegram").setLevel(logging.DEBUG)
-    logging.getLogger("aiogram.client.session.aiohttp").setLevel(logging.DEBUG)
-    logging.getLogger("aiohttp.client").setLevel(logging.DEBUG)
+    _listener = logging.handlers.QueueListener(q, *outputs, respect_handler_level=True)
+    _listener.start()
 
+    app_log = logging.getLogger("support-bot")
+    app_log.info("[logging] профиль=%s, формат=%s, файл=%s, DEBUG-сэмпл=%s", profile, fmt, log_file or "—", debug_sample)
     return app_log
+
+
+def stop_logging() -> None:
+    """
+    Дописать очередь и остановить фоновый поток (при остановке бота; повторный вызов безопасен).
+    Поздние записи после остановки идут в stderr напрямую, а не в очередь без слушателя.
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    if not root.handlers:
+        fallback = logging.StreamHandler()
+        fallback.setFormatter(_listener.handlers[0].formatter)
+        root.addHandler(fallback)
+    _listener = _queue_handler = None
+
+
+atexit.register(stop_logging)
@@ -1,15 +1,30 @@
+from typing import Optional
 from aiogram import Bot, Dispatcher
+from aiogram.types import User
+from middlewares import BotIdentityMiddleware, UpdateDedupMiddleware, update_scheduler
+from dedup import dedup_store
+from metrics import setup_handler_metrics
 from .groups import setup as setup_groups
 from .callbacks import setup as setup_callbacks
 from .manager_dm import setup as setup_manager_dm
 from .manager_media import setup as setup_manager_media
 from .manager_admin import setup as setup_manager_admin
 
-def setup_all(dp: Dispatcher, bot: Bot) -> None:
+def setup_all(dp: Dispatcher, bot: Bot, me: Optional[User] = None) -> None:
+    # повторно доставленные апдейты отбрасываются раньше всего остального
+    dp.update.outer_middleware(UpdateDedupMiddleware(dedup_store))
+    # затем: апдейты одного чата/заявки — по очереди, разных — параллельно (с общим лимитом)
+    dp.update.outer_middleware(update_scheduler)
+    # профиль бота (bot_me) — один раз на процесс, а не get_me() на каждое сообщение
+    dp.update.outer_middleware(BotIdentityMiddleware(me))
+
     setup_groups(dp, bot)
     setup_callbacks(dp, bot)
     setup_manager_admin(dp, bot)
     setup_manager_dm(dp, bot)
     setup_manager_media(dp, bot)
+
+    # время каждого сработавшего хендлера -> metrics (Prometheus / команда /stats)
+    setup_handler_metrics(dp)
     
     # Добавляйте сюда новые setup_* функции по мере необходимости
\ No newline at end of file
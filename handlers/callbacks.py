@@ -2,18 +2,23 @@
 import re
 from aiogram import Dispatcher, Bot, F
 from aiogram.types import CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
 from config import MANAGER_IDS, log
-from db import get_invoice, set_invoice_status, set_mode
-from handlers.common import build_invoice_kb
+from db import get_invoice, set_invoice_status, set_mode, get_broadcast_job, set_broadcast_status
+from handlers.common import card_refresher
+import broadcasts
+import invoice_browser
 
 ACTION_RE = re.compile(r"^inv:(-?\d+):([A-Za-z_]+)$")
+BROADCAST_RE = re.compile(r"^bc:(\d+):(PAUSE|RESUME|CANCEL)$")
 
 def setup(dp: Dispatcher, bot: Bot) -> None:
     dp.callback_query.register(on_invoice_action, F.data.startswith("inv:"))
+    dp.callback_query.register(on_broadcast_action, F.data.startswith("bc:"))
+    dp.callback_query.register(on_invoice_page, F.data.startswith("ivp:"))
 
 async def on_invoice_action(cb: CallbackQuery):
-    log.info("callback: uid=%s data=%r", getattr(cb.from_user, "id", None), cb.data)
-    log.info("callback from %s data=%r", cb.from_user.id if cb.from_user else None, cb.data)
+    log.debug("callback: uid=%s data=%r", getattr(cb.from_user, "id", None), cb.data)
 
     if not cb.from_user or cb.from_user.id not in MANAGER_IDS:
         await cb.answer()
@@ -32,12 +37,16 @@ async def on_invoice_action(cb: CallbackQuery):
         await cb.answer("Заявка не найдена", show_alert=True)
         return
 
+    # повтор того же действия (двойной клик, повторная доставка) не пишет второе событие,
+    # закрытую заявку не переоткрывает (устаревшая карточка просто перерисуется без кнопок)
+    closed = inv[5] == "DONE"
     if act == "MARK_SENT":
-        await set_invoice_status(inv_id, "SENT_TO_ACCOUNTING", cb.from_user.id, None)
-        await cb.answer("Отмечено ✅")
+        changed = await set_invoice_status(inv_id, "SENT_TO_ACCOUNTING", cb.from_user.id, None, only_if_changed=True)
+        await cb.answer("Отмечено ✅" if changed else "Заявка уже закрыта" if closed else "Уже отмечено")
     elif act == "REQUEST_REPORT":
-        await set_invoice_status(inv_id, "REPORT_REQUESTED", cb.from_user.id, None)
-        await cb.answer("Запрос зафиксирован 📝")
+        changed = await set_invoice_status(inv_id, "REPORT_REQUESTED", cb.from_user.id, None, only_if_changed=True)
+        await cb.answer("Запрос зафиксирован 📝" if changed else "Заявка уже закрыта" if closed
+                        else "Запрос уже зафиксирован")
     elif act == "POST_FILE":
         await set_mode(cb.from_user.id, inv_id, "POST_FILE")
         await cb.message.answer(f"Заявка #{inv_id}: пришлите файл — опубликую его в группе (без текста).")
@@ -46,15 +55,68 @@ async def on_invoice_action(cb: CallbackQuery):
         await set_mode(cb.from_user.id, inv_id, "SWIFT_FILE")
         await cb.message.answer(f"Заявка #{inv_id}: пришлите SWIFT-файл — опубликую его в группе (без текста).")
         await cb.answer()
-    elif act in ("DONE"):
-        await set_invoice_status(inv_id, "DONE", cb.from_user.id, None)
-        await cb.answer("Заявка закрыта ✔")
+    elif act == "DONE":
+        changed = await set_invoice_status(inv_id, "DONE", cb.from_user.id, None, only_if_changed=True)
+        await cb.answer("Заявка закрыта ✔" if changed else "Заявка уже закрыта")
     else:
         await cb.answer(f"Неизвестное действие: {act}", show_alert=True)
 
-# ПОСЛЕ ЛЮБОГО УСПЕШНОГО ACTION — обновляем клавиатуру (убираем выполненное)
+# ПОСЛЕ ЛЮБОГО УСПЕШНОГО ACTION — обновляем клавиатуры (убираем выполненное) у всех менеджеров;
+# серия быстрых кликов схлопывается в одну перерисовку, неизменившиеся карточки не трогаются
+    extra = [(cb.message.chat.id, cb.message.message_id)] if cb.message else []
+    card_refresher.refresh(cb.bot, inv_id, extra)
+
+
+async def on_broadcast_action(cb: CallbackQuery):
+    """Пауза / продолжение / отмена фоновой рассылки с кнопок сообщения-прогресса."""
+    if not cb.from_user or cb.from_user.id not in MANAGER_IDS:
+        await cb.answer()
+        return
+
+    m = BROADCAST_RE.match(cb.data or "")
+    if not m:
+        await cb.answer("Некорректные данные", show_alert=True)
+        return
+    job_id, act = int(m.group(1)), m.group(2)
+
+    job = await get_broadcast_job(job_id)
+    if not job:
+        await cb.answer("Рассылка не найдена", show_alert=True)
+        return
+    status = job[3]
+
+    if act == "PAUSE" and status == "RUNNING":
+        await set_broadcast_status(job_id, "PAUSED")
+        await cb.answer("Пауза ⏸")
+    elif act == "RESUME" and status == "PAUSED":
+        await set_broadcast_status(job_id, "RUNNING")
+        broadcasts.start_job(cb.bot, job_id)
+        await cb.answer("Продолжаю ▶")
+    elif act == "CANCEL" and status in ("RUNNING", "PAUSED"):
+        await set_broadcast_status(job_id, "CANCELLED")
+        await cb.answer("Рассылка отменена ✖")
+    else:
+        await cb.answer("Рассылка уже в другом состоянии")
+
+    await broadcasts.refresh_progress(cb.bot, job_id)
+
+
+async def on_invoice_page(cb: CallbackQuery):
+    """Листание /invoices: перерисовываем то же сообщение, фильтры и курсор — в callback_data."""
+    if not cb.from_user or cb.from_user.id not in MANAGER_IDS:
+        await cb.answer()
+        return
+
+    m = invoice_browser.PAGE_RE.match(cb.data or "")
+    if not m:
+        await cb.answer("Некорректные данные", show_alert=True)
+        return
+    flt, chat_id, direction, cursor = m.group(1), int(m.group(2)), m.group(3), int(m.group(4))
+
+    text, kb = await invoice_browser.render_page(flt, chat_id, direction, cursor)
     try:
-        kb = await build_invoice_kb(inv_id)  # None -> удалить клавиатуру
-        await cb.message.edit_reply_markup(reply_markup=kb)
-    except Exception as e:
-        log.warning("edit_reply_markup failed for inv=%s: %s", inv_id, e)
+        await cb.message.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e).lower():
+            raise
+    await cb.answer()
@@ -1,32 +1,97 @@
 # handlers/common.py
+import asyncio
+import time
 from aiogram.enums import ContentType
-from aiogram.types import Message
-from config import MANAGER_IDS, log
-from db import set_selection
+from aiogram.types import (
+    InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo, Message,
+)
+from aiogram.exceptions import TelegramBadRequest
+from cache import TTLCache
+from config import MANAGER_IDS, FANOUT_CONCURRENCY, CARD_REFRESH_DEBOUNCE, MEDIA_GROUP_WINDOW, log
+from db import set_selection_many, get_invoice_cards, get_digest
+from digest import digest_buffer, digest_item, is_urgent
+from dedup import dedup_store
 from utils import AuthorInfo, format_author
-from typing import Optional
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from typing import Any, Awaitable, Callable, Iterable, Optional
+from aiogram.types import InlineKeyboardMarkup
 from db import get_invoice_state
+from kb import invoice_kb, invoice_layout_key
+
+async def fan_out(
+    recipients: Iterable[int],
+    send: Callable[[int], Awaitable[Any]],
+    limit: int = FANOUT_CONCURRENCY,
+) -> dict[int, Any]:
+    """
+    Параллельно выполняет send(uid) для всех получателей, не больше limit одновременно.
+    Ошибка одного получателя логируется и не мешает остальным.
+    Возвращает {uid: результат send} только для успешных.
+    """
+    sem = asyncio.Semaphore(max(1, limit))
+    failed = object()
+
+    async def one(uid: int):
+        async with sem:
+            try:
+                return uid, await send(uid)
+            except Exception as e:
+                log.warning("notify manager %s failed: %s", uid, e)
+                return uid, failed
+
+    results = await asyncio.gather(*(one(uid) for uid in recipients))
+    return {uid: res for uid, res in results if res is not failed}
 
 async def relay_to_manager(message: Message):
-    """Шлём во все MANAGER_IDS: шапку + копию; выставляем selection каждому."""
+    """
+    Шлём в MANAGER_IDS: шапку + копию; выставляем selection каждому.
+    Менеджерам в режиме дайджеста (/digest) запрос копится в digest_buffer — кроме срочных.
+    """
+    chat = message.chat
+    # один запрос — одна пересылка: повторная доставка или второй путь к тому же сообщению не дублируют её
+    if not await dedup_store.claim("relay", chat.id, message.message_id):
+        return
+    try:
+        delivered = await _relay(message)
+    except asyncio.CancelledError:
+        # брошен при остановке — повторная доставка (очередь воркеров, вебхук) перешлёт снова
+        await asyncio.shield(dedup_store.release("relay", chat.id, message.message_id))
+        raise
+    if not delivered:
+        await dedup_store.release("relay", chat.id, message.message_id)  # никому не дошло — пусть повтор попробует снова
+
+
+async def _relay(message: Message) -> bool:
+    """Сама пересылка; False — запрос не дошёл ни до кого (ни сразу, ни в дайджест)."""
     chat = message.chat
     author = AuthorInfo(
         name=(message.from_user.full_name if message.from_user else "Unknown"),
         username=(message.from_user.username if message.from_user else None),
         user_id=(message.from_user.id if message.from_user else 0),
     )
+    windows = {} if is_urgent(message) else {uid: w for uid in MANAGER_IDS if (w := await get_digest(uid))}
+    if windows:
+        item = digest_item(message, author.name)
+        for uid, window in windows.items():
+            digest_buffer.add(message.bot, uid, window, item)
+    recipients = [uid for uid in MANAGER_IDS if uid not in windows]
+    if not recipients:
+        return True
+
     header = "\n".join([
         f"🔔 <b>Запрос из чата:</b> {chat.title or '(без названия)'}",
         f"👤 <b>От:</b> {format_author(author)}",
     ])
-    for uid in MANAGER_IDS:
-        try:
-            await set_selection(uid, chat.id)
-            await message.bot.send_message(uid, header)
-            await message.bot.copy_message(uid, chat.id, message.message_id)
-        except Exception as e:
-            log.warning("notify manager %s failed: %s", uid, e)
+    try:
+        # selection — только тем, кто видит запрос сейчас: у остальных выбранный чат не меняется молча
+        await set_selection_many(recipients, chat.id)
+    except Exception as e:
+        log.warning("set_selection for managers failed: %s", e)
+
+    async def notify(uid: int):
+        await message.bot.send_message(uid, header)
+        await message.bot.copy_message(uid, chat.id, message.message_id)
+
+    return bool(await fan_out(recipients, notify)) or bool(windows)
 
 async def send_media_no_caption(bot, chat_id: int, src: Message, reply_to: int | None):
     try:
@@ -65,37 +130,188 @@ async def send_media_no_caption(bot, chat_id: int, src: Message, reply_to: int |
             pass
 
 
+def _input_media(src: Message):
+    """Элемент sendMediaGroup по сообщению альбома (без подписи); None — тип в альбом не входит."""
+    ct = src.content_type
+    if ct == ContentType.DOCUMENT:
+        return InputMediaDocument(media=src.document.file_id)
+    if ct == ContentType.PHOTO:
+        return InputMediaPhoto(media=src.photo[-1].file_id)
+    if ct == ContentType.VIDEO:
+        return InputMediaVideo(media=src.video.file_id)
+    if ct == ContentType.AUDIO:
+        return InputMediaAudio(media=src.audio.file_id)
+    return None
+
+
+async def send_media_group_no_caption(bot, chat_id: int, album: list[Message], reply_to: int | None):
+    """
+    Альбом одним sendMediaGroup, реплаем на reply_to. Если собрать или отправить альбом
+    не вышло — по одному файлу через send_media_no_caption.
+    """
+    media = [_input_media(m) for m in album]
+    if len(album) > 1 and all(media):
+        try:
+            await bot.send_media_group(chat_id, media, reply_to_message_id=reply_to,
+                                       allow_sending_without_reply=True)
+            return
+        except Exception as e:
+            log.warning("send_media_group failed, sending files one by one: %s", e)
+    for m in album:
+        await send_media_no_caption(bot, chat_id, m, reply_to)
+
+
 
 async def build_invoice_kb(inv_id: int) -> Optional[InlineKeyboardMarkup]:
     """
-    Собирает клавиатуру по актуальному состоянию.
-    Возвращает None, если кнопок не осталось (или DONE).
+    Клавиатура карточки по актуальному состоянию (готовая раскладка из kb.invoice_kb).
+    Возвращает None, если заявка закрыта (DONE) или не найдена.
     """
     st = await get_invoice_state(inv_id)
-    if not st:
-        return None
-    if st["status"] == "DONE":
+    if not st or st["status"] == "DONE":
         return None
+    return invoice_kb(inv_id, invoice_layout_key(st))
+
+
+class CardRefresher:
+    """
+    Обновление клавиатур карточек заявки у всех менеджеров.
+    - refresh() откладывает обновление на debounce: серия действий по заявке -> одна перерисовка;
+    - клавиатура строится один раз на заявку, её отпечаток запоминается по каждой карточке,
+      и карточки, где уже стоит такая же разметка, не трогаются;
+    - оставшиеся правки идут параллельно (fan_out); перерисовки одной заявки — строго по очереди.
+    """
+
+    def __init__(self, debounce: float = CARD_REFRESH_DEBOUNCE):
+        self.debounce = debounce
+        self._pending: dict[int, set[tuple[int, int]]] = {}   # inv_id -> доп. карточки (чат, сообщение)
+        self._tasks: dict[int, asyncio.Task] = {}              # отложенные перерисовки
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._lock_users: dict[int, int] = {}                  # inv_id -> перерисовок, держащих или ждущих замок
+        self._running: set[asyncio.Task] = set()
+        self._sent = TTLCache("card_markup", maxsize=10_000, ttl=7 * 24 * 3600)  # (чат, сообщение) -> отпечаток
+        self.edits = 0
+        self.skipped = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _digest(kb: Optional[InlineKeyboardMarkup]) -> int:
+        return hash(kb.model_dump_json(exclude_none=True)) if kb is not None else 0
+
+    def remember(self, chat_id: int, message_id: int, kb: Optional[InlineKeyboardMarkup]) -> None:
+        """Карточка только что отправлена с этой клавиатурой."""
+        self._sent.put((chat_id, message_id), self._digest(kb))
+
+    def refresh(self, bot, inv_id: int, extra: Iterable[tuple[int, int]] = ()) -> None:
+        """Запланировать перерисовку карточек заявки (+ extra — например, нажатой карточки)."""
+        self._pending.setdefault(inv_id, set()).update(extra)
+        if inv_id in self._tasks:
+            self.coalesced += 1
+            return
+        task = asyncio.create_task(self._run(bot, inv_id))
+        self._tasks[inv_id] = task
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, bot, inv_id: int) -> None:
+        try:
+            await asyncio.sleep(self.debounce)
+        finally:
+            # дальнейшие refresh() планируют новую перерисовку — она прочтёт более свежее состояние
+            self._tasks.pop(inv_id, None)
+            extra = self._pending.pop(inv_id, set())
+        lock = self._locks.setdefault(inv_id, asyncio.Lock())
+        self._lock_users[inv_id] = self._lock_users.get(inv_id, 0) + 1
+        try:
+            async with lock:
+                await self._apply(bot, inv_id, extra)
+        except Exception as e:
+            log.warning("refresh invoice cards failed for #%s: %s", inv_id, e)
+        finally:
+            # замок убираем, только когда его никто не держит и не ждёт: сразу после release
+            # locked() ещё False, а следующая перерисовка уже стоит в очереди на этот же замок
+            self._lock_users[inv_id] -= 1
+            if not self._lock_users[inv_id]:
+                del self._lock_users[inv_id]
+                self._locks.pop(inv_id, None)
 
-    rows = []
+    async def _apply(self, bot, inv_id: int, extra: set[tuple[int, int]]) -> None:
+        kb = await build_invoice_kb(inv_id)  # None -> убрать клавиатуру
+        digest = self._digest(kb)
+        cards = {(dm_chat_id, msg_id) for _, dm_chat_id, msg_id in await get_invoice_cards(inv_id)} | extra
+        todo = [card for card in cards if self._sent.get(card) != digest]
+        self.skipped += len(cards) - len(todo)
 
-    if not st["sent_to_accounting"]:
-        rows.append([InlineKeyboardButton(text="✅ Отправил в бух", callback_data=f"inv:{inv_id}:MARK_SENT")])
+        async def edit(i: int):
+            chat_id, msg_id = todo[i]
+            try:
+                await bot.edit_message_reply_markup(chat_id=chat_id, message_id=msg_id, reply_markup=kb)
+                self.edits += 1
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e).lower():
+                    # карточку могли удалить у менеджера — не критично
+                    self._sent.invalidate(todo[i])
+                    log.debug("edit_message_reply_markup failed for inv=%s msg=%s: %s", inv_id, msg_id, e)
+                    return
+            except Exception as e:
+                self._sent.invalidate(todo[i])
+                log.warning("edit_message_reply_markup failed for inv=%s msg=%s: %s", inv_id, msg_id, e)
+                return
+            self._sent.put(todo[i], digest)
 
-    line = []
-    if not st["accounting_replied"]:
-        line.append(InlineKeyboardButton(text="📎 Файл в группу", callback_data=f"inv:{inv_id}:POST_FILE"))
-    if not st["swift_sent"]:
-        line.append(InlineKeyboardButton(text="📄 SWIFT", callback_data=f"inv:{inv_id}:SWIFT_FILE"))
-    if line:
-        rows.append(line)
+        await fan_out(range(len(todo)), edit)
+
+    async def drain(self) -> None:
+        """Дождаться всех запланированных и идущих перерисовок (при остановке)."""
+        while self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+
+card_refresher = CardRefresher()
+
+
+class MediaGroupCollector:
+    """
+    Сборка альбомов: Telegram присылает каждое сообщение альбома (общий media_group_id)
+    отдельным апдейтом. add() копит их и, когда window секунд не приходит новых частей,
+    один раз вызывает on_album(сообщения альбома по порядку).
+    """
+
+    def __init__(self, window: float = MEDIA_GROUP_WINDOW):
+        self.window = window
+        self._albums: dict[tuple[int, str], list[Message]] = {}  # (чат, media_group_id) -> части
+        self._last: dict[tuple[int, str], float] = {}            # когда пришла последняя часть
+        self._running: set[asyncio.Task] = set()
+        self.albums = 0
+        self.merged = 0
+
+    def add(self, message: Message, on_album: Callable[[list[Message]], Awaitable[Any]]) -> None:
+        key = (message.chat.id, message.media_group_id)
+        self._last[key] = time.monotonic()
+        if key in self._albums:
+            self._albums[key].append(message)
+            self.merged += 1
+            return
+        self._albums[key] = [message]
+        task = asyncio.create_task(self._run(key, on_album))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: tuple[int, str], on_album) -> None:
+        while (delay := self._last[key] + self.window - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        album = sorted(self._albums.pop(key), key=lambda m: m.message_id)
+        self._last.pop(key, None)
+        self.albums += 1
+        try:
+            await on_album(album)
+        except Exception:
+            log.exception("album %s (%s parts) failed", key[1], len(album))
 
-    if not st["report_requested"]:
-        rows.append([InlineKeyboardButton(text="📝 Запросить отчёт", callback_data=f"inv:{inv_id}:REQUEST_REPORT")])
+    async def drain(self) -> None:
+        """Дособрать и обработать начатые альбомы (при остановке)."""
+        while self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
 
-    # кнопка "Закрыть" всегда доступна, пока заявка не DONE
-    rows.append([InlineKeyboardButton(text="✔ Закрыть", callback_data=f"inv:{inv_id}:DONE")])
 
-    # if not rows:
-    #     return None
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+album_collector = MediaGroupCollector()
@@ -1,12 +1,12 @@
 # handlers/groups.py
 from aiogram import Dispatcher, Bot, F
 from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.types import Message, User
 from aiogram.enums import ChatType
-from db import save_invoice_card, upsert_chat, create_invoice
+from db import save_invoice_cards, upsert_chat, note_chat, create_invoice, get_invoice_cards
 from config import MANAGER_IDS, log
 from utils import SUPPORTED_MEDIA, bot_was_tagged
-from .common import relay_to_manager, build_invoice_kb
+from .common import relay_to_manager, build_invoice_kb, fan_out, card_refresher
 
 def setup(dp: Dispatcher, bot: Bot) -> None:
     dp.message.register(cmd_invoice_group, Command("invoice"))
@@ -35,22 +35,26 @@ async def cmd_invoice_group(message: Message):
 
     inv_id = await create_invoice(message.chat.id, message.message_id,
                                   message.from_user.id if message.from_user else 0)
+    if await get_invoice_cards(inv_id):
+        return  # повторная доставка того же /invoice: заявка и карточки уже есть
 
     header = f"🧾 Новая заявка /invoice #{inv_id}\nЧат: {message.chat.title or '(без названия)'} (id={message.chat.id})"
-    for uid in MANAGER_IDS:
-        try:
-            await message.bot.send_message(uid, header)
-            await message.bot.copy_message(uid, message.chat.id, message.message_id)
-            kb = await build_invoice_kb(inv_id)
-            msg_card = await message.bot.send_message(uid, f"Заявка #{inv_id}", reply_markup=kb)
-            try:
-                await save_invoice_card(manager_id=uid, invoice_id=inv_id,
-                                        dm_chat_id=msg_card.chat.id, message_id=msg_card.message_id)
-            except Exception as e:
-                    log.warning("save_invoice_card failed: %s", e)
-        
-        except Exception as e:
-            log.warning("notify manager %s failed: %s", uid, e)
+    kb = await build_invoice_kb(inv_id)  # одна клавиатура на всех менеджеров
+
+    async def notify(uid: int):
+        await message.bot.send_message(uid, header)
+        await message.bot.copy_message(uid, message.chat.id, message.message_id)
+        return await message.bot.send_message(uid, f"Заявка #{inv_id}", reply_markup=kb)
+
+    cards = await fan_out(MANAGER_IDS, notify)
+    for card in cards.values():
+        card_refresher.remember(card.chat.id, card.message_id, kb)
+    try:
+        await save_invoice_cards([
+            (uid, inv_id, card.chat.id, card.message_id) for uid, card in cards.items()
+        ])
+    except Exception as e:
+        log.warning("save_invoice_cards failed: %s", e)
 
 async def support_command(message: Message):
     if message.chat.type in {ChatType.GROUP, ChatType.SUPERGROUP}:
@@ -58,22 +62,32 @@ async def support_command(message: Message):
         await upsert_chat(message.chat.id, message.chat.title, getattr(message.chat, "username", None), message.chat.type)
         await relay_to_manager(target)
 
-async def index_chats(message: Message):
+def addresses_bot(message: Message, me: User) -> bool:
+    """Тег бота, ответ на сообщение бота или /support — без сети и БД."""
+    if message.text and message.text.split(maxsplit=1)[0] == "/support":
+        return True
+    reply = message.reply_to_message
+    if reply and reply.from_user and reply.from_user.id == me.id:
+        return True
+    return bot_was_tagged(message, me.username, me.id)
+
+async def index_chats(message: Message, bot_me: User):
     chat = message.chat
     if chat.type not in {ChatType.GROUP, ChatType.SUPERGROUP}:
         return
-    await upsert_chat(chat.id, chat.title, getattr(chat, "username", None), chat.type)
 
-    me = await message.bot.get_me()
-    tagged = bot_was_tagged(message, me.username, me.id)
-    is_reply_to_bot = bool(message.reply_to_message and message.reply_to_message.from_user and message.reply_to_message.from_user.id == me.id)
-    is_support_cmd = bool(message.text and message.text.split()[0] == "/support")
-    if tagged or is_reply_to_bot or is_support_cmd:
-        await relay_to_manager(message)
+    # быстрый путь: обычная переписка в группе — только отметка активности чата
+    # в write-behind буфере, без сети и без commit
+    if not addresses_bot(message, bot_me):
+        note_chat(chat.id, chat.title, getattr(chat, "username", None), chat.type)
+        return
+
+    await upsert_chat(chat.id, chat.title, getattr(chat, "username", None), chat.type)
+    await relay_to_manager(message)
 
-async def debug_rights(message: Message):
+async def debug_rights(message: Message, bot_me: User):
     chat_id = message.chat.id
-    me = await message.bot.get_me()
+    me = bot_me
     member = await message.bot.get_chat_member(chat_id, me.id)
     chat = await message.bot.get_chat(chat_id)
     status = getattr(member, "status", "unknown")
@@ -1,21 +1,31 @@
 # handlers/manager_admin.py
-import asyncio
 from typing import Optional
 from aiogram import Dispatcher, Bot, F
 from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, ReplyKeyboardRemove
 from aiogram.enums import ChatType
-from config import MANAGER_IDS
-from db import get_chat_status_msg, sqlite_checkpoint, sqlite_backup_once, list_chats_like,\
-      set_selection, list_open_invoices_with_state, get_selection,\
-      set_chat_status_msg
+from config import MANAGER_IDS, DIGEST_WINDOW
+from db import get_chat_status_msg, list_chats_like,\
+      set_selection, get_selection,\
+      set_chat_status_msg, check_invoice_progress, list_chat_ids,\
+      create_broadcast_job, set_broadcast_progress_msg, search_chats, cache_stats, archive_stats,\
+      get_digest, set_digest, vacuum_incremental
+from digest import digest_buffer
 from utils import edit_message, escape_html
-from datetime import datetime
 from kb import MANAGER_RK
 from aiogram.exceptions import TelegramBadRequest
+import broadcasts
+import invoice_browser
+import metrics
+from outbound import scheduler as outbound_scheduler
+from middlewares import update_scheduler
+from backup import run_backup
+from archive import run_archive
 
 def setup(dp: Dispatcher, bot: Bot) -> None:
     dp.message.register(db_backup_now, Command("db_backup"), F.chat.type == ChatType.PRIVATE)
+    dp.message.register(db_check, Command("db_check"), F.chat.type == ChatType.PRIVATE)
+    dp.message.register(db_archive, Command("db_archive"), F.chat.type == ChatType.PRIVATE)
     dp.message.register(cmd_broadcast, Command("broadcast"), F.chat.type == ChatType.PRIVATE)
     dp.message.register(cmd_list_chats, Command("list_chats"), F.chat.type == ChatType.PRIVATE)
     dp.message.register(cmd_select_chat, Command("select_chat"), F.chat.type == ChatType.PRIVATE)
@@ -25,6 +35,8 @@ def setup(dp: Dispatcher, bot: Bot) -> None:
     dp.message.register(cmd_invoices, Command("invoices"), F.chat.type == ChatType.PRIVATE)
     dp.message.register(cmd_menu, Command("menu"), F.chat.type == ChatType.PRIVATE)
     dp.message.register(cmd_hide, Command("hide"), F.chat.type == ChatType.PRIVATE)
+    dp.message.register(cmd_stats, Command("stats"), F.chat.type == ChatType.PRIVATE)
+    dp.message.register(cmd_digest, Command("digest"), F.chat.type == ChatType.PRIVATE)
 
 async def cmd_ping(message: Message):
         if message.from_user.id in MANAGER_IDS:
@@ -34,12 +46,80 @@ async def db_backup_now(message: Message):
     if message.from_user.id not in MANAGER_IDS:
         return
     try:
-        await sqlite_checkpoint()
-        path = await sqlite_backup_once()
-        await message.answer(f"✅ Бэкап создан: {escape_html(str(path))}")
+        res = await run_backup()
+        await message.answer(
+            f"✅ Бэкап создан: {escape_html(str(res.path))}\n"
+            f"{res.size_bytes / 1024:.0f} КБ, {res.duration_ms} мс, проверка integrity_check: ok"
+            + (f"\nУдалено по ротации: {len(res.removed)}" if res.removed else "")
+        )
     except Exception as e:
         await message.answer(f"❌ Ошибка бэкапа: {escape_html(str(e))}")
 
+async def db_check(message: Message, command: CommandObject):
+    """/db_check [fix] — сверка флагов прогресса заявок с журналом событий."""
+    if message.from_user.id not in MANAGER_IDS:
+        return
+    fix = (command.args or "").strip().lower() == "fix"
+    mismatches = await check_invoice_progress(fix=fix)
+    if not mismatches:
+        await message.answer("✅ Флаги заявок согласованы с журналом событий.")
+        return
+    lines = [f"⚠️ Расхождений: {len(mismatches)}" + (" (исправлено)" if fix else "")]
+    for iid, stored, expected in mismatches[:10]:
+        lines.append(f"• #{iid}: в таблице {stored:#04x}, по событиям {expected:#04x}")
+    if not fix:
+        lines.append("\n/db_check fix — пересчитать по событиям.")
+    await message.answer("\n".join(lines))
+
+async def db_archive(message: Message, command: CommandObject):
+    """
+    /db_archive [run|vacuum] — размеры рабочих и архивных таблиц заявок; run — перенести закрытые сейчас;
+    vacuum — однократный перевод рабочей БД в auto_vacuum=INCREMENTAL (полный VACUUM, на время — без записи).
+    """
+    if message.from_user.id not in MANAGER_IDS:
+        return
+    lines = []
+    arg = (command.args or "").strip().lower()
+    if arg == "run":
+        res = await run_archive()
+        lines.append(f"🗄 Перенесено в архив: {res.moved} ({res.batches} пачек, {res.duration_ms} мс)\n")
+    elif arg == "vacuum":
+        await message.answer("🧹 VACUUM рабочей БД запущен, запись на это время ждёт…")
+        took = await vacuum_incremental()
+        lines.append("🧹 auto_vacuum уже INCREMENTAL, VACUUM не нужен.\n" if took is None
+                     else f"🧹 VACUUM готов за {took:.1f} с: освобождённое архивом место теперь возвращается файлу.\n")
+    stats = await archive_stats()
+    for schema, label in (("main", "🔥 Рабочая БД"), ("archive", "🧊 Архив")):
+        st = stats.get(schema)
+        if st is None:
+            lines.append(f"{label}: не подключён")
+            continue
+        lines.append(
+            f"{label}: {st['bytes'] / 1024:.0f} КБ"
+            + (f" (свободных страниц {st['free_pages']})" if st["free_pages"] else "")
+            + f"\n  заявок {st['invoices']}, событий {st['invoice_events']}, карточек {st['invoice_cards']}"
+        )
+    if "archive" in stats:
+        lines.append("\n/db_archive run — перенести закрытые заявки сейчас.")
+    lines.append("/db_archive vacuum — однократно включить возврат места файлу (полный VACUUM).")
+    await message.answer("\n".join(lines))
+
+async def cmd_stats(message: Message):
+    """/stats — сводка задержек (хендлеры, БД, Bot API), кэшей и очередей отправки."""
+    if message.from_user.id not in MANAGER_IDS:
+        return
+    caches = " · ".join(f"{name} {st['hit_ratio']:.0%}" for name, st in cache_stats().items())
+    out = outbound_scheduler.stats()
+    queued = sum(v["queued_global"] + v["waiting_chat"] for k, v in out.items() if isinstance(v, dict))
+    upd = update_scheduler.stats()
+    await message.answer(
+        metrics.summary()
+        + f"\n\n🧠 Кэш (попадания): {caches or '—'}"
+        + f"\n📤 Очередь отправки: {queued}, retry_after: {out['retry_after']}"
+        + f"\n📥 Апдейты: в работе {upd['in_flight']}/{upd['limit']}, в очереди {upd['waiting']}"
+          f" (пик {upd['peak_waiting']}), ожидание своего чата p99 {(upd['wait_p99'] or 0) * 1e3:.0f} мс"
+    )
+
 async def cmd_broadcast(message: Message, command: CommandObject):
     if message.from_user.id not in MANAGER_IDS:
         return
@@ -59,32 +139,25 @@ async def cmd_broadcast(message: Message, command: CommandObject):
         return
     targets: list[int] = []
     if key.lower() == "all":
-        rows = await list_chats_like(None)
-        targets = [r[0] for r in rows]
+        targets = await list_chat_ids()
     elif key.lstrip("-").isdigit():
         targets = [int(key)]
     else:
-        rows = await list_chats_like(key)
+        rows = await search_chats(key, limit=None)  # все совпадения по каталогу, не только свежие
         if not rows:
             await message.answer("По заданной подстроке чатов не найдено.")
             return
         targets = [r[0] for r in rows]
+    if not targets:
+        await message.answer("Пока нет известных чатов для рассылки.")
+        return
 
-    sent = failed = 0
-    errors = []
-    for cid in targets:
-        try:
-            await message.bot.send_message(chat_id=cid, text=text)
-            sent += 1
-        except Exception as e:
-            failed += 1
-            errors.append(f"{cid}: {e}")
-        await asyncio.sleep(0.05)
-    msg = f"📣 Готово. Успешно: {sent}, ошибок: {failed}."
-    if failed and errors:
-        tail = "\n".join(errors[:5])
-        msg += f"\n\nПервые ошибки:\n{tail}" + ("…ещё есть ошибки" if len(errors) > 5 else "")
-    await message.answer(msg)
+    # рассылка идёт фоном: задание в БД, прогресс — в одном сообщении с кнопками
+    job_id = await create_broadcast_job(message.from_user.id, text, targets)
+    progress_text, kb = await broadcasts.render_progress(job_id)
+    progress = await message.answer(progress_text, reply_markup=kb)
+    await set_broadcast_progress_msg(job_id, progress.chat.id, progress.message_id)
+    broadcasts.start_job(message.bot, job_id)
 
 async def cmd_list_chats(message: Message):
     if message.from_user.id not in MANAGER_IDS:
@@ -171,6 +244,7 @@ async def cmd_start(message: Message):
         "• /select_chat &lt;имя|@username|id&gt; — выбрать чат\n"
         "• /where — текущий чат\n"
         "• /broadcast … — рассылка\n"
+        "• /digest on|off|&lt;мин&gt; — запросы из групп сводкой\n"
         "• /menu — показать кнопки, /hide — скрыть\n"
     )
     await message.answer(text, reply_markup=MANAGER_RK)
@@ -184,31 +258,16 @@ async def cmd_start(message: Message):
     
     
 
-def _fmt_ts(ts: int) -> str:
-    try:
-        return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
-    except Exception:
-        return str(ts)
-
-async def cmd_invoices(message: Message):
+async def cmd_invoices(message: Message, command: CommandObject):
+    """/invoices [фильтр] [чат] — постраничный список заявок; листается кнопками в том же сообщении."""
     if message.from_user.id not in MANAGER_IDS:
         return
-    items = await list_open_invoices_with_state(limit=30)
-    if not items:
-        await message.answer("✅ Открытых задач нет.")
+    flt, chat_id, error = await invoice_browser.parse_args(command.args)
+    if error:
+        await message.answer(error)
         return
-
-    lines = ["🧾 <b>Открытые заявки</b>:"]
-    for it in items:
-        done = " · ".join(it["done"]) if it["done"] else "—"
-        left = " · ".join(it["remaining"]) if it["remaining"] else "—"
-        lines.append(
-            f"• #{it['id']} — статус: <code>{it['status']}</code>\n"
-            f"  чат: <code>{it['chat_id']}</code>, создано: { _fmt_ts(it['created_ts']) }\n"
-            f"  сделано: {done}\n"
-            f"  осталось: {left}"
-        )
-    await message.answer("\n".join(lines))
+    text, kb = await invoice_browser.render_page(flt, chat_id)
+    await message.answer(text, reply_markup=kb)
 
 
 async def cmd_menu(message: Message):
@@ -221,3 +280,36 @@ async def cmd_hide(message: Message):
     if not message.from_user or message.from_user.id not in MANAGER_IDS:
         return
     await message.answer("Меню скрыто.", reply_markup=ReplyKeyboardRemove())
+
+
+async def cmd_digest(message: Message, command: CommandObject):
+    """/digest [on|off|<минуты>] — режим дайджеста: запросы из групп одной сводкой за окно."""
+    if message.from_user.id not in MANAGER_IDS:
+        return
+    uid = message.from_user.id
+    arg = (command.args or "").strip().lower()
+    if arg in ("on", "вкл"):
+        window = DIGEST_WINDOW
+    elif arg in ("off", "выкл", "0"):
+        window = 0
+    elif arg.isdigit():
+        window = int(arg) * 60
+    elif not arg:
+        current = await get_digest(uid)
+        await message.answer(
+            (f"🗂 Дайджест включён: окно {current // 60} мин, в буфере {digest_buffer.pending(uid)}."
+             if current else "🗂 Дайджест выключен: запросы из групп приходят сразу.")
+            + "\n/digest on | off | &lt;минуты&gt;"
+        )
+        return
+    else:
+        await message.answer("Использование: /digest on | off | &lt;минуты&gt;")
+        return
+
+    await set_digest(uid, window)
+    if not window:
+        digest_buffer.flush_now(uid)  # накопленное — сразу, дальше без дайджеста
+        await message.answer("🗂 Дайджест выключен: запросы из групп приходят сразу.")
+        return
+    await message.answer(f"🗂 Дайджест включён: сводка раз в {window // 60} мин. "
+                         "Срочные запросы и /invoice приходят сразу.")
@@ -4,7 +4,7 @@ from aiogram import Dispatcher, Bot, F
 from aiogram.types import Message
 from aiogram.enums import ChatType, ContentType
 
-from config import MANAGER_IDS, log
+from config import MANAGER_IDS
 
 # ⚙️ БД-хелперы
 from db import (
@@ -12,13 +12,14 @@ from db import (
     get_invoice,
     clear_mode,
     set_invoice_status,
-    get_invoice_cards,      # ← добавлено: чтобы обновлять карточки у всех менеджеров
 )
 
 # 🧩 Общие утилиты по задачам
 from .common import (
     send_media_no_caption,
-    build_invoice_kb,       # ← оставляем только из .common (а НЕ из db)  [ОТКАТ дублирующего импорта]
+    send_media_group_no_caption,
+    album_collector,        # части альбома (media_group_id) -> один вызов с целым альбомом
+    card_refresher,         # перерисовка карточек у всех менеджеров (с дебаунсом и без лишних правок)
 )
 
 # Только поддерживаемые типы — сюда не попадут команды/текст
@@ -42,16 +43,30 @@ def setup(dp: Dispatcher, bot: Bot) -> None:
 
 async def manager_media_flow(message: Message):
     """
-    Получили от менеджера в ЛС файл для конкретной заявки:
-      - публикуем файл в исходную группу (reply к /invoice) без подписи,
-      - фиксируем фактический статус (ACCOUNTING_REPLIED или SWIFT_SENT),
-      - пересобираем клавиатуры карточек у всех менеджеров (убираем только сделанное),
-      - чистим режим ожидания файла.
+    Получили от менеджера в ЛС файл для конкретной заявки.
+    Части альбома (несколько файлов одной отправкой) сначала собираются album_collector'ом
+    и обрабатываются вместе — одним sendMediaGroup, одним событием и одной перерисовкой.
     """
     # Только менеджеры
     if not message.from_user or message.from_user.id not in MANAGER_IDS:
         return
 
+    if message.media_group_id:
+        album_collector.add(message, post_files)
+        return
+    await post_files([message])
+
+
+async def post_files(messages: list[Message]):
+    """
+    Файл (или альбом) менеджера по заявке из режима ожидания:
+      - публикуем в исходную группу (reply к /invoice) без подписи,
+      - фиксируем фактический статус (ACCOUNTING_REPLIED или SWIFT_SENT),
+      - пересобираем клавиатуры карточек у всех менеджеров (убираем только сделанное),
+      - чистим режим ожидания файла.
+    """
+    message = messages[0]
+
     # Ждём установленный режим из колбэка
     mode = await get_mode(message.from_user.id)
     if not mode:
@@ -69,34 +84,24 @@ async def manager_media_flow(message: Message):
 
     chat_id, origin_msg_id = inv[1], inv[2]
 
-    # 1) Публикуем файл в исходную группу, реплаем на /invoice (без подписи)
-    await send_media_no_caption(message.bot, chat_id, message, reply_to=origin_msg_id)
+    # 1) Публикуем файл(ы) в исходную группу, реплаем на /invoice (без подписи)
+    if len(messages) > 1:
+        await send_media_group_no_caption(message.bot, chat_id, messages, reply_to=origin_msg_id)
+    else:
+        await send_media_no_caption(message.bot, chat_id, message, reply_to=origin_msg_id)
 
-    # 2) Фиксируем ФАКТ (а не намерение)  [ОТКАТ INTENT-событий]
+    # 2) Фиксируем ФАКТ (а не намерение) — одно событие на отправку, сколько бы ни было файлов  [ОТКАТ INTENT-событий]
+    files = f" ({len(messages)} шт.)" if len(messages) > 1 else ""
     if action == "SWIFT_FILE":
         await set_invoice_status(inv_id, "SWIFT_SENT", message.from_user.id, None)
-        await message.answer("📄 SWIFT отправлен.")
+        await message.answer(f"📄 SWIFT отправлен{files}.")
     else:
         await set_invoice_status(inv_id, "ACCOUNTING_REPLIED", message.from_user.id, None)
-        await message.answer("📎 Файл отправлен в группу.")
+        await message.answer(f"📎 Файл отправлен в группу{files}.")
 
     # 3) Обновляем клавиатуры карточек у всех менеджеров
     #    (кнопка исчезает только после факта доставки)  [ВАЖНОЕ ИЗМЕНЕНИЕ]
-    try:
-        kb = await build_invoice_kb(inv_id)     # станет без соответствующей кнопки
-        cards = await get_invoice_cards(inv_id) # [(manager_id, dm_chat_id, message_id), ...]
-        for _, dm_chat_id, msg_id in cards:
-            try:
-                await message.bot.edit_message_reply_markup(
-                    chat_id=dm_chat_id,
-                    message_id=msg_id,
-                    reply_markup=kb,
-                )
-            except Exception as e:
-                # Карточка могла быть удалена у конкретного менеджера — не критично
-                log.debug("edit_message_reply_markup failed for inv=%s msg=%s: %s", inv_id, msg_id, e)
-    except Exception as e:
-        log.warning("update invoice cards failed for #%s: %s", inv_id, e)
-
-    # 4) Сбрасываем режим ожидания файла для менеджера
+    card_refresher.refresh(message.bot, inv_id)
+
+    # 4) Сбрасываем режим ожидания файла для менеджера (альбом — один раз на всю пачку)
     await clear_mode(message.from_user.id)
@@ -0,0 +1,119 @@
+# invoice_browser.py — постраничный просмотр заявок (/invoices): keyset по id, правка одного сообщения
+import re
+from datetime import datetime
+from typing import Optional
+
+from aiogram.types import InlineKeyboardMarkup
+
+from config import INVOICES_PAGE_SIZE
+from db import list_invoices_page, search_chats
+from kb import invoice_page_kb
+from utils import escape_html
+
+# код фильтра (в callback_data) -> (invoices.status для list_invoices_page, подпись)
+FILTERS = {
+    "o": ("OPEN", "Открытые"),
+    "n": ("NEW", "Новые"),
+    "s": ("SENT_TO_ACCOUNTING", "В бухгалтерии"),
+    "f": ("ACCOUNTING_REPLIED", "Файл в группе"),
+    "w": ("SWIFT_SENT", "SWIFT отправлен"),
+    "r": ("REPORT_REQUESTED", "Отчёт запрошен"),
+    "d": ("DONE", "Закрытые"),
+    "a": (None, "Все"),
+}
+QUICK_FILTERS = ("o", "n", "d", "a")  # кнопки под списком
+ARG_FILTERS = {
+    "open": "o", "new": "n", "sent": "s", "replied": "f",
+    "swift": "w", "report": "r", "done": "d", "all": "a",
+}
+
+PAGE_RE = re.compile(r"^ivp:([a-z]):(-?\d+):([fnp]):(\d+)$")
+
+USAGE = (
+    "Использование: /invoices [фильтр] [чат]\n"
+    f"Фильтры: {', '.join(ARG_FILTERS)} (по умолчанию open).\n"
+    "Чат — id или часть названия."
+)
+
+
+def _fmt_ts(ts: int) -> str:
+    try:
+        return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
+    except Exception:
+        return str(ts)
+
+
+async def parse_args(args: Optional[str]) -> tuple[str, int, Optional[str]]:
+    """'/invoices done Логистика' -> (код фильтра, chat_id или 0, текст ошибки или None)."""
+    flt, chat_id = "o", 0
+    parts = (args or "").split(maxsplit=1)
+    if parts and parts[0].lower() in ARG_FILTERS:
+        flt = ARG_FILTERS[parts.pop(0).lower()]
+    chat_spec = parts[0].strip() if parts else ""
+    if chat_spec.lstrip("-").isdigit():
+        chat_id = int(chat_spec)
+    elif chat_spec:
+        found = await search_chats(chat_spec, limit=1)
+        if not found:
+            return flt, 0, f"Чат «{escape_html(chat_spec)}» не найден.\n\n{USAGE}"
+        chat_id = found[0][0]
+    return flt, chat_id, None
+
+
+async def render_page(flt: str = "o", chat_id: int = 0, direction: str = "f",
+                      cursor: int = 0) -> tuple[str, InlineKeyboardMarkup]:
+    """
+    Текст и клавиатура страницы. direction: f — первая (самые новые),
+    n — старше cursor, p — новее cursor. Один запрос к БД на страницу:
+    берём на одну заявку больше, чтобы узнать, есть ли куда листать дальше.
+    """
+    status, label = FILTERS.get(flt, FILTERS["o"])
+    chat = chat_id or None
+    size = INVOICES_PAGE_SIZE
+
+    items: list = []
+    has_newer = has_older = False
+    if direction == "p":
+        items = await list_invoices_page(status, chat, after=cursor, limit=size + 1)
+        if len(items) > size:
+            items, has_newer, has_older = items[-size:], True, True
+        else:
+            direction = "f"  # упёрлись в начало — показываем первую страницу целиком
+    elif direction == "n":
+        items = await list_invoices_page(status, chat, before=cursor, limit=size + 1)
+        if items:
+            has_newer, has_older = True, len(items) > size
+            items = items[:size]
+        else:
+            direction = "f"  # дальше пусто (заявки закрылись) — на первую
+    if direction == "f":
+        items = await list_invoices_page(status, chat, limit=size + 1)
+        has_older = len(items) > size
+        items = items[:size]
+
+    header = f"🧾 <b>{label}</b>"
+    if chat:
+        title = items[0]["chat_title"] if items else None
+        header += f" · чат {escape_html(title or '(без названия)')} (<code>{chat}</code>)"
+    if not items:
+        text = header + "\n\n" + ("✅ Открытых задач нет." if flt == "o" else "Заявок не найдено.")
+    else:
+        lines = [header + f" · #{items[0]['id']}…#{items[-1]['id']}:"]
+        for it in items:
+            done = " · ".join(it["done"]) if it["done"] else "—"
+            left = " · ".join(it["remaining"]) if it["remaining"] else "—"
+            lines.append(
+                f"• #{it['id']} — статус: <code>{it['status']}</code>\n"
+                f"  чат: {escape_html(it['chat_title'] or '(без названия)')} (<code>{it['chat_id']}</code>), создано: {_fmt_ts(it['created_ts'])}\n"
+                f"  сделано: {done}\n"
+                f"  осталось: {left}"
+            )
+        text = "\n".join(lines)
+
+    kb = invoice_page_kb(
+        flt, chat_id,
+        items[0]["id"] if items else None, items[-1]["id"] if items else None,
+        has_newer, has_older,
+        [(code, FILTERS[code][1]) for code in QUICK_FILTERS],
+    )
+    return text, kb
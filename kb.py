@@ -1,17 +1,108 @@
 # kb.py
+import functools
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
-def invoice_kb(inv_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Отправил в бух", callback_data=f"inv:{inv_id}:MARK_SENT")],
-        [
-            InlineKeyboardButton(text="📎 Файл в группу", callback_data=f"inv:{inv_id}:POST_FILE"),
-            InlineKeyboardButton(text="📄 SWIFT",        callback_data=f"inv:{inv_id}:SWIFT_FILE"),
-        ],
-        [InlineKeyboardButton(text="📝 Запросить отчёт", callback_data=f"inv:{inv_id}:REQUEST_REPORT")],
-        [InlineKeyboardButton(text="✔ Закрыть",         callback_data=f"inv:{inv_id}:DONE")],
+# карточка заявки: кнопки зависят только от 4 флагов прогресса -> 16 раскладок,
+# считаются один раз при импорте; при рендере подставляется лишь id заявки
+INVOICE_FLAGS = ("sent_to_accounting", "accounting_replied", "swift_sent", "report_requested")
+
+
+def _invoice_layout(mask: int) -> tuple[tuple[tuple[str, str], ...], ...]:
+    """Раскладка для маски выполненных шагов (бит i — INVOICE_FLAGS[i]): ряды (текст, действие)."""
+    sent, replied, swift, report = (bool(mask & (1 << i)) for i in range(len(INVOICE_FLAGS)))
+    rows = []
+    if not sent:
+        rows.append((("✅ Отправил в бух", "MARK_SENT"),))
+    line = []
+    if not replied:
+        line.append(("📎 Файл в группу", "POST_FILE"))
+    if not swift:
+        line.append(("📄 SWIFT", "SWIFT_FILE"))
+    if line:
+        rows.append(tuple(line))
+    if not report:
+        rows.append((("📝 Запросить отчёт", "REQUEST_REPORT"),))
+    # кнопка "Закрыть" всегда доступна, пока заявка не DONE
+    rows.append((("✔ Закрыть", "DONE"),))
+    return tuple(rows)
+
+
+INVOICE_LAYOUTS = tuple(_invoice_layout(mask) for mask in range(1 << len(INVOICE_FLAGS)))
+
+# провалидированные шаблоны кнопок по раскладкам: рендер = model_copy с подстановкой callback_data
+_INVOICE_TEMPLATES = tuple(
+    (
+        InlineKeyboardMarkup(inline_keyboard=[]),
+        tuple(tuple((InlineKeyboardButton(text=text, callback_data=action), action) for text, action in row)
+              for row in layout),
+    )
+    for layout in INVOICE_LAYOUTS
+)
+
+
+def invoice_layout_key(state: dict) -> int:
+    """Номер раскладки по состоянию заявки (db.get_invoice_state / progress_state)."""
+    return sum(1 << i for i, flag in enumerate(INVOICE_FLAGS) if state.get(flag))
+
+
+@functools.lru_cache(maxsize=4096)
+def invoice_kb(inv_id: int, layout: int = 0) -> InlineKeyboardMarkup:
+    """
+    Клавиатура карточки заявки по готовой раскладке (0 — все кнопки).
+    Результат кэшируется по (заявка, раскладка) и разделяется между вызовами — не изменяйте его:
+    одну и ту же клавиатуру рендерят карточки всех менеджеров и повторные перерисовки.
+    Память экономит именно кэш: промах по-прежнему создаёт по модели на кнопку (bench/keyboards).
+    """
+    markup, rows = _INVOICE_TEMPLATES[layout]
+    return markup.model_copy(update={"inline_keyboard": [
+        [button.model_copy(update={"callback_data": f"inv:{inv_id}:{action}"}) for button, action in row]
+        for row in rows
+    ]})
+
+
+def broadcast_kb(job_id: int, status: str) -> InlineKeyboardMarkup | None:
+    """Кнопки управления фоновой рассылкой; None — задание завершено."""
+    if status == "RUNNING":
+        first = InlineKeyboardButton(text="⏸ Пауза", callback_data=f"bc:{job_id}:PAUSE")
+    elif status == "PAUSED":
+        first = InlineKeyboardButton(text="▶ Продолжить", callback_data=f"bc:{job_id}:RESUME")
+    else:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        first,
+        InlineKeyboardButton(text="✖ Отменить", callback_data=f"bc:{job_id}:CANCEL"),
+    ]])
+
+
+def invoice_page_cb(flt: str, chat_id: int, direction: str, cursor: int) -> str:
+    """callback_data страницы /invoices: ivp:<фильтр>:<chat_id|0>:<f|n|p>:<id-курсор> (≤ 64 байт)."""
+    return f"ivp:{flt}:{chat_id}:{direction}:{cursor}"
+
+
+def invoice_page_kb(flt: str, chat_id: int, first_id: int | None, last_id: int | None,
+                    has_newer: bool, has_older: bool, filters) -> InlineKeyboardMarkup:
+    """Навигация по страницам заявок + быстрые фильтры; filters — [(код, подпись)]."""
+    rows = []
+    nav = []
+    if has_newer and first_id is not None:
+        nav.append(InlineKeyboardButton(text="◀ Новее", callback_data=invoice_page_cb(flt, chat_id, "p", first_id)))
+    if first_id is not None:
+        # «обновить» = та же страница: всё, что старше first_id + 1
+        nav.append(InlineKeyboardButton(text="🔄", callback_data=invoice_page_cb(flt, chat_id, "n", first_id + 1)))
+    if has_older and last_id is not None:
+        nav.append(InlineKeyboardButton(text="Старее ▶", callback_data=invoice_page_cb(flt, chat_id, "n", last_id)))
+    if nav:
+        rows.append(nav)
+    rows.append([
+        InlineKeyboardButton(text=("• " if code == flt else "") + label,
+                             callback_data=invoice_page_cb(code, chat_id, "f", 0))
+        for code, label in filters
     ])
+    if chat_id:
+        rows.append([InlineKeyboardButton(text="✖ Все чаты", callback_data=invoice_page_cb(flt, 0, "f", 0))])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
 MANAGER_RK = ReplyKeyboardMarkup(
@@ -0,0 +1,285 @@
+# metrics.py — гистограммы задержек хендлеров, запросов к БД и вызовов Bot API
+#
+# Источники:
+#   HandlerTimingMiddleware — время каждого хендлера из handlers/* (inner middleware);
+#   instrument_module()     — обёртка публичных корутин db.py: время по имени запроса;
+#   ApiMetricsMiddleware    — сессионная middleware: время/ошибки/retry_after по методу Bot API;
+#   middlewares.UpdateScheduler — очередь апдейтов: ожидание, глубина, занятые слоты.
+# Отдаётся текстом Prometheus на локальном порту (METRICS_PORT) и сводкой в /stats.
+import bisect
+import functools
+import inspect
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiohttp import web
+
+from config import log
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (секунды) на каждый набор меток."""
+
+    def __init__(self, name: str, doc: str, labelnames: tuple[str, ...], buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (+Inf последним), сумма, количество]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        s[0][bisect.bisect_left(self.buckets, value)] += 1
+        s[1] += value
+        s[2] += 1
+
+    def series(self) -> dict[tuple, tuple[int, float]]:
+        """{метки: (количество, сумма)}."""
+        return {k: (s[2], s[1]) for k, s in self._series.items()}
+
+    def quantile(self, q: float, *labels) -> Optional[float]:
+        """Оценка квантиля по корзинам (линейно внутри корзины), как histogram_quantile."""
+        s = self._series.get(labels)
+        if not s or not s[2]:
+            return None
+        rank = q * s[2]
+        seen = 0
+        for i, n in enumerate(s[0]):
+            if seen + n >= rank and n:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                if i >= len(self.buckets):
+                    return lo  # выше последней корзины — знаем только нижнюю границу
+                return lo + (self.buckets[i] - lo) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for le, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                le_label = 'le="%s"' % le
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, labels, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labelnames, labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels_text(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labelnames: tuple[str, ...]):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, value: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def values(self) -> dict[tuple, float]:
+        return dict(self._values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for labels, v in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels_text(self.labelnames, labels)} {v:g}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, doc: str):
+        self.name = name
+        self.doc = doc
+        self.value = 0.0
+
+    def inc(self, value: float = 1) -> None:
+        self.value += value
+
+    def dec(self, value: float = 1) -> None:
+        self.value -= value
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge", f"{self.name} {self.value:g}"]
+
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время работы хендлера", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хендлерах", ("handler",))
+DB_SECONDS = Histogram("bot_db_seconds", "Время вызова db.py (включая ожидание соединения)", ("query",))
+DB_ERRORS = Counter("bot_db_errors_total", "Исключения в вызовах db.py", ("query",))
+API_SECONDS = Histogram("bot_api_seconds", "Время запроса к Bot API (одна попытка)", ("method",))
+API_ERRORS = Counter("bot_api_errors_total", "Ошибки Bot API", ("method", "error"))
+API_RETRY_AFTER = Counter("bot_api_retry_after_total", "Ответы retry_after (flood control)", ("method",))
+API_RETRY_AFTER_SECONDS = Counter("bot_api_retry_after_seconds_total", "Сумма запрошенных retry_after, сек", ())
+UPDATE_WAIT_SECONDS = Histogram("bot_update_wait_seconds", "Ожидание апдейта до обработки", ("stage",))
+UPDATES_DEFERRED = Counter("bot_updates_deferred_total", "Апдейты, вставшие в очередь", ("reason",))
+UPDATES_IN_FLIGHT = Gauge("bot_updates_in_flight", "Апдейтов в обработке")
+UPDATES_WAITING = Gauge("bot_updates_waiting", "Апдейтов в очереди (ждут свой чат или свободный слот)")
+DUPLICATES_DROPPED = Counter("bot_duplicates_dropped_total", "Повторы, отброшенные dedup.py", ("scope",))
+
+REGISTRY = [HANDLER_SECONDS, HANDLER_ERRORS, DB_SECONDS, DB_ERRORS,
+            API_SECONDS, API_ERRORS, API_RETRY_AFTER, API_RETRY_AFTER_SECONDS,
+            UPDATE_WAIT_SECONDS, UPDATES_DEFERRED, UPDATES_IN_FLIGHT, UPDATES_WAITING, DUPLICATES_DROPPED]
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ------------------------- ХЕНДЛЕРЫ -------------------------
+def _handler_name(data: dict) -> str:
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    if callback is None:
+        return "unknown"
+    module = getattr(callback, "__module__", "") or ""
+    return f"{module.removeprefix('handlers.')}.{getattr(callback, '__qualname__', repr(callback))}"
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Inner middleware: вызывается только для сработавшего хендлера, меряет его целиком."""
+
+    async def __call__(self, handler: Callable[[Any, dict], Awaitable[Any]], event: Any, data: dict) -> Any:
+        name = _handler_name(data)
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - t0, name)
+
+
+def setup_handler_metrics(dp) -> None:
+    """Подключить тайминг ко всем наблюдателям событий диспетчера (message, callback_query, ...)."""
+    middleware = HandlerTimingMiddleware()
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(middleware)
+
+
+# ------------------------- БД -------------------------
+def _timed(name: str, fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(name)
+            raise
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - t0, name)
+    wrapper.__wrapped_metrics__ = True
+    return wrapper
+
+
+def instrument_module(namespace: dict, module: str, skip: tuple[str, ...] = ()) -> None:
+    """
+    Обернуть публичные корутины модуля (db.py) замером времени по имени функции.
+    Вызывается в конце модуля, до импорта его функций хендлерами.
+    """
+    for name, obj in list(namespace.items()):
+        if (name.startswith("_") or name in skip or not inspect.iscoroutinefunction(obj)
+                or getattr(obj, "__module__", None) != module or getattr(obj, "__wrapped_metrics__", False)):
+            continue
+        namespace[name] = _timed(name, obj)
+
+
+# ------------------------- BOT API -------------------------
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Сессионная middleware: время и исход каждого HTTP-запроса к Bot API.
+    Регистрируется после OutboundMiddleware (внутри неё), поэтому видит каждую попытку
+    и каждый retry_after, а ожидание лимитов в замер не попадает.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        t0 = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            API_RETRY_AFTER.inc(name)
+            API_RETRY_AFTER_SECONDS.inc(value=e.retry_after)
+            API_ERRORS.inc(name, "TelegramRetryAfter")
+            raise
+        except Exception as e:
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - t0, name)
+
+
+# ------------------------- HTTP + СВОДКА -------------------------
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render_prometheus().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    """GET /metrics в формате Prometheus text."""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("[metrics] http://%s:%s/metrics", host, port)
+    return runner
+
+
+def _fmt_ms(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "—"
+    return f"{seconds * 1e3:.0f}" if seconds >= 0.01 else f"{seconds * 1e3:.1f}"
+
+
+def _top(hist: Histogram, errors: Optional[Counter], limit: int) -> list[str]:
+    series = sorted(hist.series().items(), key=lambda kv: kv[1][1], reverse=True)[:limit]
+    lines = []
+    for labels, (count, total) in series:
+        err = ""
+        if errors is not None:
+            n_err = sum(v for k, v in errors.values().items() if k[0] == labels[0])
+            err = f", ошибок {n_err:g}" if n_err else ""
+        lines.append(
+            f"• <code>{labels[0]}</code> ×{count}: p50 {_fmt_ms(hist.quantile(0.5, *labels))} / "
+            f"p99 {_fmt_ms(hist.quantile(0.99, *labels))} мс{err}"
+        )
+    return lines or ["• —"]
+
+
+def summary(limit: int = 6) -> str:
+    """Компактная сводка для /stats: самые «дорогие» по суммарному времени."""
+    retry = sum(API_RETRY_AFTER.values().values())
+    lines = ["📊 <b>Хендлеры</b>:", *_top(HANDLER_SECONDS, HANDLER_ERRORS, limit),
+             "\n🗄 <b>БД</b>:", *_top(DB_SECONDS, DB_ERRORS, limit),
+             "\n📡 <b>Bot API</b>:", *_top(API_SECONDS, API_ERRORS, limit)]
+    if retry:
+        lines.append(f"⏳ retry_after: {retry:g} раз, всего {API_RETRY_AFTER_SECONDS.get():g} с")
+    return "\n".join(lines)
@@ -0,0 +1,190 @@
+# middlewares.py — общие middleware диспетчера
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update, User
+
+from config import UPDATE_CONCURRENCY
+from metrics import UPDATE_WAIT_SECONDS, UPDATES_DEFERRED, UPDATES_IN_FLIGHT, UPDATES_WAITING
+
+
+class BotIdentityMiddleware(BaseMiddleware):
+    """
+    Кладёт профиль бота в data["bot_me"] — хендлеры получают его аргументом `bot_me`
+    вместо bot.get_me() (HTTP-запрос) на каждое сообщение.
+    Профиль берётся один раз: переданный при старте или первый bot.me().
+    """
+
+    def __init__(self, me: Optional[User] = None):
+        self.me = me
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self.me is None:
+            self.me = await data["bot"].me()
+        data["bot_me"] = self.me
+        return await handler(event, data)
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """
+    Отбрасывает повторно доставленный апдейт (тот же update_id) до хендлеров:
+    рестарт polling, повтор вебхука, at-least-once очередь воркеров. Хранилище — dedup.DedupStore.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.store.begin_update(event.update_id):
+            return None
+        done = True
+        try:
+            return await handler(event, data)
+        except asyncio.CancelledError:
+            # брошен при остановке: не считаем обработанным, повторная доставка его выполнит
+            done = False
+            self.store.forget_update(event.update_id)
+            raise
+        finally:
+            if done:
+                self.store.done_update(event.update_id)
+
+
+def update_key(update: Update) -> Optional[Hashable]:
+    """
+    Ключ очереди апдейта: кнопки карточки — по заявке (два менеджера жмут одну карточку),
+    остальное — по чату. None — апдейт ни с чем не упорядочивается.
+    """
+    cq = update.callback_query
+    if cq is not None:
+        parts = (cq.data or "").split(":", 2)
+        if parts[0] == "inv" and len(parts) == 3 and parts[1].isdigit():
+            return "inv", int(parts[1])
+        if cq.message is not None:
+            return "chat", cq.message.chat.id
+        return "user", cq.from_user.id
+    event = update.message or update.edited_message or update.my_chat_member or update.chat_member
+    if event is not None:
+        return "chat", event.chat.id
+    return None
+
+
+class UpdateScheduler(BaseMiddleware):
+    """
+    Outer middleware на dp.update, регистрируется первой.
+    Апдейты с одним ключом (update_key) обрабатываются строго по одному в порядке поступления,
+    разные ключи — параллельно, но не больше limit одновременно. Апдейт, ждущий свой ключ,
+    слот не занимает: медленный чат тормозит только себя.
+    Polling и вебхук создают задачу на апдейт в порядке получения и доходят до этой
+    middleware без ожиданий, поэтому очередь блокировки ключа (FIFO) = порядок Telegram.
+    """
+
+    def __init__(self, limit: int = UPDATE_CONCURRENCY):
+        self.limit = limit
+        self._slots = asyncio.Semaphore(limit)
+        self._keys: dict[Hashable, list] = {}  # ключ -> [Lock, апдейтов с этим ключом в очереди/работе]
+        self._tasks: dict[asyncio.Task, Optional[int]] = {}  # задача апдейта в очереди/работе -> update_id (drain)
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        key = update_key(event) if isinstance(event, Update) else None
+        entry = None
+        if key is not None:
+            entry = self._keys.get(key)
+            if entry is None:
+                entry = self._keys[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+
+        task = asyncio.current_task()
+        self._tasks[task] = getattr(event, "update_id", None)
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        UPDATES_WAITING.inc()
+        has_key = has_slot = started = False
+        try:
+            t0 = time.perf_counter()
+            if entry is not None:
+                if entry[0].locked():
+                    UPDATES_DEFERRED.inc("key")
+                await entry[0].acquire()
+                has_key = True
+            t1 = time.perf_counter()
+            if self._slots.locked():
+                UPDATES_DEFERRED.inc("slot")
+            await self._slots.acquire()
+            has_slot = True
+            t2 = time.perf_counter()
+            UPDATE_WAIT_SECONDS.observe(t1 - t0, "key")
+            UPDATE_WAIT_SECONDS.observe(t2 - t1, "slot")
+
+            started = True
+            self.waiting -= 1
+            UPDATES_WAITING.dec()
+            self.in_flight += 1
+            UPDATES_IN_FLIGHT.inc()
+            try:
+                return await handler(event, data)
+            finally:
+                self.in_flight -= 1
+                UPDATES_IN_FLIGHT.dec()
+        finally:
+            self._tasks.pop(task, None)
+            if not started:  # отменён в очереди
+                self.waiting -= 1
+                UPDATES_WAITING.dec()
+            if has_slot:
+                self._slots.release()
+            if has_key:
+                entry[0].release()
+            if entry is not None:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._keys[key]
+
+    async def drain(self, timeout: float) -> tuple[int, list[Optional[int]]]:
+        """
+        Остановка: дождаться апдейтов в обработке и в очереди (новые уже не поступают);
+        не успевшие за timeout — отменить. Возвращает (дождались, update_id брошенных).
+        """
+        current = asyncio.current_task()
+        tasks = {t: uid for t, uid in self._tasks.items() if t is not current}
+        if not tasks:
+            return 0, []
+        done, left = await asyncio.wait(tasks, timeout=timeout)
+        for task in left:
+            task.cancel()
+        if left:
+            await asyncio.wait(left, timeout=1.0)
+        return len(done), sorted((tasks[t] for t in left), key=lambda uid: uid or 0)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "limit": self.limit,
+            "waiting": self.waiting,
+            "peak_waiting": self.peak_waiting,
+            "keys": len(self._keys),
+            "wait_p99": UPDATE_WAIT_SECONDS.quantile(0.99, "key"),
+        }
+
+
+update_scheduler = UpdateScheduler()
@@ -0,0 +1,228 @@
+# outbound.py — единый планировщик исходящих запросов к Bot API (отправки и правки)
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from config import (
+    OUT_GLOBAL_RATE, OUT_PRIVATE_RATE, OUT_PRIVATE_BURST,
+    OUT_GROUP_PER_MIN, OUT_GROUP_BURST, OUT_MAX_RETRIES, log,
+)
+
+# полосы приоритета: меньше — раньше
+LANE_INTERACTIVE = 0   # ответы менеджерам, карточки, релеи
+LANE_BULK = 1          # рассылки
+LANE_NAMES = {LANE_INTERACTIVE: "interactive", LANE_BULK: "bulk"}
+
+_lane: ContextVar[int] = ContextVar("outbound_lane", default=LANE_INTERACTIVE)
+
+# методы, которые пишут в чат и попадают под лимиты Telegram
+_OUTBOUND_PREFIXES = ("Send", "Copy", "Forward", "Edit")
+
+
+@contextlib.contextmanager
+def bulk() -> Iterator[None]:
+    """Все отправки внутри блока идут в полосе bulk и уступают интерактивному трафику."""
+    token = _lane.set(LANE_BULK)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class TokenBucket:
+    """Классический token bucket; reserve() может уводить баланс в минус (очередь ожидания)."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько ждать до появления целого токена (не забирая его)."""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def reserve(self) -> float:
+        """Забрать токен в долг; вернуть, сколько ждать, пока он станет «настоящим»."""
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def block(self, seconds: float) -> None:
+        """Flood wait: не выдавать токены ближайшие seconds секунд."""
+        self._refill(time.monotonic())
+        # следующий reserve() получит ровно seconds ожидания
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    @property
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class OutboundScheduler:
+    """
+    Лимиты Telegram на исходящие:
+      - глобальный bucket (≈30 сообщений/с на бота), выдаётся по приоритету полос;
+      - bucket на чат: ЛС ≈1/с, группы строже (≈20/мин);
+      - retry_after блокирует bucket чата (или глобальный, если чата нет).
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(OUT_GLOBAL_RATE, OUT_GLOBAL_RATE)
+        self._chats: dict[int | str, TokenBucket] = {}
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # метрики
+        self.waiting_chat = {lane: 0 for lane in LANE_NAMES}
+        self.sent = {lane: 0 for lane in LANE_NAMES}
+        self.retry_after_hits = 0
+
+    # ---- per-chat ----
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 5000:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(OUT_GROUP_PER_MIN / 60, OUT_GROUP_BURST)
+            else:
+                bucket = TokenBucket(OUT_PRIVATE_RATE, OUT_PRIVATE_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    # ---- global ----
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._grant_loop())
+
+    async def _grant_loop(self) -> None:
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._global.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():          # ожидающий отменён
+                continue
+            self._global.take()
+            fut.set_result(None)
+
+    async def acquire(self, chat_id: Optional[int | str], lane: int = LANE_INTERACTIVE) -> None:
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay > 0:
+                self.waiting_chat[lane] += 1
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self.waiting_chat[lane] -= 1
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._seq), fut))
+        self._ensure_task()
+        self._wakeup.set()
+        await fut
+        self.sent[lane] += 1
+
+    def on_retry_after(self, chat_id: Optional[int | str], seconds: float) -> None:
+        self.retry_after_hits += 1
+        if chat_id is None:
+            self._global.block(seconds)
+        else:
+            self._chat_bucket(chat_id).block(seconds)
+
+    def stats(self) -> dict:
+        """Глубина очередей и счётчики по полосам."""
+        queued = {lane: 0 for lane in LANE_NAMES}
+        for lane, _, fut in self._waiters:
+            if not fut.done():
+                queued[lane] += 1
+        return {
+            LANE_NAMES[lane]: {
+                "queued_global": queued[lane],
+                "waiting_chat": self.waiting_chat[lane],
+                "sent": self.sent[lane],
+            }
+            for lane in LANE_NAMES
+        } | {"retry_after": self.retry_after_hits, "chat_buckets": len(self._chats)}
+
+    def pending(self) -> int:
+        """Отправок, ждущих глобальный bucket или bucket своего чата."""
+        return sum(1 for _, _, fut in self._waiters if not fut.done()) + sum(self.waiting_chat.values())
+
+    async def drain(self, poll: float = 0.05) -> None:
+        """Остановка: дождаться, пока ждущие лимитов отправки уйдут (до close)."""
+        while self.pending():
+            await asyncio.sleep(poll)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+scheduler = OutboundScheduler()
+
+
+def is_outbound(method: TelegramMethod) -> bool:
+    return type(method).__name__.startswith(_OUTBOUND_PREFIXES)
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    """Пропускает отправки/правки через scheduler и повторяет их после retry_after."""
+
+    def __init__(self, sched: OutboundScheduler = scheduler, max_retries: int = OUT_MAX_RETRIES):
+        self.scheduler = sched
+        self.max_retries = max_retries
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        if not is_outbound(method):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        lane = _lane.get()
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(chat_id, lane)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                self.scheduler.on_retry_after(chat_id, e.retry_after)
+                if attempt > self.max_retries:
+                    raise
+                log.warning("[outbound] %s chat=%s: retry_after=%ss (попытка %s)",
+                            type(method).__name__, chat_id, e.retry_after, attempt)
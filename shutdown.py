@@ -0,0 +1,55 @@
+# shutdown.py — упорядоченная остановка по SIGTERM/SIGINT
+#
+# К моменту вызова приём уже остановлен (polling / вебхук / очередь воркера). Дальше по шагам:
+#   апдейты в обработке -> отложенная работа (альбомы, дайджесты, перерисовки карточек, рассылки)
+#   -> очередь исходящих -> буферы БД (активность чатов, dedup) -> финальный WAL checkpoint.
+# Все шаги делят один дедлайн SHUTDOWN_TIMEOUT; шаг, не уложившийся в остаток, отменяется,
+# и то, что он не успел, попадает в итоговую строку лога как брошенное.
+import asyncio
+import logging
+import time
+from typing import Awaitable, Optional
+
+from config import SHUTDOWN_TIMEOUT, log
+
+
+class ShutdownCoordinator:
+    def __init__(self, timeout: float = SHUTDOWN_TIMEOUT):
+        self.timeout = timeout
+        self._t0 = time.monotonic()
+        self._deadline = self._t0 + timeout
+        self.report: list[tuple[str, float, str]] = []  # (шаг, сек, итог)
+        self.failed = 0
+
+    def start(self) -> None:
+        """Отсчёт дедлайна — с момента, когда приём остановлен."""
+        self._t0 = time.monotonic()
+        self._deadline = self._t0 + self.timeout
+
+    def remaining(self) -> float:
+        return max(0.0, self._deadline - time.monotonic())
+
+    async def step(self, name: str, work: Awaitable[Optional[str]], grace: float = 0.0) -> None:
+        """
+        Выполнить шаг в пределах остатка дедлайна (+ grace для шагов, которые сами
+        укладываются в remaining()). Таймаут или ошибка шага не отменяют следующие шаги.
+        work может вернуть строку-итог («дождались 12, брошено 0»).
+        """
+        t0 = time.monotonic()
+        try:
+            note = await asyncio.wait_for(work, timeout=max(self.remaining(), 0.1) + grace) or "ok"
+        except asyncio.TimeoutError:
+            note = "не успел — брошено"
+            self.failed += 1
+        except Exception as e:
+            log.exception("[shutdown] шаг %s: ошибка", name)
+            note = f"ошибка: {e}"
+            self.failed += 1
+        self.report.append((name, time.monotonic() - t0, note))
+
+    def log_summary(self) -> None:
+        parts = [f"{name} {sec * 1e3:.0f} мс ({note})" for name, sec, note in self.report]
+        log.log(
+            logging.WARNING if self.failed else logging.INFO,
+            "[shutdown] %.1f с из %.1f: %s", time.monotonic() - self._t0, self.timeout, "; ".join(parts),
+        )
@@ -0,0 +1,126 @@
+# update_queue.py — очередь апдейтов между процессом приёма и воркерами (WORKERS > 0)
+#
+# Отдельный файл SQLite (QUEUE_DB_PATH) в WAL: работает без внешних сервисов и переживает
+# рестарт. Приём пишет апдейт с номером шарда, воркер читает только свой шард по возрастанию id
+# и удаляет строки после обработки (at-least-once: необработанное при падении придёт снова).
+import zlib
+from typing import Iterable, Optional
+
+import aiosqlite
+from aiogram.types import Update
+
+from config import QUEUE_DB_PATH, WORKERS
+from middlewares import update_key
+
+QUEUE_SQL = """
+PRAGMA journal_mode=WAL;
+
+CREATE TABLE IF NOT EXISTS update_queue (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,  -- без переиспользования id: курсор воркера только растёт
+    shard     INTEGER NOT NULL,
+    payload   TEXT    NOT NULL,                   -- Update в JSON, как его прислал Telegram
+    queued_ts REAL    NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+);
+CREATE INDEX IF NOT EXISTS idx_queue_shard ON update_queue(shard, id);
+
+-- живые воркеры: кто и когда поднялся (ожидание готовности, /stats)
+CREATE TABLE IF NOT EXISTS queue_workers (
+    shard       INTEGER PRIMARY KEY,
+    pid         INTEGER NOT NULL,
+    started_ts  REAL    NOT NULL
+);
+"""
+
+
+def shard_of(update: Update, shards: int) -> int:
+    """
+    Шард по тому же ключу, что и UpdateScheduler: апдейты одного чата (кнопки карточки —
+    одной заявки) всегда попадают в один процесс, и порядок внутри ключа сохраняется.
+    """
+    key = update_key(update)
+    if key is None:
+        return update.update_id % shards
+    return zlib.crc32(f"{key[0]}:{key[1]}".encode()) % shards
+
+
+class UpdateQueue:
+    def __init__(self, path: str = QUEUE_DB_PATH, shards: int = WORKERS):
+        self.path = path
+        self.shards = max(1, shards)
+        self._db: Optional[aiosqlite.Connection] = None
+
+    async def open(self) -> None:
+        self._db = await aiosqlite.connect(self.path)
+        for pragma in ("PRAGMA busy_timeout=5000;", "PRAGMA synchronous=NORMAL;"):
+            await self._db.execute(pragma)
+        await self._db.executescript(QUEUE_SQL)
+        await self._db.commit()
+
+    async def reshard(self) -> int:
+        """
+        Число воркеров сменилось с прошлого запуска (PRAGMA user_version очереди) —
+        переложить оставшиеся апдейты по новым шардам, пока воркеры не запущены.
+        """
+        cur = await self._db.execute("PRAGMA user_version")
+        if (await cur.fetchone())[0] == self.shards:
+            return 0
+        cur = await self._db.execute("SELECT id, shard, payload FROM update_queue")
+        moved = []
+        for row_id, shard, payload in await cur.fetchall():
+            new = shard_of(Update.model_validate_json(payload), self.shards)
+            if new != shard:
+                moved.append((new, row_id))
+        await self._db.executemany("UPDATE update_queue SET shard=? WHERE id=?", moved)
+        await self._db.execute(f"PRAGMA user_version = {int(self.shards)}")
+        await self._db.commit()
+        return len(moved)
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def put(self, updates: Iterable[Update]) -> int:
+        rows = [
+            (shard_of(u, self.shards), u.model_dump_json(by_alias=True, exclude_unset=True))
+            for u in updates
+        ]
+        await self._db.executemany("INSERT INTO update_queue(shard, payload) VALUES(?,?)", rows)
+        await self._db.commit()
+        return len(rows)
+
+    async def fetch(self, shard: int, after_id: int, limit: int) -> list[tuple[int, str]]:
+        """[(id, payload)] шарда с id > after_id по порядку поступления."""
+        cur = await self._db.execute(
+            "SELECT id, payload FROM update_queue WHERE shard=? AND id>? ORDER BY id LIMIT ?",
+            (shard, after_id, limit),
+        )
+        return await cur.fetchall()
+
+    async def ack(self, ids: list[int]) -> None:
+        """Удалить обработанные строки."""
+        if not ids:
+            return
+        await self._db.executemany("DELETE FROM update_queue WHERE id=?", [(i,) for i in ids])
+        await self._db.commit()
+
+    async def depth(self) -> dict[int, int]:
+        """{шард: апдейтов в очереди}."""
+        cur = await self._db.execute("SELECT shard, count(*) FROM update_queue GROUP BY shard")
+        return dict(await cur.fetchall())
+
+    async def register_worker(self, shard: int, pid: int, started_ts: float) -> None:
+        await self._db.execute(
+            "INSERT OR REPLACE INTO queue_workers(shard, pid, started_ts) VALUES(?,?,?)",
+            (shard, pid, started_ts),
+        )
+        await self._db.commit()
+
+    async def workers(self) -> dict[int, tuple[int, float]]:
+        """{шард: (pid, время старта)}."""
+        cur = await self._db.execute("SELECT shard, pid, started_ts FROM queue_workers")
+        return {r[0]: (r[1], r[2]) for r in await cur.fetchall()}
+
+    async def clear_workers(self) -> None:
+        await self._db.execute("DELETE FROM queue_workers")
+        await self._db.commit()
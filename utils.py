@@ -49,6 +49,16 @@ def escape_html(s: str | None) -> str:
     return _html_escape(str(s), quote=False)
 
 
+def message_link(chat_id: int, username: Optional[str], message_id: int) -> Optional[str]:
+    """Ссылка t.me на сообщение группы: публичной — по @username, супергруппы — через /c/; у обычной группы ссылок нет."""
+    if username:
+        return f"https://t.me/{username}/{message_id}"
+    s = str(chat_id)
+    if s.startswith("-100"):
+        return f"https://t.me/c/{s[4:]}/{message_id}"
+    return None
+
+
 # --- Функция для редактирования сообщения
 async def edit_message(bot: Bot, chat_id: int, msg_id: int, text: str ):
     await bot.edit_message_text(
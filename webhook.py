@@ -0,0 +1,126 @@
+# webhook.py — приём апдейтов через вебхук (альтернатива long polling)
+import asyncio
+import contextlib
+import hmac
+import signal
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from config import (
+    ALLOWED_UPDATES, WEBHOOK_BASE_URL, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT,
+    WEBHOOK_SECRET, WEBHOOK_DRAIN_TIMEOUT, log,
+)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    aiohttp-сервер: проверяет секрет, сразу отвечает 200 и обрабатывает апдейт
+    в фоне через Dispatcher.feed_webhook_update. С queue (WORKERS > 0) апдейт только
+    записывается в очередь воркеров, и 200 уходит после commit.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: Optional[str] = WEBHOOK_SECRET,
+                 path: str = WEBHOOK_PATH, queue=None):
+        self.dp = dp
+        self.bot = bot
+        self.queue = queue
+        self.secret = secret or None
+        self.path = path
+        self.accepting = True
+        self.received = 0
+        self._tasks: set[asyncio.Task] = set()
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if not self.accepting:
+            # Telegram повторит доставку позже — апдейт не потеряется
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        self.received += 1
+        if self.queue is not None:
+            try:
+                update = Update.model_validate(data, context={"bot": self.bot})
+            except ValueError:
+                return web.Response(status=400)
+            await self.queue.put([update])
+            return web.Response()
+        task = asyncio.create_task(self._process(data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, data: dict) -> None:
+        try:
+            await self.dp.feed_webhook_update(self.bot, data)
+        except Exception:
+            log.exception("[webhook] ошибка обработки апдейта %s", data.get("update_id"))
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> None:
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        log.info("[webhook] слушаю %s:%s%s", host, port, self.path)
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT) -> int:
+        """Перестать принимать апдейты и дождаться фоновых обработчиков. Возвращает число брошенных."""
+        self.accepting = False
+        pending = set(self._tasks)
+        if pending:
+            _, pending = await asyncio.wait(pending, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        return len(pending)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, queue=None) -> None:
+    """Режим RUN_MODE=webhook: регистрирует вебхук и работает до SIGTERM/SIGINT."""
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("RUN_MODE=webhook требует WEBHOOK_BASE_URL")
+
+    server = WebhookServer(dp, bot, queue=queue)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    await server.start()
+    try:
+        await bot.set_webhook(
+            url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=ALLOWED_UPDATES,
+            drop_pending_updates=False,
+        )
+        await stop.wait()
+    finally:
+        abandoned = await server.drain()
+        log.info("[webhook] остановка: принято %s, брошено при остановке %s", server.received, abandoned)
+        await server.stop()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
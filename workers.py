@@ -0,0 +1,197 @@
+# workers.py — многопроцессный режим (WORKERS > 0): один процесс приёма, N процессов обработки
+#
+#   WORKERS=4 python app.py                     # приём (RUN_MODE polling|webhook) + 4 воркера
+#   python -m app --worker 2 --shards 4         # так WorkerPool запускает каждый воркер
+#
+# Приём не разбирает апдейты хендлерами — только кладёт их в update_queue (SQLite) с номером
+# шарда по update_key. Воркер — обычный бот (свой Dispatcher из handlers.setup_all, свой пул БД),
+# который берёт апдейты своего шарда по порядку; внутри процесса их упорядочивает UpdateScheduler.
+# Фоновые задачи (бэкап, архив) остаются в процессе приёма, докачка рассылок — в воркере 0.
+import asyncio
+import contextlib
+import json
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramNetworkError
+
+from config import (
+    ALLOWED_UPDATES, OUT_GLOBAL_RATE, POLLING_TIMEOUT, QUEUE_MAX_DEPTH, QUEUE_POLL_INTERVAL,
+    UPDATE_MAX_PENDING, WORKER_DRAIN_TIMEOUT, log,
+)
+from update_queue import UpdateQueue
+
+_ROOT = Path(__file__).resolve().parent
+
+
+def stop_event() -> asyncio.Event:
+    """Event, который выставят SIGTERM/SIGINT (остановка процесса приёма или воркера)."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    return stop
+
+
+# ------------------------- ПРИЁМ -------------------------
+async def ingest_polling(bot: Bot, queue: UpdateQueue, stop: asyncio.Event) -> None:
+    """
+    Long polling в очередь. offset сдвигается только после commit в очередь:
+    упавший между getUpdates и записью процесс получит те же апдейты снова.
+    """
+    offset: Optional[int] = None
+    backoff = 1.0
+    while not stop.is_set():
+        if sum((await queue.depth()).values()) > QUEUE_MAX_DEPTH:
+            # воркеры не успевают — апдейты подождут у Telegram, а не в памяти/на диске
+            await asyncio.sleep(0.5)
+            continue
+        getter = asyncio.ensure_future(bot.get_updates(
+            offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=ALLOWED_UPDATES,
+            request_timeout=POLLING_TIMEOUT + 10,
+        ))
+        stopper = asyncio.ensure_future(stop.wait())
+        await asyncio.wait({getter, stopper}, return_when=asyncio.FIRST_COMPLETED)
+        stopper.cancel()
+        if not getter.done():
+            getter.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await getter
+            break
+        try:
+            updates = getter.result()
+        except TelegramNetworkError as e:
+            log.warning("[ingest] getUpdates: %s, повтор через %.0f с", e, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            continue
+        backoff = 1.0
+        if updates:
+            await queue.put(updates)
+            offset = updates[-1].update_id + 1
+
+
+# ------------------------- ВОРКЕР -------------------------
+async def consume_queue(dp: Dispatcher, bot: Bot, queue: UpdateQueue, shard: int, stop: asyncio.Event,
+                        max_pending: int = UPDATE_MAX_PENDING) -> None:
+    """
+    Разбор своего шарда: задача на апдейт в порядке id (как polling — дальше порядок внутри
+    чата держит UpdateScheduler), не больше max_pending в памяти; обработанные удаляются
+    из очереди пачками. При остановке дорабатывает начатое до WORKER_DRAIN_TIMEOUT.
+    """
+    cursor = 0
+    pending: set[asyncio.Task] = set()
+    done: list[int] = []
+
+    async def process(row_id: int, payload: str) -> None:
+        try:
+            await dp.feed_raw_update(bot, json.loads(payload))
+        except Exception:
+            log.exception("[worker %s] ошибка обработки апдейта (строка очереди %s)", shard, row_id)
+        finally:
+            done.append(row_id)
+
+    while not stop.is_set():
+        if done:
+            acked, done[:] = done[:], []
+            await queue.ack(acked)
+        if len(pending) >= max_pending:
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            continue
+        rows = await queue.fetch(shard, cursor, min(100, max_pending - len(pending)))
+        if not rows:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop.wait(), QUEUE_POLL_INTERVAL)
+            continue
+        for row_id, payload in rows:
+            cursor = row_id
+            task = asyncio.create_task(process(row_id, payload))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+    if pending:
+        started = set(pending)
+        _, left = await asyncio.wait(started, timeout=WORKER_DRAIN_TIMEOUT)
+        for task in left:
+            task.cancel()
+        log.info("[worker %s] остановка: дообработано %s, брошено %s (вернутся из очереди)",
+                 shard, len(started) - len(left), len(left))
+    await queue.ack(done)
+
+
+# ------------------------- СУПЕРВИЗОР -------------------------
+class WorkerPool:
+    """Запускает воркеры отдельными процессами и перезапускает упавшие."""
+
+    def __init__(self, count: int):
+        self.count = count
+        self._procs: dict[int, asyncio.subprocess.Process] = {}
+        self._watchers: list[asyncio.Task] = []
+        self._stopping = False
+
+    def _env(self) -> dict:
+        env = dict(os.environ)
+        env["WORKERS"] = str(self.count)
+        # кэши горячих таблиц — в памяти процесса, а пишут их разные шарды: в воркерах без кэша
+        env["CACHE_TTL"] = "0"
+        # глобальный лимит Telegram — на бота, делим между процессами
+        env["OUT_GLOBAL_RATE"] = str(OUT_GLOBAL_RATE / self.count)
+        return env
+
+    async def _spawn(self, shard: int) -> asyncio.subprocess.Process:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "app", "--worker", str(shard), "--shards", str(self.count),
+            cwd=str(_ROOT), env=self._env(),
+        )
+        self._procs[shard] = proc
+        log.info("[workers] воркер %s запущен, pid=%s", shard, proc.pid)
+        return proc
+
+    async def _watch(self, shard: int) -> None:
+        proc = self._procs[shard]
+        while True:
+            code = await proc.wait()
+            if self._stopping:
+                return
+            log.warning("[workers] воркер %s (pid=%s) завершился с кодом %s — перезапуск", shard, proc.pid, code)
+            await asyncio.sleep(1.0)
+            proc = await self._spawn(shard)
+
+    async def start(self) -> None:
+        for shard in range(self.count):
+            await self._spawn(shard)
+            self._watchers.append(asyncio.create_task(self._watch(shard)))
+
+    async def wait_ready(self, queue: UpdateQueue, timeout: float = 60.0) -> bool:
+        """Дождаться, пока все воркеры отметятся в очереди (бенчмарки, старт)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            workers = await queue.workers()
+            if all(workers.get(s, (None,))[0] == p.pid for s, p in self._procs.items()):
+                return True
+            await asyncio.sleep(0.1)
+        return False
+
+    async def stop(self) -> None:
+        """SIGTERM всем, ждём дообработки, оставшихся — kill."""
+        self._stopping = True
+        for task in self._watchers:
+            task.cancel()
+        for proc in self._procs.values():
+            if proc.returncode is None:
+                with contextlib.suppress(ProcessLookupError):
+                    proc.send_signal(signal.SIGTERM)
+        for shard, proc in self._procs.items():
+            try:
+                await asyncio.wait_for(proc.wait(), WORKER_DRAIN_TIMEOUT + 5)
+            except asyncio.TimeoutError:
+                log.warning("[workers] воркер %s не остановился вовремя — kill", shard)
+                with contextlib.suppress(ProcessLookupError):
+                    proc.kill()
+                await proc.wait()